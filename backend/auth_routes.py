@@ -3,11 +3,12 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
 from typing import Optional
-import bcrypt
 import os
 from pydantic import BaseModel
 from models import LoginRequest, LoginResponse, User, SuccessResponse, UserWithDetails
-from database_utils import run_postgres_query
+from database_async import db
+from utils.cache import TTLCache
+from password_hashing import verify_password, password_hasher
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
@@ -19,6 +20,12 @@ SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 1440))
 
+# Resolved principals, keyed by (user_id, token). Entries are dropped explicitly
+# when a user is changed; the TTL bounds staleness across uvicorn workers.
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", 60))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", 10000))
+principal_cache = TTLCache(maxsize=PRINCIPAL_CACHE_MAX_ENTRIES, ttl=PRINCIPAL_CACHE_TTL_SECONDS)
+
 class TokenData(BaseModel):
     username: str
     user_id: int
@@ -78,7 +85,20 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
 
-def get_current_user(token_data: TokenData = Depends(verify_token)):
+def invalidate_user_cache(user_id: int):
+    """Forget every cached principal of a user (call after changing or deleting it)"""
+    principal_cache.discard_where(lambda key: key[0] == user_id)
+
+
+async def get_current_user(
+    token_data: TokenData = Depends(verify_token),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    cache_key = (token_data.user_id, credentials.credentials)
+    cached = principal_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     query = """
         SELECT
             u.id,
@@ -93,15 +113,16 @@ def get_current_user(token_data: TokenData = Depends(verify_token)):
         FROM users u
         LEFT JOIN organizations o ON u.org_id = o.id
         LEFT JOIN roles r ON u.role_id = r.id
-        WHERE u.username = %s OR u.email = %s
+        WHERE u.id = %s
     """
 
-    result = run_postgres_query(query, (token_data.username, token_data.username))
-
-    if result and result.get("success") and result.get("data"):
-        row = result["data"][0]
+    try:
+        row = await db.fetchrow(query, (token_data.user_id,))
+    except Exception:
+        row = None
 
-        return UserResponse(
+    if row:
+        user = UserResponse(
             id=row["id"],
             username=row["username"],
             email=row["email"],
@@ -112,6 +133,8 @@ def get_current_user(token_data: TokenData = Depends(verify_token)):
             role_name=row.get("role_name"),
             is_active=row.get("is_active", True)
         )
+        principal_cache.set(cache_key, user)
+        return user
 
     raise HTTPException(status_code=401, detail="User not found or inactive")
 
@@ -153,16 +176,17 @@ async def login(login_request: LoginRequest):
 
     query += " LIMIT 1;"
 
-    result = run_postgres_query(query, tuple(params))
+    try:
+        user = await db.fetchrow(query, tuple(params))
+    except Exception:
+        user = None
 
-    if not result or not result.get("success") or not result.get("data"):
+    if not user:
         raise HTTPException(status_code=401, detail="User not found with the specified credentials")
 
-    user = result["data"][0]
-
     stored_hash = user["password"]
 
-    if not bcrypt.checkpw(login_request.password.encode("utf-8"), stored_hash.encode("utf-8")):
+    if not await verify_password(login_request.password, stored_hash):
         raise HTTPException(status_code=401, detail="Invalid password")
 
     # Check if user is active
@@ -214,11 +238,14 @@ async def get_current_user_info(current_user: UserResponse = Depends(get_current
 async def get_organizations():
     """Get all organizations"""
     query = "SELECT id, name FROM public.organizations ORDER BY name"
-    result = run_postgres_query(query)
+    try:
+        rows = await db.fetch(query)
+    except Exception:
+        rows = None
 
-    if result and result.get("success"):
+    if rows is not None:
         # Convert RealDictRow to regular dict
-        organizations = [dict(row) for row in result.get("data", [])]
+        organizations = [dict(row) for row in rows]
         return {
             "success": True,
             "organizations": organizations
@@ -231,11 +258,14 @@ async def get_organizations():
 async def get_roles():
     """Get all roles"""
     query = "SELECT id, role_name, description FROM public.roles ORDER BY id"
-    result = run_postgres_query(query)
+    try:
+        rows = await db.fetch(query)
+    except Exception:
+        rows = None
 
-    if result and result.get("success"):
+    if rows is not None:
         # Convert RealDictRow to regular dict
-        roles = [dict(row) for row in result.get("data", [])]
+        roles = [dict(row) for row in rows]
         return {
             "success": True,
             "roles": roles
@@ -251,4 +281,9 @@ async def verify_user_token(current_user: UserResponse = Depends(get_current_use
 
 @router.get("/health")
 async def auth_health_check():
-    return {"status": "healthy", "service": "authentication"}
\ No newline at end of file
+    return {
+        "status": "healthy",
+        "service": "authentication",
+        "principal_cache": principal_cache.stats(),
+        "password_hasher": password_hasher.stats()
+    }
\ No newline at end of file
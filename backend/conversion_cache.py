@@ -0,0 +1,148 @@
+# Conversion Result Cache
+#
+# Converted files are kept on disk keyed by (SHA-256 of the input, target
+# format, converter version), so converting the same document again is a
+# file copy. The cache is bounded to CONVERSION_CACHE_MAX_BYTES, evicting the
+# least recently used results first. Changing the converter version (e.g.
+# upgrading pdf2docx) naturally misses the old entries, which then age out.
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+
+from starlette.concurrency import run_in_threadpool
+
+CONVERSION_CACHE_DIR = os.getenv(
+    "CONVERSION_CACHE_DIR", os.path.join(tempfile.gettempdir(), "matterai_conversion_cache")
+)
+CONVERSION_CACHE_MAX_BYTES = int(os.getenv("CONVERSION_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+CONVERSION_CACHE_ENABLED = os.getenv("CONVERSION_CACHE_ENABLED", "true").lower() == "true"
+
+
+def _link_or_copy(source: str, target: str):
+    """Hard-link when possible (same filesystem), copy otherwise"""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+class ConversionCache:
+    def __init__(self, directory: str = CONVERSION_CACHE_DIR, max_bytes: int = CONVERSION_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._index = None  # OrderedDict path -> size, least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(input_sha256: str, target_format: str, converter_version: str) -> str:
+        return hashlib.sha256(f"{input_sha256}:{target_format}:{converter_version}".encode()).hexdigest()
+
+    def _path(self, key: str, target_format: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.{target_format}")
+
+    def _load_index(self):
+        """Rebuild the LRU index from disk, oldest access first (once per process)"""
+        if self._index is not None:
+            return
+        entries = []
+        os.makedirs(self.directory, exist_ok=True)
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                if name.endswith(".tmp"):
+                    continue
+                try:
+                    stat_result = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat_result.st_mtime, path, stat_result.st_size))
+        entries.sort()
+        self._index = OrderedDict((path, size) for _, path, size in entries)
+        self._bytes = sum(size for _, _, size in entries)
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._index:
+            path, size = self._index.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _get(self, key: str, target_format: str, target_path: str) -> bool:
+        path = self._path(key, target_format)
+        with self._lock:
+            self._load_index()
+            try:
+                _link_or_copy(path, target_path)
+            except FileNotFoundError:
+                # Evicted (possibly by another process)
+                size = self._index.pop(path, None)
+                if size is not None:
+                    self._bytes -= size
+                self.misses += 1
+                return False
+            # mtime doubles as the last-access time for the LRU order on restart
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            if path not in self._index:
+                self._index[path] = os.path.getsize(path)
+                self._bytes += self._index[path]
+            self._index.move_to_end(path)
+            self.hits += 1
+            return True
+
+    def _put(self, key: str, target_format: str, source_path: str):
+        path = self._path(key, target_format)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        _link_or_copy(source_path, tmp_path)
+        size = os.path.getsize(tmp_path)
+        with self._lock:
+            self._load_index()
+            os.replace(tmp_path, path)
+            self._bytes += size - self._index.pop(path, 0)
+            self._index[path] = size
+            self.stores += 1
+            self._evict()
+
+    async def get(self, key: str, target_format: str, target_path: str) -> bool:
+        """Place the cached result at target_path; False on a miss"""
+        return await run_in_threadpool(self._get, key, target_format, target_path)
+
+    async def put(self, key: str, target_format: str, source_path: str):
+        """Store a converted file (failures only cost a future cache miss)"""
+        try:
+            await run_in_threadpool(self._put, key, target_format, source_path)
+        except OSError as e:
+            print(f"⚠️ Could not cache conversion result: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": CONVERSION_CACHE_ENABLED,
+            "entries": len(self._index) if self._index is not None else None,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "stores": self.stores,
+            "evictions": self.evictions,
+        }
+
+
+conversion_cache = ConversionCache()
@@ -0,0 +1,241 @@
+# Asynchronous File Conversion Jobs
+#
+# A submitted conversion returns a job id straight away; the work runs in the
+# background with at most CONVERSION_JOB_CONCURRENCY jobs converting at once.
+# Job state follows the translation API the frontend already polls
+# (HomeLogic.pollJobStatus): status is PENDING / PROCESSING / COMPLETED /
+# FAILED / CANCELLED, and a completed job carries a download_id.
+#
+# Results are kept on disk for CONVERSION_JOB_RETENTION_SECONDS after the job
+# finishes. Jobs live in this process, so with several workers the status and
+# download requests must reach the worker that accepted the job.
+
+import asyncio
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime
+
+CONVERSION_JOB_CONCURRENCY = int(os.getenv("CONVERSION_JOB_CONCURRENCY", 2))
+# Jobs waiting for a slot beyond this are rejected
+CONVERSION_JOB_MAX_PENDING = int(os.getenv("CONVERSION_JOB_MAX_PENDING", 50))
+CONVERSION_JOB_RETENTION_SECONDS = float(os.getenv("CONVERSION_JOB_RETENTION_SECONDS", 3600))
+CONVERSION_JOB_PURGE_INTERVAL_SECONDS = 60
+
+PENDING = "PENDING"
+PROCESSING = "PROCESSING"
+COMPLETED = "COMPLETED"
+FAILED = "FAILED"
+CANCELLED = "CANCELLED"
+TERMINAL_STATES = (COMPLETED, FAILED, CANCELLED)
+
+PUBLIC_FIELDS = (
+    "job_id", "status", "progress", "filename", "target_format", "output_filename",
+    "download_id", "error", "created_at", "started_at", "completed_at", "expires_at"
+)
+
+
+class ConversionQueueFull(Exception):
+    """Raised when too many conversion jobs are waiting"""
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+class ConversionJobManager:
+    def __init__(self, concurrency: int = CONVERSION_JOB_CONCURRENCY,
+                 max_pending: int = CONVERSION_JOB_MAX_PENDING,
+                 retention: float = CONVERSION_JOB_RETENTION_SECONDS):
+        self.max_pending = max_pending
+        self.retention = retention
+        self._slots = asyncio.Semaphore(concurrency)
+        self._jobs = {}
+        self._tasks = {}
+        self._listeners = {}
+        self._cleanups = set()
+        self._last_purge = 0.0
+
+    # ------------------------------------------------------------
+    #  State
+    # ------------------------------------------------------------
+    def _update(self, job: dict, **changes):
+        job.update(changes)
+        job["updated_at"] = _now()
+        snapshot = self.public(job)
+        for queue in self._listeners.get(job["job_id"], ()):
+            queue.put_nowait(snapshot)
+
+    def public(self, job: dict) -> dict:
+        return {field: job.get(field) for field in PUBLIC_FIELDS}
+
+    def get(self, job_id: str):
+        self._maybe_purge()
+        job = self._jobs.get(job_id)
+        if job is None or (job["expires_at_ts"] and job["expires_at_ts"] < time.time()):
+            return None
+        return job
+
+    def pending_count(self) -> int:
+        return sum(1 for job in self._jobs.values() if job["status"] == PENDING)
+
+    # ------------------------------------------------------------
+    #  Running
+    # ------------------------------------------------------------
+    def submit(self, input_path: str, work_dir: str, filename: str, target_format: str,
+               runner, cleanup=None) -> dict:
+        """
+        Queue a conversion. runner(input_path, work_dir, target_format) is an
+        async callable returning the output path. work_dir is owned by the job
+        from now on and removed when the job expires, by awaiting cleanup()
+        when given.
+        """
+        self._maybe_purge()
+        if self.pending_count() >= self.max_pending:
+            raise ConversionQueueFull("Too many conversions queued, try again later")
+
+        job_id = str(uuid.uuid4())
+        job = {
+            "job_id": job_id,
+            "status": PENDING,
+            "progress": 0,
+            "filename": filename,
+            "target_format": target_format,
+            "output_filename": None,
+            "download_id": None,
+            "error": None,
+            "created_at": _now(),
+            "started_at": None,
+            "completed_at": None,
+            "expires_at": None,
+            "expires_at_ts": None,
+            "work_dir": work_dir,
+            "cleanup": cleanup,
+            "output_path": None,
+        }
+        self._jobs[job_id] = job
+
+        task = asyncio.ensure_future(self._run(job, input_path, runner))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+        return job
+
+    async def _run(self, job: dict, input_path: str, runner):
+        try:
+            async with self._slots:
+                self._update(job, status=PROCESSING, progress=10, started_at=_now())
+                output_path = await runner(input_path, job["work_dir"], job["target_format"])
+            self._update(
+                job,
+                status=COMPLETED,
+                progress=100,
+                output_path=output_path,
+                output_filename=os.path.basename(output_path),
+                download_id=job["job_id"],
+                **self._finished()
+            )
+        except asyncio.CancelledError:
+            self._update(job, status=CANCELLED, **self._finished())
+            # Nothing to download, so free the disk space right away
+            self._release_work_dir(job)
+        except Exception as e:
+            print(f"❌ Conversion job {job['job_id']} failed: {e}")
+            self._update(job, status=FAILED, error=str(e), **self._finished())
+            self._release_work_dir(job)
+
+    def _finished(self) -> dict:
+        expires_at_ts = time.time() + self.retention
+        return {
+            "completed_at": _now(),
+            "expires_at_ts": expires_at_ts,
+            "expires_at": datetime.utcfromtimestamp(expires_at_ts).isoformat(),
+        }
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a running job, or discard a finished one and its result"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return False
+        task = self._tasks.get(job_id)
+        if task is not None:
+            task.cancel()
+        else:
+            self._discard(job_id)
+        return True
+
+    # ------------------------------------------------------------
+    #  Events
+    # ------------------------------------------------------------
+    async def events(self, job_id: str, heartbeat: float = 15.0):
+        """
+        Yield the job's public state now and after every change, or None every
+        `heartbeat` seconds without one; stops after a terminal state.
+        """
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        queue = asyncio.Queue()
+        self._listeners.setdefault(job_id, []).append(queue)
+        try:
+            snapshot = self.public(job)
+            yield snapshot
+            while snapshot["status"] not in TERMINAL_STATES:
+                try:
+                    snapshot = await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield snapshot
+        finally:
+            listeners = self._listeners.get(job_id, [])
+            if queue in listeners:
+                listeners.remove(queue)
+            if not listeners:
+                self._listeners.pop(job_id, None)
+
+    # ------------------------------------------------------------
+    #  Retention
+    # ------------------------------------------------------------
+    def _release_work_dir(self, job: dict):
+        if job.get("work_dir_released"):
+            return
+        job["work_dir_released"] = True
+        if job["cleanup"] is None:
+            shutil.rmtree(job["work_dir"], ignore_errors=True)
+            return
+        task = asyncio.ensure_future(job["cleanup"]())
+        self._cleanups.add(task)
+        task.add_done_callback(self._cleanups.discard)
+
+    def _discard(self, job_id: str):
+        job = self._jobs.pop(job_id, None)
+        if job is not None:
+            self._release_work_dir(job)
+
+    def _maybe_purge(self):
+        now = time.monotonic()
+        if now - self._last_purge < CONVERSION_JOB_PURGE_INTERVAL_SECONDS:
+            return
+        self._last_purge = now
+        wall_now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job["expires_at_ts"] and job["expires_at_ts"] < wall_now:
+                self._discard(job_id)
+
+    async def close(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        for job_id in list(self._jobs):
+            self._discard(job_id)
+        await asyncio.gather(*self._cleanups, return_exceptions=True)
+
+    def stats(self) -> dict:
+        counts = {}
+        for job in self._jobs.values():
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return {"jobs": len(self._jobs), "by_status": counts}
+
+
+conversion_jobs = ConversionJobManager()
@@ -0,0 +1,213 @@
+# Async PostgreSQL Query API for the FastAPI routers
+#
+# psycopg2 is a blocking driver, so every query is executed on a dedicated
+# thread pool. Route handlers `await` the result instead of blocking the event
+# loop, and a single uvicorn worker can keep up to POSTGRES_POOL_MAX_SIZE
+# queries in flight at once.
+#
+# Borrowers wait for a connection on an asyncio semaphore sized to the pool,
+# not inside an executor thread, so a burst of queries can never occupy every
+# thread while transactions that already hold connections need one to run
+# their next statement. Connections are returned on a separate executor for
+# the same reason.
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from psycopg2.extras import RealDictCursor
+
+from database_pool import get_pool, PoolTimeout
+
+
+class AsyncConnection:
+    """
+    A pooled connection bound to one request / transaction.
+    With autocommit=True every statement is committed as soon as it finishes.
+    """
+
+    def __init__(self, database, conn, autocommit=True):
+        self._database = database
+        self._conn = conn
+        self._autocommit = autocommit
+
+    @property
+    def raw(self):
+        """The underlying psycopg2 connection (only use it from run())"""
+        return self._conn
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn(conn, *args, **kwargs) on the database executor"""
+        return await self._database.run_in_executor(fn, self._conn, *args, **kwargs)
+
+    def _execute(self, conn, query, params, mode):
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(query, params or ())
+            if mode == "fetch":
+                result = cursor.fetchall() if cursor.description else []
+            elif mode == "fetchrow":
+                result = cursor.fetchone() if cursor.description else None
+            elif mode == "fetchval":
+                row = cursor.fetchone() if cursor.description else None
+                result = next(iter(row.values())) if row else None
+            else:
+                result = cursor.rowcount
+        if self._autocommit:
+            conn.commit()
+        return result
+
+    def _executemany(self, conn, query, params_seq):
+        with conn.cursor() as cursor:
+            cursor.executemany(query, params_seq)
+            result = cursor.rowcount
+        if self._autocommit:
+            conn.commit()
+        return result
+
+    async def fetch(self, query, params=None):
+        """Return all rows as a list of dicts"""
+        return await self.run(self._execute, query, params, "fetch")
+
+    async def fetchrow(self, query, params=None):
+        """Return the first row as a dict, or None"""
+        return await self.run(self._execute, query, params, "fetchrow")
+
+    async def fetchval(self, query, params=None):
+        """Return the first column of the first row, or None"""
+        return await self.run(self._execute, query, params, "fetchval")
+
+    async def execute(self, query, params=None):
+        """Execute a statement and return the affected row count"""
+        return await self.run(self._execute, query, params, "execute")
+
+    async def executemany(self, query, params_seq):
+        return await self.run(self._executemany, query, params_seq)
+
+
+class AsyncDatabase:
+    """
+    Async facade over the shared psycopg2 connection pool.
+
+        rows = await db.fetch("SELECT * FROM users WHERE org_id = %s", (org_id,))
+        row = await db.fetchrow("SELECT * FROM users WHERE id = %s", (user_id,))
+        count = await db.execute("DELETE FROM users WHERE id = %s", (user_id,))
+
+        async with db.transaction() as conn:
+            await conn.execute(...)
+            await conn.execute(...)
+    """
+
+    def __init__(self, pool_getter=get_pool):
+        self._pool_getter = pool_getter
+        self._executor = None
+        self._release_executor = None
+        self._slots = None
+
+    @property
+    def pool(self):
+        return self._pool_getter()
+
+    def _get_executor(self):
+        if self._executor is None:
+            # A thread per connection this facade can hold, plus headroom for
+            # synchronous pool users (database_utils) sharing the same pool
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.pool.max_size * 2,
+                thread_name_prefix="db"
+            )
+        return self._executor
+
+    def _get_release_executor(self):
+        if self._release_executor is None:
+            self._release_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="db-release")
+        return self._release_executor
+
+    async def run_in_executor(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._get_executor(), functools.partial(fn, *args, **kwargs)
+        )
+
+    @asynccontextmanager
+    async def _connection_slot(self):
+        """Wait (without holding a thread) until a pooled connection is ours to take"""
+        pool = self.pool
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(pool.max_size)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), pool.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeout(f"No database connection available within {pool.acquire_timeout:.1f}s")
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    @asynccontextmanager
+    async def acquire(self, autocommit=True):
+        """Borrow one connection for several statements"""
+        pool = self.pool
+        async with self._connection_slot():
+            conn = await self.run_in_executor(pool.getconn)
+            try:
+                yield AsyncConnection(self, conn, autocommit=autocommit)
+            finally:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(
+                    self._get_release_executor(),
+                    functools.partial(pool.putconn, conn, close=conn.closed != 0)
+                )
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Borrow one connection and commit on success / roll back on error"""
+        async with self.acquire(autocommit=False) as conn:
+            try:
+                yield conn
+            except BaseException:
+                await conn.run(lambda c: c.rollback())
+                raise
+            else:
+                await conn.run(lambda c: c.commit())
+
+    def _run_pooled(self, fn, *args):
+        """Borrow, use and return a connection in a single executor hop"""
+        pool = self.pool
+        conn = pool.getconn()
+        try:
+            return fn(AsyncConnection(self, conn), conn, *args)
+        finally:
+            pool.putconn(conn, close=conn.closed != 0)
+
+    async def fetch(self, query, params=None):
+        async with self._connection_slot():
+            return await self.run_in_executor(self._run_pooled, AsyncConnection._execute, query, params, "fetch")
+
+    async def fetchrow(self, query, params=None):
+        async with self._connection_slot():
+            return await self.run_in_executor(self._run_pooled, AsyncConnection._execute, query, params, "fetchrow")
+
+    async def fetchval(self, query, params=None):
+        async with self._connection_slot():
+            return await self.run_in_executor(self._run_pooled, AsyncConnection._execute, query, params, "fetchval")
+
+    async def execute(self, query, params=None):
+        async with self._connection_slot():
+            return await self.run_in_executor(self._run_pooled, AsyncConnection._execute, query, params, "execute")
+
+    async def executemany(self, query, params_seq):
+        async with self._connection_slot():
+            return await self.run_in_executor(self._run_pooled, AsyncConnection._executemany, query, params_seq)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self._release_executor is not None:
+            self._release_executor.shutdown(wait=False)
+            self._release_executor = None
+
+
+# Shared instance used by all routers
+db = AsyncDatabase()
@@ -0,0 +1,280 @@
+# PostgreSQL Connection Pool
+
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+from database_setup import get_connection
+
+# Pool config
+POOL_CONFIG = {
+    "min_size": int(os.getenv("POSTGRES_POOL_MIN_SIZE", 2)),
+    "max_size": int(os.getenv("POSTGRES_POOL_MAX_SIZE", 20)),
+    # Seconds to wait for a free connection before giving up
+    "acquire_timeout": float(os.getenv("POSTGRES_POOL_ACQUIRE_TIMEOUT", 10)),
+    # Connections idle longer than this are closed (down to min_size)
+    "max_idle": float(os.getenv("POSTGRES_POOL_MAX_IDLE", 300)),
+    # Connections older than this are recycled on return
+    "max_lifetime": float(os.getenv("POSTGRES_POOL_MAX_LIFETIME", 3600)),
+    # Idle connections unused for this long are pinged before being handed out
+    "health_check_after": float(os.getenv("POSTGRES_POOL_HEALTH_CHECK_AFTER", 30)),
+}
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within acquire_timeout"""
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """
+    Thread-safe psycopg2 connection pool.
+
+    - Keeps between min_size and max_size open connections
+    - Pings stale idle connections before handing them out (health-check-on-borrow)
+    - Closes connections idle for longer than max_idle (idle reaping)
+    - Rolls back / discards broken connections when they are returned
+    """
+
+    def __init__(self, connect=get_connection, min_size=2, max_size=20, acquire_timeout=10.0,
+                 max_idle=300.0, max_lifetime=3600.0, health_check_after=30.0):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size: require 0 <= min_size <= max_size and max_size >= 1")
+
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+
+        self._idle = deque()
+        self._in_use = {}
+        self._lock = threading.Condition()
+        self._closed = False
+        self._last_reap = time.monotonic()
+
+        self._stats = {
+            "connections_created": 0,
+            "connections_closed": 0,
+            "acquired": 0,
+            "released": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "health_check_failures": 0,
+            "reaped": 0,
+        }
+
+    # ------------------------------------------------------------
+    #  Connection lifecycle
+    # ------------------------------------------------------------
+    def _open(self):
+        conn = self._connect()
+        if conn is None:
+            raise psycopg2.OperationalError("Failed to connect to database")
+        self._stats["connections_created"] += 1
+        return _PooledConnection(conn)
+
+    def _close(self, pooled):
+        self._stats["connections_closed"] += 1
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, pooled):
+        conn = pooled.conn
+        if conn.closed:
+            return False
+        if time.monotonic() - pooled.last_used < self.health_check_after:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _reap_idle(self):
+        """Close idle connections above min_size that have not been used for max_idle seconds"""
+        now = time.monotonic()
+        self._last_reap = now
+        total = len(self._idle) + len(self._in_use)
+        keep = deque()
+        while self._idle:
+            pooled = self._idle.popleft()
+            if total > self.min_size and now - pooled.last_used > self.max_idle:
+                self._close(pooled)
+                self._stats["reaped"] += 1
+                total -= 1
+            else:
+                keep.append(pooled)
+        self._idle = keep
+
+    def open(self):
+        """Pre-open min_size connections"""
+        with self._lock:
+            while len(self._idle) + len(self._in_use) < self.min_size:
+                self._idle.append(self._open())
+
+    # ------------------------------------------------------------
+    #  Borrow / return
+    # ------------------------------------------------------------
+    def getconn(self, timeout=None):
+        timeout = self.acquire_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        while True:
+            candidate = None
+            with self._lock:
+                if self._closed:
+                    raise psycopg2.InterfaceError("Connection pool is closed")
+
+                if time.monotonic() - self._last_reap > min(self.max_idle, 60):
+                    self._reap_idle()
+
+                while candidate is None:
+                    if self._idle:
+                        # Reuse the most recently returned connection (keeps the working set warm)
+                        candidate = self._idle.pop()
+                    elif len(self._in_use) < self.max_size:
+                        break
+                    else:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._stats["timeouts"] += 1
+                            raise PoolTimeout(f"No database connection available within {timeout:.1f}s")
+                        self._stats["waits"] += 1
+                        self._lock.wait(remaining)
+
+                # Reserve the slot while checking / connecting outside of the lock
+                slot = candidate or _PooledConnection(None)
+                self._in_use[id(slot)] = slot
+
+            if candidate is not None:
+                healthy = self._is_healthy(candidate)
+                with self._lock:
+                    self._in_use.pop(id(slot), None)
+                    if healthy:
+                        return self._checkout(candidate)
+                    self._stats["health_check_failures"] += 1
+                    self._close(candidate)
+                    self._lock.notify()
+                continue
+
+            try:
+                pooled = self._open()
+            except Exception:
+                with self._lock:
+                    self._in_use.pop(id(slot), None)
+                    self._lock.notify()
+                raise
+
+            with self._lock:
+                self._in_use.pop(id(slot), None)
+                return self._checkout(pooled)
+
+    def _checkout(self, pooled):
+        self._in_use[id(pooled.conn)] = pooled
+        self._stats["acquired"] += 1
+        return pooled.conn
+
+    def putconn(self, conn, close=False):
+        with self._lock:
+            pooled = self._in_use.pop(id(conn), None)
+            self._stats["released"] += 1
+            if pooled is None:
+                # Not ours; don't leak it
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                return
+
+            discard = close or self._closed or conn.closed
+            if not discard:
+                try:
+                    # Never hand out a connection with an open or failed transaction
+                    if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                except Exception:
+                    discard = True
+
+            now = time.monotonic()
+            if not discard and now - pooled.created_at > self.max_lifetime:
+                discard = True
+
+            if discard:
+                self._close(pooled)
+            else:
+                pooled.last_used = now
+                self._idle.append(pooled)
+
+            self._lock.notify()
+
+    def closeall(self):
+        with self._lock:
+            self._closed = True
+            while self._idle:
+                self._close(self._idle.popleft())
+            for pooled in list(self._in_use.values()):
+                if pooled.conn is not None:
+                    self._close(pooled)
+            self._in_use.clear()
+            self._lock.notify_all()
+
+    def stats(self):
+        with self._lock:
+            in_use = len(self._in_use)
+            idle = len(self._idle)
+            return {
+                **self._stats,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "in_use": in_use,
+                "idle": idle,
+                "size": in_use + idle,
+            }
+
+
+# ============================================================
+#  SHARED POOL
+# ============================================================
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Get the process-wide connection pool (created lazily on first use)
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(**POOL_CONFIG)
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
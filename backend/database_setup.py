@@ -164,6 +164,11 @@ def initialize_database():
     if create_tables_if_not_exist():
         insert_default_users()
         print("✅ PostgreSQL connected & tables created")
+
+        # Imported here: migrations imports get_connection from this module
+        from migrations import run_migrations
+        if not run_migrations():
+            print("⚠️ Schema migrations did not complete")
         return True
 
     print("❌ PostgreSQL initialization failed")
@@ -1,5 +1,12 @@
-from database_setup import get_connection
+import base64
+import json
+import os
+from datetime import date
+
+from database_pool import get_pool
+from database_async import db
 from psycopg2.extras import RealDictCursor
+from utils.cache import TTLCache
 
 # ============================================================
 #  RUN POSTGRES QUERY (MAIN DB UTILITY)
@@ -7,12 +14,16 @@ from psycopg2.extras import RealDictCursor
 def run_postgres_query(query, params=None, fetchone=False, fetchall=False):
     """
     Execute a PostgreSQL query with clean fetch/commit behavior.
+    Connections are borrowed from the shared pool and returned afterwards.
     """
     try:
-        conn = get_connection()
-        if not conn:
-            return {"success": False, "message": "Failed to connect to database", "data": None}
+        pool = get_pool()
+        conn = pool.getconn()
+    except Exception:
+        return {"success": False, "message": "Failed to connect to database", "data": None}
 
+    broken = False
+    try:
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         cursor.execute(query, params or ())
 
@@ -26,18 +37,22 @@ def run_postgres_query(query, params=None, fetchone=False, fetchall=False):
             result = []
 
         cursor.close()
-        conn.close()
 
         return {"success": True, "data": result}
 
     except Exception as e:
+        broken = conn.closed != 0
         return {"success": False, "message": str(e), "data": None}
 
+    finally:
+        # putconn rolls back any open transaction before reuse
+        pool.putconn(conn, close=broken)
+
 
 # ============================================================
 #  CREATE TIMESHEET ENTRY
 # ============================================================
-def create_timesheet_entry(user_id: int, entry_data: dict):
+async def create_timesheet_entry(user_id: int, entry_data: dict):
     try:
         query = """
             INSERT INTO public.timesheet_entries (
@@ -74,59 +89,199 @@ def create_timesheet_entry(user_id: int, entry_data: dict):
             entry_data.get("narrative")
         )
 
-        return run_postgres_query(query, params)
+        await db.execute(query, params)
+        invalidate_timesheet_counts(user_id)
+        return {"success": True, "data": []}
 
     except Exception as e:
         return {"success": False, "message": str(e)}
 
 
+# ============================================================
+#  TIMESHEET FILTERS / CURSORS
+# ============================================================
+def build_timesheet_filters(user_id: int, filters: dict):
+    """
+    Build the WHERE clause shared by every timesheet listing query.
+    Returns (where_sql, params).
+    """
+    where = "WHERE user_id = %s"
+    params = [user_id]
+
+    # Optional filters
+    if filters.get("client"):
+        where += " AND client ILIKE %s"
+        params.append(f"%{filters['client']}%")
+
+    if filters.get("matter"):
+        where += " AND matter ILIKE %s"
+        params.append(f"%{filters['matter']}%")
+
+    if filters.get("timekeeper"):
+        where += " AND timekeeper ILIKE %s"
+        params.append(f"%{filters['timekeeper']}%")
+
+    if filters.get("date_from"):
+        where += " AND entry_date >= %s"
+        params.append(filters["date_from"])
+
+    if filters.get("date_to"):
+        where += " AND entry_date <= %s"
+        params.append(filters["date_to"])
+
+    if filters.get("entry_type"):
+        where += " AND entry_type = %s"
+        params.append(filters["entry_type"])
+
+    return where, params
+
+
+def encode_timesheet_cursor(entry_date, entry_id: int) -> str:
+    """Opaque cursor pointing just after (entry_date, id) in newest-first order"""
+    raw = json.dumps([str(entry_date), entry_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_timesheet_cursor(cursor: str):
+    """Returns (entry_date, id); raises ValueError on a malformed cursor"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        entry_date, entry_id = json.loads(base64.urlsafe_b64decode(padded))
+        return date.fromisoformat(entry_date), int(entry_id)
+    except Exception:
+        raise ValueError("Invalid pagination cursor")
+
+
+# Total counts per (user, filters). Counting is the expensive part of a listing,
+# so it is cached briefly and dropped whenever the user's entries change.
+TIMESHEET_COUNT_CACHE_TTL_SECONDS = float(os.getenv("TIMESHEET_COUNT_CACHE_TTL_SECONDS", 60))
+timesheet_count_cache = TTLCache(maxsize=10000, ttl=TIMESHEET_COUNT_CACHE_TTL_SECONDS)
+
+
+def invalidate_timesheet_counts(user_id: int):
+    timesheet_count_cache.discard_where(lambda key: key[0] == user_id)
+
+
 # ============================================================
 #  GET TIMESHEET ENTRIES WITH FILTERS
 # ============================================================
-def get_timesheet_entries(user_id: int, filters: dict):
+async def get_timesheet_entries(user_id: int, filters: dict):
+    """
+    Newest-first page of entries.
+    With filters["cursor"] the page continues after that cursor (keyset
+    pagination on (entry_date, id)); otherwise limit/offset is used.
+    data holds the rows, next_cursor is set when more rows follow.
+    """
     try:
-        query = """
+        where, params = build_timesheet_filters(user_id, filters)
+        limit = filters.get("limit", 10)
+
+        if filters.get("cursor"):
+            cursor_date, cursor_id = decode_timesheet_cursor(filters["cursor"])
+            where += " AND (entry_date, id) < (%s, %s)"
+            params.extend([cursor_date, cursor_id])
+            offset = 0
+        else:
+            offset = filters.get("offset", 0)
+
+        # Fetch one extra row to learn whether another page exists
+        query = f"""
             SELECT *
             FROM public.timesheet_entries
-            WHERE user_id = %s
+            {where}
+            ORDER BY entry_date DESC, id DESC
+            LIMIT %s OFFSET %s
         """
+        params.extend([limit + 1, offset])
+
+        rows = await db.fetch(query, tuple(params))
 
-        params = [user_id]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_timesheet_cursor(last["entry_date"], last["id"])
 
-        # Optional filters
-        if filters.get("client"):
-            query += " AND client ILIKE %s"
-            params.append(f"%{filters['client']}%")
+        return {"success": True, "data": rows, "next_cursor": next_cursor}
 
-        if filters.get("matter"):
-            query += " AND matter ILIKE %s"
-            params.append(f"%{filters['matter']}%")
+    except Exception as e:
+        return {"success": False, "message": str(e), "data": []}
 
-        if filters.get("date_from"):
-            query += " AND entry_date >= %s"
-            params.append(filters["date_from"])
 
-        if filters.get("date_to"):
-            query += " AND entry_date <= %s"
-            params.append(filters["date_to"])
+async def count_timesheet_entries(user_id: int, filters: dict):
+    """Total number of entries matching filters (cached per user and filter set)"""
+    filter_keys = ("client", "matter", "timekeeper", "date_from", "date_to", "entry_type")
+    cache_key = (user_id,) + tuple(str(filters.get(k) or "") for k in filter_keys)
 
-        if filters.get("entry_type"):
-            query += " AND entry_type = %s"
-            params.append(filters["entry_type"])
+    cached = timesheet_count_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
-        query += " ORDER BY entry_date DESC LIMIT %s OFFSET %s"
-        params.extend([filters.get("limit", 10), filters.get("offset", 0)])
+    where, params = build_timesheet_filters(user_id, filters)
+    total = await db.fetchval(f"SELECT COUNT(*) FROM public.timesheet_entries {where}", tuple(params))
+    timesheet_count_cache.set(cache_key, total)
+    return total
 
-        return run_postgres_query(query, tuple(params))
 
-    except Exception as e:
-        return {"success": False, "message": str(e), "data": []}
+# ============================================================
+#  TIMESHEET SUMMARY (BILLING ROLLUP)
+# ============================================================
+SUMMARY_DIMENSIONS = ("client", "matter", "timekeeper", "phase_task", "entry_type", "period")
+SUMMARY_PERIODS = ("day", "week", "month", "quarter", "year")
+
+
+async def get_timesheet_summary(user_id: int, group_by: list, period: str, filters: dict):
+    """
+    Aggregate hours and totals from timesheet_daily_rollups (kept up to date by
+    triggers on timesheet_entries), grouped by the requested dimensions and
+    always split by currency. A grand-total row per currency is included via
+    GROUPING SETS and flagged with is_total.
+    """
+    if period not in SUMMARY_PERIODS:
+        raise ValueError(f"period must be one of: {', '.join(SUMMARY_PERIODS)}")
+    for dimension in group_by:
+        if dimension not in SUMMARY_DIMENSIONS:
+            raise ValueError(f"Cannot group by '{dimension}'. Allowed: {', '.join(SUMMARY_DIMENSIONS)}")
+
+    # period is whitelisted above, so it is safe to inline
+    expressions = {
+        dimension: (f"date_trunc('{period}', entry_date)::date" if dimension == "period" else dimension)
+        for dimension in group_by
+    }
+    select_dims = "".join(f"{expr} AS {dimension}, " for dimension, expr in expressions.items())
+
+    where, params = build_timesheet_filters(user_id, filters)
+
+    if expressions:
+        dims = ", ".join(expressions.values())
+        grouping = f"GROUP BY GROUPING SETS (({dims}, currency), (currency))"
+        is_total = f"GROUPING({dims}) <> 0"
+        order = f"is_total, {', '.join(str(i) for i in range(1, len(expressions) + 1))}, currency"
+    else:
+        grouping = "GROUP BY currency"
+        is_total = "TRUE"
+        order = "currency"
+
+    query = f"""
+        SELECT {select_dims}
+               currency,
+               {is_total} AS is_total,
+               SUM(entry_count) AS entry_count,
+               SUM(hours_worked) AS hours_worked,
+               SUM(hours_billed) AS hours_billed,
+               SUM(total) AS total
+        FROM public.timesheet_daily_rollups
+        {where}
+        {grouping}
+        ORDER BY {order}
+    """
+    return await db.fetch(query, tuple(params))
 
 
 # ============================================================
 #  UPDATE TIMESHEET ENTRY
 # ============================================================
-def update_timesheet_entry(entry_id: int, entry_data: dict):
+async def update_timesheet_entry(entry_id: int, entry_data: dict):
     try:
         query = """
             UPDATE public.timesheet_entries
@@ -149,11 +304,15 @@ def update_timesheet_entry(entry_id: int, entry_data: dict):
                 narrative=%(narrative)s,
                 updated_at = NOW()
             WHERE id=%(entry_id)s
+            RETURNING user_id
         """
 
         params = {**entry_data, "entry_id": entry_id}
 
-        return run_postgres_query(query, params)
+        owner_id = await db.fetchval(query, params)
+        if owner_id is not None:
+            invalidate_timesheet_counts(owner_id)
+        return {"success": True, "data": []}
 
     except Exception as e:
         return {"success": False, "message": str(e)}
@@ -162,9 +321,12 @@ def update_timesheet_entry(entry_id: int, entry_data: dict):
 # ============================================================
 #  DELETE TIMESHEET ENTRY
 # ============================================================
-def delete_timesheet_entry(entry_id: int):
+async def delete_timesheet_entry(entry_id: int):
     try:
-        query = "DELETE FROM public.timesheet_entries WHERE id = %s"
-        return run_postgres_query(query, (entry_id,))
+        query = "DELETE FROM public.timesheet_entries WHERE id = %s RETURNING user_id"
+        owner_id = await db.fetchval(query, (entry_id,))
+        if owner_id is not None:
+            invalidate_timesheet_counts(owner_id)
+        return {"success": True, "data": []}
     except Exception as e:
         return {"success": False, "message": str(e)}
\ No newline at end of file
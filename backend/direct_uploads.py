@@ -0,0 +1,301 @@
+# Direct (Presigned) Transfers
+#
+#   POST /files/direct/uploads             presigned PUT, or presigned multipart part URLs
+#   POST /files/direct/uploads/refresh     new presigned URL(s) for an unfinished upload
+#   POST /files/direct/uploads/complete    finish the upload and register the file
+#   POST /files/direct/uploads/abort       discard an unfinished upload
+#   GET  /files/direct/download/{file_id}  short-lived presigned GET URL
+#
+# File bytes go straight between the client and S3; the API only signs URLs
+# and records metadata. Objects are keyed under the caller's organization
+# (orgs/{org_id}/files/{file_id}/{filename}), and a file can only be fetched
+# by its uploader or members of the same organization.
+#
+# The upload token returned with the URLs is a signed JWT describing the
+# pending upload, so completion works on any worker without shared state.
+# Presigned URLs expire after S3_PRESIGN_EXPIRES_SECONDS, much sooner than
+# the token, so clients of long uploads fetch fresh ones from /refresh.
+# Multipart uploads that are never completed or aborted should be cleaned up
+# by an AbortIncompleteMultipartUpload lifecycle rule on the bucket.
+
+import mimetypes
+import os
+import re
+import uuid
+from datetime import datetime, timedelta
+
+from fastapi import APIRouter, HTTPException, Depends, status
+from jose import jwt, JWTError
+
+from models import (
+    User, FileUploadResponse, SuccessResponse, DirectUploadInit, DirectUploadTicket,
+    DirectUploadPart, DirectUploadComplete, DirectUploadAbort, DirectUploadRefresh, PresignedDownload
+)
+from auth_routes import get_current_user, SECRET_KEY, ALGORITHM
+from file_routes import ALLOWED_EXTENSIONS, validate_file_extension, to_uploaded_file, can_access_file
+from utils.s3 import (
+    BUCKET_NAME, S3_MULTIPART_THRESHOLD, S3_PRESIGN_EXPIRES_SECONDS, run_s3,
+    presigned_put_url, presigned_get_url, create_presigned_multipart_upload, presigned_part_urls,
+    multipart_part_size,
+    complete_multipart_upload, abort_multipart_upload, head_object, delete_object
+)
+from document_ingest import document_ingestor
+import file_catalog
+
+router = APIRouter(prefix="/files/direct", tags=["File Management"])
+
+# S3 allows up to 5TB per object; keep a saner ceiling by default
+DIRECT_UPLOAD_MAX_FILE_SIZE = int(os.getenv("DIRECT_UPLOAD_MAX_FILE_SIZE", 5 * 1024 * 1024 * 1024))
+# How long after starting an upload it may still be completed
+DIRECT_UPLOAD_TOKEN_TTL_SECONDS = int(os.getenv("DIRECT_UPLOAD_TOKEN_TTL_SECONDS", 24 * 3600))
+UPLOAD_TOKEN_TYPE = "direct_upload"
+
+
+# ============================================================
+#  HELPERS
+# ============================================================
+def _require_bucket():
+    if not BUCKET_NAME:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Direct transfers are not configured (AWS_S3_BUCKET is not set)"
+        )
+
+
+def _object_key(current_user: User, file_id: str, filename: str) -> str:
+    scope = f"orgs/{current_user.org_id}" if current_user.org_id is not None else f"users/{current_user.id}"
+    safe_name = re.sub(r"[^A-Za-z0-9._-]+", "_", os.path.basename(filename)).strip("._") or "file"
+    return f"{scope}/files/{file_id}/{safe_name}"
+
+
+def _issue_upload_token(claims: dict) -> str:
+    claims = dict(claims, type=UPLOAD_TOKEN_TYPE)
+    claims["exp"] = datetime.utcnow() + timedelta(seconds=DIRECT_UPLOAD_TOKEN_TTL_SECONDS)
+    return jwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def _read_upload_token(token: str, current_user: User) -> dict:
+    try:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid or expired upload token")
+    if claims.get("type") != UPLOAD_TOKEN_TYPE or claims.get("user_id") != current_user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    return claims
+
+
+# ============================================================
+#  ROUTES
+# ============================================================
+@router.post("/uploads", response_model=DirectUploadTicket)
+async def start_direct_upload(
+    request: DirectUploadInit,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Get presigned URL(s) to upload a file straight to storage. Small files get
+    one PUT URL (send the returned headers with it); larger ones get a URL per
+    part of `part_size` bytes. Call /complete with the upload token afterwards.
+    """
+    _require_bucket()
+    if not validate_file_extension(request.filename):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"File type not allowed. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"
+        )
+    if request.size > DIRECT_UPLOAD_MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"File too large. Maximum size: {DIRECT_UPLOAD_MAX_FILE_SIZE / (1024*1024):.1f}MB"
+        )
+
+    file_id = str(uuid.uuid4())
+    filename = os.path.basename(request.filename)
+    content_type = request.content_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    key = _object_key(current_user, file_id, filename)
+    expires_at = datetime.utcnow() + timedelta(seconds=S3_PRESIGN_EXPIRES_SECONDS)
+    claims = {
+        "file_id": file_id,
+        "key": key,
+        "filename": filename,
+        "size": request.size,
+        "content_type": content_type,
+        "user_id": current_user.id,
+        "org_id": current_user.org_id,
+        "upload_id": None,
+    }
+
+    try:
+        if request.size < S3_MULTIPART_THRESHOLD:
+            url = await run_s3(presigned_put_url, key, content_type)
+            return DirectUploadTicket(
+                file_id=file_id,
+                upload_token=_issue_upload_token(claims),
+                method="PUT",
+                url=url,
+                headers={"Content-Type": content_type},
+                expires_at=expires_at
+            )
+
+        multipart = await run_s3(create_presigned_multipart_upload, key, request.size, content_type)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"Could not prepare upload: {str(e)}"
+        )
+
+    claims["upload_id"] = multipart["upload_id"]
+    return DirectUploadTicket(
+        file_id=file_id,
+        upload_token=_issue_upload_token(claims),
+        method="MULTIPART",
+        part_size=multipart["part_size"],
+        parts=[DirectUploadPart(**part) for part in multipart["parts"]],
+        expires_at=expires_at
+    )
+
+
+@router.post("/uploads/refresh", response_model=DirectUploadTicket)
+async def refresh_direct_upload(
+    request: DirectUploadRefresh,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Sign new URLs for an upload that is still in progress, e.g. when the
+    ones returned by /uploads expired before every part was sent. Parts that
+    were already uploaded do not need to be sent again.
+    """
+    _require_bucket()
+    claims = _read_upload_token(request.upload_token, current_user)
+    if await file_catalog.get_file(claims["file_id"]) is not None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload is already completed")
+
+    expires_at = datetime.utcnow() + timedelta(seconds=S3_PRESIGN_EXPIRES_SECONDS)
+    if not claims["upload_id"]:
+        url = await run_s3(presigned_put_url, claims["key"], claims["content_type"])
+        return DirectUploadTicket(
+            file_id=claims["file_id"],
+            upload_token=request.upload_token,
+            method="PUT",
+            url=url,
+            headers={"Content-Type": claims["content_type"]},
+            expires_at=expires_at
+        )
+
+    part_size = multipart_part_size(claims["size"])
+    part_count = -(-claims["size"] // part_size)
+    part_numbers = request.part_numbers or range(1, part_count + 1)
+    if any(part_number < 1 or part_number > part_count for part_number in part_numbers):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Part numbers must be between 1 and {part_count}"
+        )
+    parts = await run_s3(presigned_part_urls, claims["key"], claims["upload_id"], sorted(set(part_numbers)))
+    return DirectUploadTicket(
+        file_id=claims["file_id"],
+        upload_token=request.upload_token,
+        method="MULTIPART",
+        part_size=part_size,
+        parts=[DirectUploadPart(**part) for part in parts],
+        expires_at=expires_at
+    )
+
+
+@router.post("/uploads/complete", response_model=FileUploadResponse)
+async def complete_direct_upload(
+    request: DirectUploadComplete,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Finish a direct upload: complete the multipart upload if there is one,
+    check the stored object and register it like any other uploaded file.
+    Safe to retry.
+    """
+    _require_bucket()
+    claims = _read_upload_token(request.upload_token, current_user)
+
+    existing = await file_catalog.get_file(claims["file_id"])
+    if existing is not None:
+        return FileUploadResponse(success=True, message="File uploaded successfully", file=to_uploaded_file(existing))
+
+    try:
+        if claims["upload_id"]:
+            parts = None
+            if request.parts is not None:
+                parts = [{"PartNumber": part.part_number, "ETag": part.etag} for part in request.parts]
+            try:
+                await run_s3(complete_multipart_upload, claims["key"], claims["upload_id"], parts)
+            except Exception:
+                # A retried completion finds the upload already finished
+                if await run_s3(head_object, claims["key"]) is None:
+                    raise
+        stored = await run_s3(head_object, claims["key"])
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Upload could not be completed: {str(e)}"
+        )
+
+    if stored is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="The file has not been uploaded yet")
+    if stored["ContentLength"] != claims["size"]:
+        await run_s3(delete_object, claims["key"])
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Uploaded size {stored['ContentLength']} does not match the declared size {claims['size']}"
+        )
+
+    file_record = await file_catalog.add_object(
+        claims["file_id"], claims["filename"], claims["size"], claims["content_type"],
+        claims["key"], current_user
+    )
+    await document_ingestor.submit(file_record)
+    return FileUploadResponse(
+        success=True,
+        message="File uploaded successfully",
+        file=to_uploaded_file(file_record)
+    )
+
+
+@router.post("/uploads/abort", response_model=SuccessResponse)
+async def abort_direct_upload(
+    request: DirectUploadAbort,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Discard an upload that has not been completed
+    """
+    _require_bucket()
+    claims = _read_upload_token(request.upload_token, current_user)
+    if await file_catalog.get_file(claims["file_id"]) is not None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload is already completed")
+
+    if claims["upload_id"]:
+        await run_s3(abort_multipart_upload, claims["key"], claims["upload_id"])
+    else:
+        await run_s3(delete_object, claims["key"])
+    return SuccessResponse(success=True, message="Upload aborted")
+
+
+@router.get("/download/{file_id}", response_model=PresignedDownload)
+async def get_direct_download_url(
+    file_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Short-lived URL to download a file straight from storage. Files stored on
+    the API server itself get their regular download URL.
+    """
+    file_record = await file_catalog.get_file(file_id)
+    if not file_record or not can_access_file(file_record, current_user):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+
+    expires_at = datetime.utcnow() + timedelta(seconds=S3_PRESIGN_EXPIRES_SECONDS)
+    if not file_record["storage_key"]:
+        return PresignedDownload(file_id=file_id, url=file_record["url"], expires_at=expires_at)
+
+    _require_bucket()
+    url = await run_s3(
+        presigned_get_url, file_record["storage_key"], file_record["original_filename"], file_record["type"]
+    )
+    return PresignedDownload(file_id=file_id, url=url, expires_at=expires_at)
@@ -0,0 +1,427 @@
+# Document Ingestion
+#
+# Uploaded PDF / DOCX / TXT files are read in the background and their text
+# is stored in public.document_chunks, where /query/search finds it
+# (search_index.py). Extraction runs on a bounded pool of INGEST_WORKERS
+# processes, so large or slow documents never block the event loop or
+# compete with request threads.
+#
+# public.document_texts (migration 9) holds each file's state: pending →
+# processing → indexed / failed / unsupported. Workers claim rows with
+# SKIP LOCKED, so uploads queued by any uvicorn process (or left behind by
+# a restart) are picked up by the next sweep; a claim older than
+# INGEST_CLAIM_TIMEOUT_SECONDS is treated as abandoned.
+#
+# Files larger than INGEST_MAX_FILE_SIZE are not indexed (status too_large).
+# Files without a local copy (direct S3 uploads, S3 storage without a cache)
+# are downloaded into the ingestor's own scratch space, so background work
+# never takes quota from the document converter.
+#
+# Extracted text is cached on disk by content hash, so the same document
+# uploaded again is chunked without being parsed a second time.
+#
+# A parser crash (or the OOM killer) breaks the whole process pool and fails
+# every extraction in flight. The pool is replaced, and each of those
+# documents is retried once in a process of its own, so only the one that
+# caused the crash ends up failed. An extraction still running after
+# INGEST_EXTRACT_TIMEOUT_SECONDS is treated the same way: its pool is killed
+# and replaced, and the document is marked failed.
+
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from psycopg2.extras import execute_values
+from starlette.concurrency import run_in_threadpool
+
+from database_async import db
+from utils.scratch import ScratchSpace
+from utils.text_extraction import EXTRACTOR_VERSION, SUPPORTED_EXTENSIONS, extract_text, chunk_text
+import file_catalog
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 2))
+# Files waiting in this process beyond this stay pending for a later sweep
+INGEST_MAX_QUEUE = int(os.getenv("INGEST_MAX_QUEUE", 100))
+# A worker process is replaced after this many documents (bounds parser leaks)
+INGEST_TASKS_PER_WORKER = int(os.getenv("INGEST_TASKS_PER_WORKER", 50))
+INGEST_CHUNK_CHARS = int(os.getenv("INGEST_CHUNK_CHARS", 2000))
+# Larger files are not indexed
+INGEST_MAX_FILE_SIZE = int(os.getenv("INGEST_MAX_FILE_SIZE", 200 * 1024 * 1024))
+# Scratch space for downloading files that have no local copy
+INGEST_SCRATCH_DIR = os.getenv(
+    "INGEST_SCRATCH_DIR", os.path.join(tempfile.gettempdir(), "matterai_ingest_scratch")
+)
+INGEST_SCRATCH_QUOTA_BYTES = int(os.getenv("INGEST_SCRATCH_QUOTA_BYTES", 1024 * 1024 * 1024))
+# Text beyond this many characters is not indexed
+INGEST_MAX_CHARS = int(os.getenv("INGEST_MAX_CHARS", 5 * 1024 * 1024))
+INGEST_TEXT_CACHE_DIR = os.getenv(
+    "INGEST_TEXT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "matterai_text_cache")
+)
+INGEST_SWEEP_INTERVAL_SECONDS = float(os.getenv("INGEST_SWEEP_INTERVAL_SECONDS", 60))
+INGEST_CLAIM_TIMEOUT_SECONDS = int(os.getenv("INGEST_CLAIM_TIMEOUT_SECONDS", 1800))
+# A document still being parsed after this is given up (keep below the claim timeout)
+INGEST_EXTRACT_TIMEOUT_SECONDS = float(os.getenv("INGEST_EXTRACT_TIMEOUT_SECONDS", 300))
+# Characters of the first chunk returned as a file's excerpt
+FILE_CONTEXT_EXCERPT_CHARS = 500
+
+PENDING = "pending"
+PROCESSING = "processing"
+INDEXED = "indexed"
+FAILED = "failed"
+UNSUPPORTED = "unsupported"
+TOO_LARGE = "too_large"
+
+
+def is_supported(filename: str) -> bool:
+    return os.path.splitext(filename)[1].lower() in SUPPORTED_EXTENSIONS
+
+
+# ============================================================
+#  TEXT CACHE (by content hash)
+# ============================================================
+def _cache_path(sha256: str) -> str:
+    return os.path.join(INGEST_TEXT_CACHE_DIR, sha256[:2], f"{sha256}-v{EXTRACTOR_VERSION}.txt")
+
+
+def _read_cached_text(sha256: str):
+    try:
+        with open(_cache_path(sha256), encoding="utf-8") as handle:
+            return handle.read()
+    except FileNotFoundError:
+        return None
+
+
+def _write_cached_text(sha256: str, text: str):
+    path = _cache_path(sha256)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        handle.write(text)
+    os.replace(tmp_path, path)
+
+
+def _insert_chunks(conn, file_id: str, chunks: list):
+    with conn.cursor() as cursor:
+        execute_values(
+            cursor,
+            "INSERT INTO public.document_chunks (file_id, chunk_index, content) VALUES %s",
+            [(file_id, index, chunk) for index, chunk in enumerate(chunks)],
+            page_size=500
+        )
+
+
+# ============================================================
+#  PIPELINE
+# ============================================================
+class DocumentIngestor:
+    def __init__(self, workers: int = INGEST_WORKERS, max_queue: int = INGEST_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = None
+        self._queue = None
+        # Queue places held while a claim is being recorded (submit, sweeper)
+        self._reserved = 0
+        self._tasks = []
+        self._open_local_copy = None
+        self.scratch = None
+        self.indexed = 0
+        self.failed = 0
+        self.cache_hits = 0
+        self.worker_crashes = 0
+        self.extraction_timeouts = 0
+
+    def start(self, open_local_copy):
+        """
+        Start the workers and the sweeper. open_local_copy(file_record, scratch)
+        is an async context manager yielding a local path of the file's content,
+        downloading it into a workspace of the given ScratchSpace if needed.
+        """
+        if self._tasks:
+            return
+        self._open_local_copy = open_local_copy
+        self.scratch = ScratchSpace(INGEST_SCRATCH_DIR, INGEST_SCRATCH_QUOTA_BYTES)
+        self.scratch.start_janitor()
+        self._executor = self._new_executor(self.workers)
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.ensure_future(self._sweeper()))
+
+    def _new_executor(self, workers: int) -> ProcessPoolExecutor:
+        # spawn: forking a process that runs threads and an event loop is unsafe
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            max_tasks_per_child=INGEST_TASKS_PER_WORKER
+        )
+
+    async def submit(self, file_record: dict):
+        """
+        Schedule a newly uploaded file for indexing. Failures are logged, never
+        raised, so they cannot fail the upload.
+        """
+        try:
+            skipped = None
+            if not is_supported(file_record["name"]):
+                skipped = UNSUPPORTED
+            elif file_record["size"] > INGEST_MAX_FILE_SIZE:
+                skipped = TOO_LARGE
+            if skipped:
+                await db.execute("""
+                    INSERT INTO public.document_texts (file_id, status) VALUES (%s, %s)
+                    ON CONFLICT (file_id) DO NOTHING
+                """, (file_record["id"], skipped))
+                return
+
+            # Claim it right away when this process has room, so it starts now.
+            # The queue place is reserved across the insert, so it is still
+            # free when the claim has been recorded.
+            claim = self._queue is not None and self._room() > 0
+            if claim:
+                self._reserved += 1
+            try:
+                inserted = await db.fetchval("""
+                    INSERT INTO public.document_texts (file_id, status, claimed_at)
+                    VALUES (%s, %s, CASE WHEN %s THEN NOW() END)
+                    ON CONFLICT (file_id) DO NOTHING
+                    RETURNING file_id
+                """, (file_record["id"], PROCESSING if claim else PENDING, claim))
+            finally:
+                if claim:
+                    self._reserved -= 1
+            # Not inserted: already registered (e.g. by the backfill), the sweeper has it
+            if claim and inserted is not None:
+                self._queue.put_nowait(file_record["id"])
+        except Exception as e:
+            print(f"⚠️ Could not schedule {file_record['id']} for indexing: {e}")
+
+    def _room(self) -> int:
+        return self.max_queue - self._queue.qsize() - self._reserved
+
+    async def _claim(self, limit: int) -> list:
+        """Claim up to limit pending (or abandoned) files for this process"""
+        rows = await db.fetch("""
+            UPDATE public.document_texts SET status = %s, claimed_at = NOW()
+            WHERE file_id IN (
+                SELECT file_id FROM public.document_texts
+                WHERE status = %s
+                   OR (status = %s AND claimed_at < NOW() - make_interval(secs => %s))
+                ORDER BY created_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING file_id
+        """, (PROCESSING, PENDING, PROCESSING, INGEST_CLAIM_TIMEOUT_SECONDS, limit))
+        return [row["file_id"] for row in rows]
+
+    async def _backfill(self, batch_size: int = 1000):
+        """Register files uploaded before ingestion existed"""
+        supported = "\\.(" + "|".join(sorted(ext[1:] for ext in SUPPORTED_EXTENSIONS)) + ")$"
+        while True:
+            added = await db.execute("""
+                INSERT INTO public.document_texts (file_id, status)
+                SELECT f.id, CASE WHEN lower(f.name) ~ %s THEN %s ELSE %s END
+                FROM public.file_catalog f
+                WHERE NOT EXISTS (SELECT 1 FROM public.document_texts t WHERE t.file_id = f.id)
+                LIMIT %s
+                ON CONFLICT (file_id) DO NOTHING
+            """, (supported, PENDING, UNSUPPORTED, batch_size))
+            # A short batch is not the end: rows another process registered
+            # concurrently were skipped by ON CONFLICT and count as not added
+            if added == 0:
+                return
+
+    async def _sweeper(self):
+        try:
+            await self._backfill()
+        except Exception as e:
+            print(f"⚠️ Document ingestion backfill failed: {e}")
+        while True:
+            try:
+                room = self._room()
+                if room > 0:
+                    self._reserved += room
+                    try:
+                        file_ids = await self._claim(room)
+                    finally:
+                        self._reserved -= room
+                    for file_id in file_ids:
+                        self._queue.put_nowait(file_id)
+            except Exception as e:
+                print(f"⚠️ Document ingestion sweep failed: {e}")
+            await asyncio.sleep(INGEST_SWEEP_INTERVAL_SECONDS)
+
+    async def _worker(self):
+        while True:
+            file_id = await self._queue.get()
+            try:
+                await self._ingest(file_id)
+            except Exception as e:
+                self.failed += 1
+                print(f"❌ Indexing {file_id} failed: {e}")
+                try:
+                    await db.execute("""
+                        UPDATE public.document_texts SET status = %s, error = %s, claimed_at = NULL
+                        WHERE file_id = %s
+                    """, (FAILED, str(e)[:1000], file_id))
+                except Exception:
+                    pass
+
+    async def _extract(self, file_record: dict) -> str:
+        sha256 = file_record["sha256"]
+        if sha256:
+            text = await run_in_threadpool(_read_cached_text, sha256)
+            if text is not None:
+                self.cache_hits += 1
+                return text
+
+        extension = os.path.splitext(file_record["name"])[1].lower()
+        async with self._open_local_copy(file_record, self.scratch) as path:
+            if path is None:
+                raise FileNotFoundError("File content not found")
+            text = await self._run_extraction(path, extension)
+
+        if sha256:
+            try:
+                await run_in_threadpool(_write_cached_text, sha256, text)
+            except OSError as e:
+                print(f"⚠️ Could not cache extracted text: {e}")
+        return text
+
+    async def _run_in(self, executor: ProcessPoolExecutor, path: str, extension: str) -> str:
+        loop = asyncio.get_running_loop()
+        return await asyncio.wait_for(
+            loop.run_in_executor(executor, extract_text, path, extension, INGEST_MAX_CHARS),
+            INGEST_EXTRACT_TIMEOUT_SECONDS
+        )
+
+    def _kill(self, executor: ProcessPoolExecutor):
+        """Stop a pool whose worker hangs; shutdown() alone would leave it running"""
+        # Snapshot first: the pool's management thread prunes the dict as workers die
+        for process in list((executor._processes or {}).values()):
+            process.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _run_extraction(self, path: str, extension: str) -> str:
+        executor = self._executor
+        try:
+            return await self._run_in(executor, path, extension)
+        except BrokenProcessPool:
+            if self._executor is executor:
+                self.worker_crashes += 1
+                print("⚠️ A document extraction worker crashed, restarting the pool")
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._new_executor(self.workers)
+        except asyncio.TimeoutError:
+            self.extraction_timeouts += 1
+            if self._executor is executor:
+                print("⚠️ A document extraction timed out, restarting the pool")
+                self._executor = self._new_executor(self.workers)
+            # Other documents in flight on it get BrokenProcessPool and are retried
+            self._kill(executor)
+            raise RuntimeError(f"Text extraction timed out after {INGEST_EXTRACT_TIMEOUT_SECONDS:g}s")
+
+        # This document may or may not be the one that crashed the pool
+        isolated = self._new_executor(1)
+        try:
+            return await self._run_in(isolated, path, extension)
+        except BrokenProcessPool:
+            raise RuntimeError("Document crashed the text extraction process")
+        except asyncio.TimeoutError:
+            self.extraction_timeouts += 1
+            self._kill(isolated)
+            raise RuntimeError(f"Text extraction timed out after {INGEST_EXTRACT_TIMEOUT_SECONDS:g}s")
+        finally:
+            isolated.shutdown(wait=False)
+
+    async def _ingest(self, file_id: str):
+        file_record = await file_catalog.get_file(file_id)
+        if file_record is None:
+            # Deleted since it was queued (its document_texts row went with it)
+            return
+        if file_record["size"] > INGEST_MAX_FILE_SIZE:
+            # Queued by the backfill, or before the limit was lowered
+            await db.execute("""
+                UPDATE public.document_texts SET status = %s, claimed_at = NULL WHERE file_id = %s
+            """, (TOO_LARGE, file_id))
+            return
+
+        text = await self._extract(file_record)
+        chunks = await run_in_threadpool(chunk_text, text, INGEST_CHUNK_CHARS)
+
+        async with db.transaction() as conn:
+            await conn.execute("DELETE FROM public.document_chunks WHERE file_id = %s", (file_id,))
+            if chunks:
+                await conn.run(_insert_chunks, file_id, chunks)
+            await conn.execute("""
+                UPDATE public.document_texts
+                SET status = %s, chunk_count = %s, char_count = %s, error = NULL,
+                    claimed_at = NULL, indexed_at = NOW()
+                WHERE file_id = %s
+            """, (INDEXED, len(chunks), len(text), file_id))
+        self.indexed += 1
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self.scratch is not None:
+            await self.scratch.close()
+            self.scratch = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "indexed": self.indexed,
+            "failed": self.failed,
+            "worker_crashes": self.worker_crashes,
+            "extraction_timeouts": self.extraction_timeouts,
+            "text_cache_hits": self.cache_hits,
+            "scratch_space": self.scratch.stats() if self.scratch is not None else None,
+        }
+
+
+document_ingestor = DocumentIngestor()
+
+
+# ============================================================
+#  QUERY-TIME LOOKUP
+# ============================================================
+async def get_file_contexts(file_ids: list, user) -> list:
+    """
+    Indexing state and an excerpt of each file the user may read, in one
+    indexed lookup (no document is opened during the request)
+    """
+    if not file_ids:
+        return []
+    rows = await db.fetch("""
+        SELECT f.id, f.name, t.status, t.chunk_count, t.char_count, t.error,
+               left(c.content, %s) AS excerpt
+        FROM public.file_catalog f
+        LEFT JOIN public.document_texts t ON t.file_id = f.id
+        LEFT JOIN public.document_chunks c ON c.file_id = f.id AND c.chunk_index = 0
+        WHERE f.id = ANY(%s)
+          AND (f.uploaded_by = %s OR (f.org_id IS NOT NULL AND f.org_id = %s))
+    """, (FILE_CONTEXT_EXCERPT_CHARS, list(file_ids), user.username, user.org_id))
+    by_id = {row["id"]: row for row in rows}
+    return [
+        {
+            "file_id": file_id,
+            "name": by_id[file_id]["name"],
+            "status": by_id[file_id]["status"] or PENDING,
+            "chunk_count": by_id[file_id]["chunk_count"] or 0,
+            "char_count": by_id[file_id]["char_count"] or 0,
+            "excerpt": by_id[file_id]["excerpt"],
+            "error": by_id[file_id]["error"],
+        }
+        for file_id in file_ids
+        if file_id in by_id
+    ]
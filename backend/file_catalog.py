@@ -0,0 +1,222 @@
+# File Catalog
+#
+# Persisted metadata for uploaded files (public.file_catalog, migration 5) and
+# reference counts for their content-addressed blobs (public.file_blobs).
+# Files uploaded directly to S3 (migration 6) have a storage_key instead of a
+# blob. Uploads take their blob reference before storing the content, and no
+# transaction is held open while content is written to or removed from
+# storage. A blob's content is only removed after the delete that dropped its
+# last reference has committed, while holding a session-level per-hash
+# advisory lock (outside any transaction) that add_file() also takes, so a
+# concurrent upload of the same content waits and keeps it.
+# Single-file lookups go through a short-lived in-process cache;
+# listings use keyset pagination on (uploaded_at, id).
+
+import os
+
+from database_async import db
+from utils.cache import TTLCache
+
+FILE_CATALOG_CACHE_TTL_SECONDS = float(os.getenv("FILE_CATALOG_CACHE_TTL_SECONDS", 60))
+FILE_CATALOG_CACHE_MAX_ENTRIES = int(os.getenv("FILE_CATALOG_CACHE_MAX_ENTRIES", 10000))
+
+FILE_COLUMNS = "id, name, size, content_type, sha256, storage_key, user_id, org_id, uploaded_by, uploaded_at"
+
+# Serialises taking a blob reference against removing the blob's content
+BLOB_LOCK_SQL = "SELECT pg_advisory_xact_lock(hashtextextended(%s, 0))"
+# The same lock, held across the removal without keeping a transaction open
+BLOB_SESSION_LOCK_SQL = "SELECT pg_advisory_lock(hashtextextended(%s, 0))"
+BLOB_SESSION_UNLOCK_SQL = "SELECT pg_advisory_unlock(hashtextextended(%s, 0))"
+
+file_cache = TTLCache(maxsize=FILE_CATALOG_CACHE_MAX_ENTRIES, ttl=FILE_CATALOG_CACHE_TTL_SECONDS)
+
+
+def _to_record(row) -> dict:
+    """Shape a catalog row like the old FILE_DB records"""
+    return {
+        "id": row["id"],
+        "name": row["name"],
+        "size": row["size"],
+        "type": row["content_type"],
+        "url": f"/files/download/{row['id']}",
+        "uploaded_at": row["uploaded_at"],
+        "original_filename": row["name"],
+        "sha256": row["sha256"],
+        "storage_key": row["storage_key"],
+        "user_id": row["user_id"],
+        "org_id": row["org_id"],
+        "uploaded_by": row["uploaded_by"],
+    }
+
+
+async def add_file(file_id: str, name: str, size: int, content_type: str, sha256: str,
+                   user, store_content, remove_content) -> dict:
+    """
+    Record a file and take a reference on its blob. The reference is taken
+    (and committed) first, so the blob cannot be removed by a concurrent
+    delete; store_content() is then awaited outside any transaction. If
+    storing or recording fails the reference is dropped again, and the
+    content removed with remove_content(sha256) if nothing else uses it.
+    """
+    async with db.transaction() as conn:
+        await conn.execute(BLOB_LOCK_SQL, (sha256,))
+        await conn.execute("""
+            INSERT INTO public.file_blobs (sha256, size, ref_count)
+            VALUES (%s, %s, 1)
+            ON CONFLICT (sha256) DO UPDATE SET ref_count = public.file_blobs.ref_count + 1
+        """, (sha256, size))
+
+    try:
+        await store_content()
+        row = await db.fetchrow(f"""
+            INSERT INTO public.file_catalog
+                (id, name, size, content_type, sha256, user_id, org_id, uploaded_by)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING {FILE_COLUMNS}
+        """, (file_id, name, size, content_type, sha256, user.id, user.org_id, user.username))
+    except BaseException:
+        try:
+            await _release_blob(sha256, remove_content)
+        except Exception as e:
+            print(f"⚠️ Could not release blob {sha256}: {e}")
+        raise
+
+    record = _to_record(row)
+    file_cache.set(file_id, record)
+    return record
+
+
+async def add_object(file_id: str, name: str, size: int, content_type: str, storage_key: str,
+                     user) -> dict:
+    """
+    Record a file stored as an S3 object. Registering the same file_id again
+    (a retried completion) returns the existing record.
+    """
+    row = await db.fetchrow(f"""
+        WITH inserted AS (
+            INSERT INTO public.file_catalog
+                (id, name, size, content_type, storage_key, user_id, org_id, uploaded_by)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (id) DO NOTHING
+            RETURNING {FILE_COLUMNS}
+        )
+        SELECT {FILE_COLUMNS} FROM inserted
+        UNION ALL
+        SELECT {FILE_COLUMNS} FROM public.file_catalog WHERE id = %s
+        LIMIT 1
+    """, (file_id, name, size, content_type, storage_key, user.id, user.org_id, user.username, file_id))
+
+    record = _to_record(row)
+    file_cache.set(file_id, record)
+    return record
+
+
+async def get_file(file_id: str):
+    """File record by id, or None"""
+    record = file_cache.get(file_id)
+    if record is not None:
+        return record
+
+    row = await db.fetchrow(f"SELECT {FILE_COLUMNS} FROM public.file_catalog WHERE id = %s", (file_id,))
+    if not row:
+        return None
+    record = _to_record(row)
+    file_cache.set(file_id, record)
+    return record
+
+
+async def list_files(uploaded_by: str, limit: int, before: str = None) -> list:
+    """
+    Newest-first page of a user's files. `before` is the id of the last file
+    of the previous page.
+    """
+    params = [uploaded_by]
+    keyset = ""
+    if before:
+        keyset = """
+            AND (uploaded_at, id) < (
+                SELECT uploaded_at, id FROM public.file_catalog WHERE id = %s
+            )
+        """
+        params.append(before)
+    params.append(limit)
+
+    rows = await db.fetch(f"""
+        SELECT {FILE_COLUMNS}
+        FROM public.file_catalog
+        WHERE uploaded_by = %s {keyset}
+        ORDER BY uploaded_at DESC, id DESC
+        LIMIT %s
+    """, tuple(params))
+    return [_to_record(row) for row in rows]
+
+
+async def remove_file(file_id: str, remove_content, remove_object=None) -> bool:
+    """
+    Delete a file record and drop its blob reference. Once that has committed,
+    remove_content(sha256) is awaited if it was the blob's last reference, or
+    remove_object(storage_key) for S3-stored files. A failure to remove the
+    content is logged, not raised. Returns False if the file did not exist.
+    """
+    orphaned = None
+    async with db.transaction() as conn:
+        row = await conn.fetchrow(
+            "DELETE FROM public.file_catalog WHERE id = %s RETURNING sha256, storage_key", (file_id,)
+        )
+        if row is None:
+            file_cache.pop(file_id)
+            return False
+
+        if row["sha256"] is not None and await _drop_reference(conn, row["sha256"]):
+            orphaned = row["sha256"]
+
+    file_cache.pop(file_id)
+    try:
+        if orphaned is not None:
+            await _collect_blob(orphaned, remove_content)
+        elif row["storage_key"] and remove_object is not None:
+            await remove_object(row["storage_key"])
+    except Exception as e:
+        print(f"⚠️ Could not remove the content of deleted file {file_id}: {e}")
+    return True
+
+
+async def _drop_reference(conn, sha256: str) -> bool:
+    """Drop one reference to a blob inside a transaction; True if it was the last"""
+    remaining = await conn.fetchval("""
+        UPDATE public.file_blobs SET ref_count = ref_count - 1
+        WHERE sha256 = %s
+        RETURNING ref_count
+    """, (sha256,))
+    if remaining is not None and remaining <= 0:
+        await conn.execute("DELETE FROM public.file_blobs WHERE sha256 = %s", (sha256,))
+        return True
+    return False
+
+
+async def _release_blob(sha256: str, remove_content):
+    """Drop a reference taken by add_file, removing the content if it was the last"""
+    async with db.transaction() as conn:
+        orphaned = await _drop_reference(conn, sha256)
+    if orphaned:
+        await _collect_blob(sha256, remove_content)
+
+
+async def _collect_blob(sha256: str, remove_content):
+    """
+    Remove an unreferenced blob's content, unless an upload has referenced it
+    again. The reference check commits before the content is touched; the
+    lock stays held until the removal is done, so an upload taking a new
+    reference cannot find the content and then lose it.
+    """
+    async with db.acquire() as conn:
+        await conn.execute(BLOB_SESSION_LOCK_SQL, (sha256,))
+        try:
+            if await conn.fetchval("SELECT 1 FROM public.file_blobs WHERE sha256 = %s", (sha256,)) is None:
+                await remove_content(sha256)
+        finally:
+            await conn.execute(BLOB_SESSION_UNLOCK_SQL, (sha256,))
+
+
+def cache_stats() -> dict:
+    return file_cache.stats()
@@ -1,28 +1,149 @@
 from fastapi import APIRouter, UploadFile, File, Form
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from pdf2docx import Converter
+import pdf2docx
+import functools
+import hashlib
+import json
 import os
-import tempfile
-import shutil
-import subprocess
+import threading
+
+from office_pool import office_pool
+from conversion_jobs import conversion_jobs, ConversionQueueFull, COMPLETED
+from conversion_cache import conversion_cache, CONVERSION_CACHE_ENABLED
+from utils.uploads import save_upload_file, UploadTooLarge
+from utils.http_files import ConditionalFileResponse
+from utils.scratch import scratch_space, ScratchQuotaExceeded
 
 router = APIRouter(prefix="/convert_file", tags=["File Converter"])
 
-def convert_docx_to_pdf_libreoffice(input_path: str, output_dir: str) -> str:
+CONVERSION_MAX_FILE_SIZE = int(os.getenv("CONVERSION_MAX_FILE_SIZE", 100 * 1024 * 1024))
+SUPPORTED_CONVERSIONS = {(".pdf", "docx"), (".docx", "pdf")}
+# Scratch space reserved per conversion, as a multiple of the upload size
+# (input + output + converter intermediates)
+CONVERSION_SCRATCH_FACTOR = 4
+
+# PDF → DOCX: documents with at least this many pages are split into page
+# ranges converted in PDF2DOCX_WORKERS processes (smaller ones aren't worth
+# the process start-up cost)
+PDF2DOCX_PARALLEL_MIN_PAGES = int(os.getenv("PDF2DOCX_PARALLEL_MIN_PAGES", 20))
+PDF2DOCX_WORKERS = int(os.getenv("PDF2DOCX_WORKERS", os.cpu_count() or 1))
+# Parallel conversions running at once; further large documents convert in a
+# single process instead of oversubscribing the CPUs
+PDF2DOCX_PARALLEL_JOBS = int(os.getenv("PDF2DOCX_PARALLEL_JOBS", 1))
+pdf2docx_parallel_slots = threading.BoundedSemaphore(PDF2DOCX_PARALLEL_JOBS)
+
+async def convert_docx_to_pdf_libreoffice(input_path: str, output_dir: str) -> str:
+    """
+    Converts DOCX to PDF using LibreOffice (preserves formatting), on a warm
+    worker from the office pool.
+    """
+    return await office_pool.convert(input_path, output_dir, "pdf")
+
+
+def convert_pdf_to_docx(input_path: str, output_path: str):
+    """
+    Converts PDF to DOCX with pdf2docx (CPU-bound, run in the thread pool).
+    Large documents use pdf2docx's multi-processing mode, which parses page
+    ranges in a process pool and merges them into one document.
+    """
+    cv = Converter(input_path)
+    try:
+        page_count = len(cv.fitz_doc)
+        if (
+            PDF2DOCX_WORKERS > 1
+            and page_count >= PDF2DOCX_PARALLEL_MIN_PAGES
+            and pdf2docx_parallel_slots.acquire(blocking=False)
+        ):
+            try:
+                cv.convert(
+                    output_path, start=0, end=None,
+                    multi_processing=True, cpu_count=min(PDF2DOCX_WORKERS, page_count)
+                )
+            finally:
+                pdf2docx_parallel_slots.release()
+        else:
+            cv.convert(output_path, start=0, end=None)
+    finally:
+        cv.close()
+
+
+async def converter_version(target_format: str) -> str:
+    """Identifies the converter, so upgrading it invalidates cached results"""
+    if target_format == "docx":
+        return f"pdf2docx-{getattr(pdf2docx, '__version__', 'unknown')}"
+    return f"libreoffice-{await office_pool.version()}"
+
+
+async def run_conversion(input_path: str, output_dir: str, target_format: str,
+                         input_sha256: str = None) -> str:
+    """
+    Convert input_path into output_dir and return the output path. With the
+    input's SHA-256, results are served from / stored in the conversion cache.
+    """
+    base_name, ext = os.path.splitext(os.path.basename(input_path))
+    ext = ext.lower()
+    output_path = os.path.join(output_dir, f"{base_name}.{target_format}")
+
+    cache_key = None
+    if CONVERSION_CACHE_ENABLED and input_sha256 and (ext, target_format) in SUPPORTED_CONVERSIONS:
+        cache_key = conversion_cache.key(input_sha256, target_format, await converter_version(target_format))
+        if await conversion_cache.get(cache_key, target_format, output_path):
+            return output_path
+
+    if ext == ".pdf" and target_format == "docx":
+        # PDF → DOCX
+        await run_in_threadpool(convert_pdf_to_docx, input_path, output_path)
+    elif ext == ".docx" and target_format == "pdf":
+        # DOCX → PDF using LibreOffice (perfect fidelity)
+        output_path = await convert_docx_to_pdf_libreoffice(input_path, output_dir)
+    else:
+        raise ValueError(f"Unsupported conversion: {ext} → {target_format}")
+
+    if not os.path.exists(output_path):
+        raise RuntimeError("Conversion failed")
+    if cache_key:
+        await conversion_cache.put(cache_key, target_format, output_path)
+    return output_path
+
+
+async def receive_conversion_upload(file: UploadFile, target_format: str):
     """
-    Converts DOCX to PDF using LibreOffice headless mode (preserves formatting).
+    Validate the requested conversion and save the upload into a new scratch
+    workspace, hashing it on the way. Returns (workspace, input_path, sha256)
+    or a JSONResponse error. The caller owns the workspace and must release it.
     """
+    filename = os.path.basename(file.filename or "")
+    ext = os.path.splitext(filename)[1].lower()
+    if (ext, target_format) not in SUPPORTED_CONVERSIONS:
+        return JSONResponse(
+            {"error": f"Unsupported conversion: {ext} → {target_format}"},
+            status_code=400,
+        )
+
+    # Wait for disk space rather than filling it up under load
+    upload_size = file.size if file.size is not None else CONVERSION_MAX_FILE_SIZE
     try:
-        subprocess.run(
-            ["libreoffice", "--headless", "--convert-to", "pdf", input_path, "--outdir", output_dir],
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+        workspace = await scratch_space.acquire(min(upload_size, CONVERSION_MAX_FILE_SIZE) * CONVERSION_SCRATCH_FACTOR)
+    except ScratchQuotaExceeded as e:
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": "10"})
+
+    input_path = workspace.file_path(filename)
+    digest = hashlib.sha256()
+    try:
+        await save_upload_file(file, input_path, CONVERSION_MAX_FILE_SIZE, on_chunk=digest.update)
+    except UploadTooLarge:
+        await workspace.release()
+        return JSONResponse(
+            {"error": f"File too large. Maximum size: {CONVERSION_MAX_FILE_SIZE / (1024*1024):.1f}MB"},
+            status_code=400,
         )
-        output_path = os.path.join(output_dir, os.path.splitext(os.path.basename(input_path))[0] + ".pdf")
-        return output_path
-    except subprocess.CalledProcessError as e:
-        raise RuntimeError(f"LibreOffice conversion failed: {e.stderr.decode('utf-8')}")
+    except BaseException:
+        await workspace.release()
+        raise
+    return workspace, input_path, digest.hexdigest()
 
 
 @router.post(
@@ -35,43 +156,101 @@ async def convert_file(
     target_format: str = Form(..., description="Target format: pdf or docx"),
 ):
     try:
-        tmp_dir = tempfile.mkdtemp()
-        input_path = os.path.join(tmp_dir, file.filename)
-
-        # Save uploaded file
-        with open(input_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
+        received = await receive_conversion_upload(file, target_format)
+        if isinstance(received, JSONResponse):
+            return received
+        workspace, input_path, input_sha256 = received
 
-        base_name, ext = os.path.splitext(file.filename)
-        ext = ext.lower()
-        output_path = os.path.join(tmp_dir, f"{base_name}.{target_format}")
+        try:
+            output_path = await run_conversion(input_path, workspace.path, target_format, input_sha256)
+        except BaseException:
+            await workspace.release()
+            raise
 
-        if ext == ".pdf" and target_format == "docx":
-            # PDF → DOCX
-            cv = Converter(input_path)
-            cv.convert(output_path, start=0, end=None)
-            cv.close()
-
-        elif ext == ".docx" and target_format == "pdf":
-            # DOCX → PDF using LibreOffice (perfect fidelity)
-            output_path = convert_docx_to_pdf_libreoffice(input_path, tmp_dir)
-
-        else:
-            shutil.rmtree(tmp_dir)
-            return JSONResponse(
-                {"error": f"Unsupported conversion: {ext} → {target_format}"},
-                status_code=400,
-            )
-
-        if not os.path.exists(output_path):
-            shutil.rmtree(tmp_dir)
-            return JSONResponse({"error": "Conversion failed"}, status_code=500)
-
-        return FileResponse(
+        # The workspace is removed once the response has been sent
+        return ConditionalFileResponse(
             output_path,
             media_type="application/octet-stream",
             filename=os.path.basename(output_path),
+            background=BackgroundTask(workspace.release),
         )
 
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
+
+
+# ============================================================
+#  JOB MODE (submit → poll status / stream events → download)
+# ============================================================
+@router.post(
+    "/jobs",
+    summary="Start a background conversion (PDF <-> DOCX)",
+    description="Returns a job_id immediately. Poll `/convert_file/status/{job_id}` (or stream `/convert_file/events/{job_id}`) until COMPLETED, then fetch `/convert_file/download/{download_id}`.",
+)
+async def submit_conversion_job(
+    file: UploadFile = File(..., description="Upload a PDF or DOCX file"),
+    target_format: str = Form(..., description="Target format: pdf or docx"),
+):
+    received = await receive_conversion_upload(file, target_format)
+    if isinstance(received, JSONResponse):
+        return received
+    workspace, input_path, input_sha256 = received
+
+    try:
+        job = conversion_jobs.submit(
+            input_path, workspace.path, os.path.basename(input_path), target_format,
+            functools.partial(run_conversion, input_sha256=input_sha256),
+            cleanup=workspace.release
+        )
+    except ConversionQueueFull as e:
+        await workspace.release()
+        return JSONResponse({"error": str(e)}, status_code=503, headers={"Retry-After": "10"})
+
+    return JSONResponse(conversion_jobs.public(job), status_code=202)
+
+
+@router.get("/status/{job_id}", summary="Conversion job status")
+async def get_conversion_job_status(job_id: str):
+    job = conversion_jobs.get(job_id)
+    if job is None:
+        return JSONResponse({"detail": "Job not found"}, status_code=404)
+    return conversion_jobs.public(job)
+
+
+@router.get("/events/{job_id}", summary="Conversion job status as server-sent events")
+async def stream_conversion_job_events(job_id: str):
+    if conversion_jobs.get(job_id) is None:
+        return JSONResponse({"detail": "Job not found"}, status_code=404)
+
+    async def event_stream():
+        async for snapshot in conversion_jobs.events(job_id):
+            if snapshot is None:
+                # Keep proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: status\ndata: {json.dumps(snapshot)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/download/{download_id}", summary="Download a completed conversion")
+async def download_conversion_result(download_id: str):
+    job = conversion_jobs.get(download_id)
+    if job is None or job["status"] != COMPLETED:
+        return JSONResponse({"detail": "Result not found or not ready"}, status_code=404)
+    return ConditionalFileResponse(
+        job["output_path"],
+        filename=job["output_filename"],
+        media_type="application/octet-stream",
+    )
+
+
+@router.delete("/jobs/{job_id}", summary="Cancel a conversion job or discard its result")
+async def cancel_conversion_job(job_id: str):
+    if not conversion_jobs.cancel(job_id):
+        return JSONResponse({"detail": "Job not found"}, status_code=404)
+    return {"success": True, "message": "Job cancelled"}
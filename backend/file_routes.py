@@ -1,18 +1,28 @@
-from fastapi import APIRouter, HTTPException, Depends, status, File, UploadFile
-from fastapi.responses import FileResponse
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, status, File, UploadFile, Query
+from fastapi.responses import RedirectResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
+from contextlib import asynccontextmanager, AsyncExitStack
 import os
 import uuid
-from datetime import datetime
 import mimetypes
 
 from models import UploadedFile, FileUploadResponse, SuccessResponse, User
 from auth_routes import get_current_user
+from utils.uploads import UploadTooLarge
+from utils.blobs import BlobStore
+from utils.storage import storage, PUBLIC_UPLOAD_DIR, STORAGE_LOCAL_ROOT
+from utils.http_files import ConditionalFileResponse
+from utils.s3 import run_s3, presigned_get_url, delete_object, get_s3_client, BUCKET_NAME
+from utils.scratch import scratch_space
+from document_ingest import document_ingestor
+import file_catalog
 
 router = APIRouter(prefix="/files", tags=["File Management"])
 
 # File storage configuration
-UPLOAD_DIR = "uploads"
+UPLOAD_DIR = PUBLIC_UPLOAD_DIR
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
 ALLOWED_EXTENSIONS = {
     ".pdf", ".doc", ".docx", ".txt", ".rtf",  # Documents
@@ -26,8 +36,13 @@ ALLOWED_EXTENSIONS = {
 # Ensure upload directory exists
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-# Mock file database (replace with real database)
-FILE_DB = {}
+# Downloads are private, but the content behind a file ID is immutable
+FILE_DOWNLOAD_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+# File contents are stored once per distinct SHA-256, however often uploaded,
+# in the configured storage backend (STORAGE_BACKEND, local disk by default).
+# Nothing of it lives under UPLOAD_DIR, which is public at /static.
+blob_store = BlobStore(storage, tmp_dir=os.path.join(STORAGE_LOCAL_ROOT, "tmp"))
 
 def validate_file_extension(filename: str) -> bool:
     """Validate file extension"""
@@ -42,6 +57,72 @@ def get_file_type(filename: str) -> str:
     mime_type, _ = mimetypes.guess_type(filename)
     return mime_type or "application/octet-stream"
 
+def to_uploaded_file(file_record: dict) -> UploadedFile:
+    return UploadedFile(**{k: v for k, v in file_record.items() 
+                           if k in UploadedFile.__fields__})
+
+def can_access_file(file_record: dict, current_user: User) -> bool:
+    """Uploader, or anyone in the organization the file was uploaded under"""
+    if file_record["uploaded_by"] == current_user.username:
+        return True
+    return file_record["org_id"] is not None and file_record["org_id"] == current_user.org_id
+
+async def register_uploaded_file(file_id: str, filename: str, tmp_path: str,
+                                 sha256: str, size: int, user: User) -> UploadedFile:
+    """
+    Move a fully written temporary file (see blob_store.temp_path) into the
+    blob store, record it in the file catalog and return its metadata.
+    Content that is already stored is not written again.
+    """
+    try:
+        file_record = await file_catalog.add_file(
+            file_id, filename, size, get_file_type(filename), sha256, user,
+            store_content=lambda: blob_store.adopt(tmp_path, sha256),
+            remove_content=blob_store.remove
+        )
+    except BaseException:
+        blob_store.discard_temp(tmp_path)
+        raise
+    # Extract and index the text in the background
+    await document_ingestor.submit(file_record)
+    return to_uploaded_file(file_record)
+
+async def remove_catalog_file(file_id: str) -> bool:
+    """Remove a file from the catalog, then its content once nothing else uses it"""
+    return await file_catalog.remove_file(
+        file_id,
+        remove_content=blob_store.remove,
+        remove_object=lambda key: run_s3(delete_object, key)
+    )
+
+@asynccontextmanager
+async def open_local_copy(file_record: dict, scratch=scratch_space):
+    """
+    Local path of a file's content for the duration of the block (None if
+    the content is missing). Files stored directly in S3, or in a storage
+    backend without a local copy, are downloaded to a workspace of scratch
+    (a ScratchSpace) first.
+    """
+    if not file_record["storage_key"]:
+        async with blob_store.pinned_path(file_record["sha256"]) as path:
+            if path is not None:
+                yield path
+                return
+        if not await blob_store.exists(file_record["sha256"]):
+            yield None
+            return
+    
+    workspace = await scratch.acquire(file_record["size"])
+    try:
+        path = workspace.file_path(file_record["name"])
+        if file_record["storage_key"]:
+            await run_s3(get_s3_client().download_file, BUCKET_NAME, file_record["storage_key"], path)
+        else:
+            await blob_store.download(file_record["sha256"], path)
+        yield path
+    finally:
+        await workspace.release()
+
 @router.post("/upload", response_model=FileUploadResponse)
 async def upload_file(
     file: UploadFile = File(...),
@@ -58,43 +139,21 @@ async def upload_file(
                 detail=f"File type not allowed. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"
             )
         
-        # Read file content to check size
-        content = await file.read()
-        if not validate_file_size(len(content)):
+        file_id = str(uuid.uuid4())
+        
+        # Stream to disk in chunks, hashing and enforcing the size limit as we go
+        try:
+            sha256, file_size, tmp_path = await blob_store.spool_upload(file, MAX_FILE_SIZE)
+        except UploadTooLarge:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"File too large. Maximum size: {MAX_FILE_SIZE / (1024*1024):.1f}MB"
             )
         
-        # Generate unique filename
-        file_id = str(uuid.uuid4())
-        file_extension = os.path.splitext(file.filename)[1]
-        unique_filename = f"{file_id}{file_extension}"
-        file_path = os.path.join(UPLOAD_DIR, unique_filename)
-        
-        # Save file
-        with open(file_path, "wb") as buffer:
-            buffer.write(content)
-        
-        # Create file record
-        uploaded_file = UploadedFile(
-            id=file_id,
-            name=file.filename,
-            size=len(content),
-            type=get_file_type(file.filename),
-            url=f"/files/download/{file_id}",
-            uploaded_at=datetime.utcnow()
+        uploaded_file = await register_uploaded_file(
+            file_id, file.filename, tmp_path, sha256, file_size, current_user
         )
         
-        # Store in file database
-        FILE_DB[file_id] = {
-            **uploaded_file.dict(),
-            "original_filename": file.filename,
-            "stored_filename": unique_filename,
-            "file_path": file_path,
-            "uploaded_by": current_user.username
-        }
-        
         return FileUploadResponse(
             success=True,
             message="File uploaded successfully",
@@ -149,27 +208,61 @@ async def download_file(
     Download a file by its ID
     """
     try:
-        file_record = FILE_DB.get(file_id)
+        file_record = await file_catalog.get_file(file_id)
         
-        if not file_record:
+        # Files of other users and organizations are reported as missing
+        if not file_record or not can_access_file(file_record, current_user):
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="File not found"
             )
         
-        file_path = file_record["file_path"]
-        
-        if not os.path.exists(file_path):
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="File not found on disk"
+        # Uploaded straight to S3: send the client there instead of proxying
+        if file_record["storage_key"]:
+            url = await run_s3(
+                presigned_get_url, file_record["storage_key"],
+                file_record["original_filename"], file_record["type"]
             )
+            return RedirectResponse(url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
         
-        return FileResponse(
-            path=file_path,
-            filename=file_record["original_filename"],
-            media_type=file_record["type"]
-        )
+        # With S3 storage this fetches cold files into the local cache first,
+        # and keeps them there until the response has been sent
+        pin = AsyncExitStack()
+        file_path = await pin.enter_async_context(blob_store.pinned_path(file_record["sha256"]))
+        try:
+            # No local copy (S3 storage without a cache): download from storage directly
+            if file_path is None:
+                url = await blob_store.download_url(
+                    file_record["sha256"], file_record["original_filename"], file_record["type"]
+                )
+                if url is not None:
+                    await pin.aclose()
+                    return RedirectResponse(url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+            
+            try:
+                if file_path is None:
+                    raise FileNotFoundError(file_record["sha256"])
+                stat_result = await run_in_threadpool(os.stat, file_path)
+            except FileNotFoundError:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="File not found on disk"
+                )
+            
+            # Supports Range/If-Range and answers 304 to If-None-Match; the ETag is
+            # the content hash, and a file ID's content never changes
+            return ConditionalFileResponse(
+                path=file_path,
+                filename=file_record["original_filename"],
+                media_type=file_record["type"],
+                etag=file_record["sha256"],
+                stat_result=stat_result,
+                cache_control=FILE_DOWNLOAD_CACHE_CONTROL,
+                background=BackgroundTask(pin.aclose)
+            )
+        except BaseException:
+            await pin.aclose()
+            raise
         
     except HTTPException:
         raise
@@ -188,7 +281,7 @@ async def get_file_info(
     Get file information by ID
     """
     try:
-        file_record = FILE_DB.get(file_id)
+        file_record = await file_catalog.get_file(file_id)
         
         if not file_record:
             raise HTTPException(
@@ -196,8 +289,7 @@ async def get_file_info(
                 detail="File not found"
             )
         
-        return UploadedFile(**{k: v for k, v in file_record.items() 
-                             if k in UploadedFile.__fields__})
+        return to_uploaded_file(file_record)
         
     except HTTPException:
         raise
@@ -209,23 +301,16 @@ async def get_file_info(
 
 @router.get("/list", response_model=List[UploadedFile])
 async def list_user_files(
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of files to return"),
+    before: Optional[str] = Query(None, description="Return files older than this file ID (the last ID of the previous page)"),
     current_user: User = Depends(get_current_user)
 ):
     """
-    List all files uploaded by the current user
+    List files uploaded by the current user, newest first
     """
     try:
-        user_files = []
-        
-        for file_record in FILE_DB.values():
-            if file_record["uploaded_by"] == current_user.username:
-                user_files.append(UploadedFile(**{k: v for k, v in file_record.items() 
-                                                 if k in UploadedFile.__fields__}))
-        
-        # Sort by upload date (newest first)
-        user_files.sort(key=lambda x: x.uploaded_at, reverse=True)
-        
-        return user_files
+        file_records = await file_catalog.list_files(current_user.username, limit, before)
+        return [to_uploaded_file(file_record) for file_record in file_records]
         
     except Exception as e:
         raise HTTPException(
@@ -242,7 +327,7 @@ async def delete_file(
     Delete a file by its ID
     """
     try:
-        file_record = FILE_DB.get(file_id)
+        file_record = await file_catalog.get_file(file_id)
         
         if not file_record:
             raise HTTPException(
@@ -257,13 +342,11 @@ async def delete_file(
                 detail="You don't have permission to delete this file"
             )
         
-        # Delete file from disk
-        file_path = file_record["file_path"]
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        
-        # Remove from database
-        del FILE_DB[file_id]
+        if not await remove_catalog_file(file_id):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="File not found"
+            )
         
         return SuccessResponse(
             success=True,
@@ -287,6 +370,8 @@ async def file_health_check():
         "status": "healthy", 
         "service": "file_management",
         "upload_dir": UPLOAD_DIR,
+        "storage": storage.stats(),
         "max_file_size_mb": MAX_FILE_SIZE / (1024*1024),
-        "allowed_extensions": list(ALLOWED_EXTENSIONS)
+        "allowed_extensions": list(ALLOWED_EXTENSIONS),
+        "catalog_cache": file_catalog.cache_stats()
     }
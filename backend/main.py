@@ -1,6 +1,6 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 import os
 
 # Import route modules
@@ -10,8 +10,25 @@ from user_routes import router as user_router
 from query_routes import router as query_router
 from timesheet_routes import router as timesheet_router, chatbot_router
 from file_routes import router as file_router
+from resumable_uploads import router as resumable_upload_router
+from direct_uploads import router as direct_upload_router
 from file_converter_routes import router as file_converter_router
 from database_setup import initialize_database
+from database_pool import get_pool, close_pool
+from database_async import db
+from password_hashing import password_hasher, PasswordHasherBusy
+from utils.uploads import MaxBodySizeMiddleware
+from utils.http_files import ConditionalStaticFiles
+from office_pool import office_pool
+from conversion_jobs import conversion_jobs
+from conversion_cache import conversion_cache
+from utils.scratch import scratch_space
+from document_ingest import document_ingestor
+import file_converter_routes
+import file_routes
+import query_routes
+import resumable_uploads
+import timesheet_import
 
 # ============================================================
 #   FastAPI App Configuration
@@ -24,6 +41,23 @@ app = FastAPI(
     redoc_url="/redoc"
 )
 
+# ============================================================
+#   Upload Size Limits (reject oversized bodies before parsing)
+# ============================================================
+MULTIPART_OVERHEAD = 64 * 1024
+app.add_middleware(
+    MaxBodySizeMiddleware,
+    limits={
+        "/files/upload-multiple": 10 * file_routes.MAX_FILE_SIZE + MULTIPART_OVERHEAD,
+        "/files/upload": file_routes.MAX_FILE_SIZE + MULTIPART_OVERHEAD,
+        "/files/resumable": resumable_uploads.RESUMABLE_MAX_CHUNK_SIZE + MULTIPART_OVERHEAD,
+        "/query/upload-multiple": 10 * query_routes.MAX_FILE_SIZE + MULTIPART_OVERHEAD,
+        "/query/upload": query_routes.MAX_FILE_SIZE + MULTIPART_OVERHEAD,
+        "/convert_file": file_converter_routes.CONVERSION_MAX_FILE_SIZE + MULTIPART_OVERHEAD,
+        "/timesheet/entries/bulk": timesheet_import.BULK_IMPORT_MAX_BYTES,
+    }
+)
+
 # ============================================================
 #   CORS Configuration (Merged from both versions)
 # ============================================================
@@ -49,13 +83,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ============================================================
+#   Overload Handling
+# ============================================================
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
 # ============================================================
 #   Static Files (Uploads)
 # ============================================================
 if not os.path.exists("uploads"):
     os.makedirs("uploads")
 
-app.mount("/static", StaticFiles(directory="uploads"), name="static")
+# Public and unauthenticated: only legacy files saved at the top of uploads/.
+# Stored file content lives under STORAGE_LOCAL_ROOT and is only served by
+# the access-checked /files/download.
+app.mount("/static", ConditionalStaticFiles(directory="uploads"), name="static")
 
 # ============================================================
 #   Routers (All Combined)
@@ -67,6 +111,8 @@ app.include_router(query_router)
 app.include_router(timesheet_router)
 app.include_router(chatbot_router)
 app.include_router(file_router)
+app.include_router(resumable_upload_router)
+app.include_router(direct_upload_router)
 app.include_router(file_converter_router)
 
 # ============================================================
@@ -97,6 +143,10 @@ async def root():
 async def startup_event():
     print("🚀 Starting MatterAI Backend...")
 
+    office_pool.start_in_background()
+    scratch_space.start_janitor()
+    document_ingestor.start(file_routes.open_local_copy)
+
     try:
         if initialize_database():
             print("✅ Database initialized")
@@ -108,6 +158,19 @@ async def startup_event():
         print(f"⚠️ Database error: {str(e)[:80]}...")
         print("📝 Continuing with fallback data...")
 
+# ============================================================
+#   Shutdown Event → Release Pooled DB Connections
+# ============================================================
+@app.on_event("shutdown")
+async def shutdown_event():
+    db.close()
+    close_pool()
+    password_hasher.shutdown()
+    await conversion_jobs.close()
+    await document_ingestor.close()
+    await scratch_space.close()
+    await office_pool.close()
+
 # ============================================================
 #   Health Check
 # ============================================================
@@ -123,7 +186,13 @@ async def health_check():
             "files": "healthy",
             "file_converter": "healthy",
             "database": "healthy"
-        }
+        },
+        "database_pool": get_pool().stats(),
+        "office_pool": office_pool.stats(),
+        "conversion_jobs": conversion_jobs.stats(),
+        "conversion_cache": conversion_cache.stats(),
+        "scratch_space": scratch_space.stats(),
+        "document_ingest": document_ingestor.stats()
     }
 
 # ============================================================
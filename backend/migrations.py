@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migrations.
+
+Each migration runs once and is recorded in public.schema_migrations.
+run_migrations() is called at startup; a Postgres advisory lock makes
+concurrent uvicorn workers apply pending migrations exactly once.
+
+Migrations marked transactional=False run in autocommit mode, which
+CREATE INDEX CONCURRENTLY requires (it builds the index without blocking
+writes to the table). Their statements must be idempotent (IF NOT EXISTS),
+since a failure part-way leaves the earlier statements applied. A failed
+concurrent build also leaves an INVALID index behind, which IF NOT EXISTS
+would then skip, so such leftovers are dropped before each build.
+"""
+
+import re
+import time
+
+from psycopg2 import extensions
+
+from database_setup import get_connection
+
+# Arbitrary constant identifying the migration lock
+MIGRATION_LOCK_ID = 748213
+# How long a worker waits for another worker's migrations to finish
+MIGRATION_LOCK_TIMEOUT_SECONDS = 600
+
+CONCURRENT_INDEX_PATTERN = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE
+)
+
+MIGRATIONS = [
+    {
+        "version": 1,
+        "name": "timesheet_entries_btree_indexes",
+        "transactional": False,
+        "statements": [
+            # Listing / keyset pagination / date-range filters (newest first)
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_timesheet_entries_user_date
+            ON public.timesheet_entries (user_id, entry_date DESC, id DESC)
+            """,
+            # Listing filtered by entry type
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_timesheet_entries_user_type_date
+            ON public.timesheet_entries (user_id, entry_type, entry_date DESC, id DESC)
+            """,
+        ],
+    },
+    {
+        "version": 2,
+        "name": "timesheet_entries_trigram_indexes",
+        "transactional": False,
+        "statements": [
+            "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+            # ILIKE '%...%' filters on client / matter / timekeeper
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_timesheet_entries_client_trgm
+            ON public.timesheet_entries USING gin (client gin_trgm_ops)
+            """,
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_timesheet_entries_matter_trgm
+            ON public.timesheet_entries USING gin (matter gin_trgm_ops)
+            """,
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_timesheet_entries_timekeeper_trgm
+            ON public.timesheet_entries USING gin (timekeeper gin_trgm_ops)
+            """,
+        ],
+    },
+    {
+        "version": 3,
+        "name": "timesheet_daily_rollups",
+        "transactional": True,
+        "statements": [
+            # One row per user/day/client/matter/timekeeper/phase/type/currency
+            """
+            CREATE TABLE IF NOT EXISTS public.timesheet_daily_rollups (
+                user_id INTEGER NOT NULL REFERENCES public.users(id) ON DELETE CASCADE,
+                entry_date DATE NOT NULL,
+                client VARCHAR(255) NOT NULL,
+                matter TEXT NOT NULL,
+                timekeeper VARCHAR(255) NOT NULL,
+                phase_task VARCHAR(255) NOT NULL,
+                entry_type VARCHAR(20) NOT NULL,
+                currency VARCHAR(10) NOT NULL,
+                entry_count INTEGER NOT NULL DEFAULT 0,
+                hours_worked NUMERIC(14,2) NOT NULL DEFAULT 0,
+                hours_billed NUMERIC(14,2) NOT NULL DEFAULT 0,
+                total NUMERIC(16,2) NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, entry_date, client, matter, timekeeper, phase_task, entry_type, currency)
+            )
+            """,
+            # Applies the net change of one statement (transition tables keep COPY cheap)
+            """
+            CREATE OR REPLACE FUNCTION public.timesheet_rollup_apply() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    INSERT INTO public.timesheet_daily_rollups AS r (
+                        user_id, entry_date, client, matter, timekeeper, phase_task, entry_type, currency,
+                        entry_count, hours_worked, hours_billed, total
+                    )
+                    SELECT user_id, entry_date, client, matter, timekeeper,
+                           COALESCE(phase_task, ''), entry_type, COALESCE(currency, 'USD'),
+                           -COUNT(*), -COALESCE(SUM(hours_worked), 0),
+                           -COALESCE(SUM(hours_billed), 0), -COALESCE(SUM(total), 0)
+                    FROM old_rows
+                    GROUP BY 1, 2, 3, 4, 5, 6, 7, 8
+                    ON CONFLICT (user_id, entry_date, client, matter, timekeeper, phase_task, entry_type, currency)
+                    DO UPDATE SET
+                        entry_count = r.entry_count + EXCLUDED.entry_count,
+                        hours_worked = r.hours_worked + EXCLUDED.hours_worked,
+                        hours_billed = r.hours_billed + EXCLUDED.hours_billed,
+                        total = r.total + EXCLUDED.total;
+                END IF;
+
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    INSERT INTO public.timesheet_daily_rollups AS r (
+                        user_id, entry_date, client, matter, timekeeper, phase_task, entry_type, currency,
+                        entry_count, hours_worked, hours_billed, total
+                    )
+                    SELECT user_id, entry_date, client, matter, timekeeper,
+                           COALESCE(phase_task, ''), entry_type, COALESCE(currency, 'USD'),
+                           COUNT(*), COALESCE(SUM(hours_worked), 0),
+                           COALESCE(SUM(hours_billed), 0), COALESCE(SUM(total), 0)
+                    FROM new_rows
+                    GROUP BY 1, 2, 3, 4, 5, 6, 7, 8
+                    ON CONFLICT (user_id, entry_date, client, matter, timekeeper, phase_task, entry_type, currency)
+                    DO UPDATE SET
+                        entry_count = r.entry_count + EXCLUDED.entry_count,
+                        hours_worked = r.hours_worked + EXCLUDED.hours_worked,
+                        hours_billed = r.hours_billed + EXCLUDED.hours_billed,
+                        total = r.total + EXCLUDED.total;
+                END IF;
+
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    DELETE FROM public.timesheet_daily_rollups r
+                    USING (SELECT DISTINCT user_id, entry_date, client, matter, timekeeper,
+                                  COALESCE(phase_task, '') AS phase_task, entry_type,
+                                  COALESCE(currency, 'USD') AS currency
+                           FROM old_rows) o
+                    WHERE r.user_id = o.user_id AND r.entry_date = o.entry_date
+                      AND r.client = o.client AND r.matter = o.matter
+                      AND r.timekeeper = o.timekeeper AND r.phase_task = o.phase_task
+                      AND r.entry_type = o.entry_type AND r.currency = o.currency
+                      AND r.entry_count <= 0;
+                END IF;
+
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+            """,
+            "DROP TRIGGER IF EXISTS trg_timesheet_rollup_insert ON public.timesheet_entries",
+            "DROP TRIGGER IF EXISTS trg_timesheet_rollup_update ON public.timesheet_entries",
+            "DROP TRIGGER IF EXISTS trg_timesheet_rollup_delete ON public.timesheet_entries",
+            """
+            CREATE TRIGGER trg_timesheet_rollup_insert
+            AFTER INSERT ON public.timesheet_entries
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION public.timesheet_rollup_apply()
+            """,
+            """
+            CREATE TRIGGER trg_timesheet_rollup_update
+            AFTER UPDATE ON public.timesheet_entries
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION public.timesheet_rollup_apply()
+            """,
+            """
+            CREATE TRIGGER trg_timesheet_rollup_delete
+            AFTER DELETE ON public.timesheet_entries
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION public.timesheet_rollup_apply()
+            """,
+            # Backfill; creating the triggers locked out writers, so nothing is missed
+            "TRUNCATE public.timesheet_daily_rollups",
+            """
+            INSERT INTO public.timesheet_daily_rollups (
+                user_id, entry_date, client, matter, timekeeper, phase_task, entry_type, currency,
+                entry_count, hours_worked, hours_billed, total
+            )
+            SELECT user_id, entry_date, client, matter, timekeeper,
+                   COALESCE(phase_task, ''), entry_type, COALESCE(currency, 'USD'),
+                   COUNT(*), COALESCE(SUM(hours_worked), 0),
+                   COALESCE(SUM(hours_billed), 0), COALESCE(SUM(total), 0)
+            FROM public.timesheet_entries
+            GROUP BY 1, 2, 3, 4, 5, 6, 7, 8
+            """,
+        ],
+    },
+    {
+        "version": 4,
+        "name": "chat_sessions",
+        "transactional": True,
+        "statements": [
+            """
+            CREATE TABLE IF NOT EXISTS public.chat_sessions (
+                session_id VARCHAR(64) PRIMARY KEY,
+                data JSONB NOT NULL,
+                expires_at TIMESTAMP NOT NULL,
+                updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_chat_sessions_expires_at ON public.chat_sessions (expires_at)",
+            "CREATE INDEX IF NOT EXISTS idx_chat_sessions_updated_at ON public.chat_sessions (updated_at)",
+        ],
+    },
+    {
+        # Uploaded file metadata (was the in-process file_routes.FILE_DB) and
+        # reference counts for the content-addressed blobs
+        "version": 5,
+        "name": "file_catalog",
+        "transactional": True,
+        "statements": [
+            """
+            CREATE TABLE IF NOT EXISTS public.file_blobs (
+                sha256 CHAR(64) PRIMARY KEY,
+                size BIGINT NOT NULL,
+                ref_count INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT NOW()
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS public.file_catalog (
+                id VARCHAR(36) PRIMARY KEY,
+                name TEXT NOT NULL,
+                size BIGINT NOT NULL,
+                content_type VARCHAR(255) NOT NULL,
+                sha256 CHAR(64) NOT NULL REFERENCES public.file_blobs(sha256),
+                user_id INTEGER,
+                org_id INTEGER,
+                uploaded_by VARCHAR(255) NOT NULL,
+                uploaded_at TIMESTAMP NOT NULL DEFAULT NOW()
+            )
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_file_catalog_owner_uploaded
+            ON public.file_catalog (uploaded_by, uploaded_at DESC, id DESC)
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_file_catalog_sha256 ON public.file_catalog (sha256)",
+        ],
+    },
+    {
+        # Files uploaded straight to S3 through presigned URLs have an object
+        # key instead of a local blob
+        "version": 6,
+        "name": "file_catalog_object_storage",
+        "transactional": True,
+        "statements": [
+            "ALTER TABLE public.file_catalog ADD COLUMN IF NOT EXISTS storage_key TEXT",
+            "ALTER TABLE public.file_catalog ALTER COLUMN sha256 DROP NOT NULL",
+            """
+            ALTER TABLE public.file_catalog
+            ADD CONSTRAINT file_catalog_has_content
+            CHECK (sha256 IS NOT NULL OR storage_key IS NOT NULL)
+            """,
+        ],
+    },
+    {
+        # Full-text search over timesheet entries (/query/search). The
+        # generated column keeps the index current on every insert/update;
+        # adding it rewrites the table once.
+        "version": 7,
+        "name": "timesheet_entries_search",
+        "transactional": False,
+        "statements": [
+            # Lets one GIN index filter by user_id and match text together
+            "CREATE EXTENSION IF NOT EXISTS btree_gin",
+            """
+            ALTER TABLE public.timesheet_entries
+            ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+                setweight(to_tsvector('english'::regconfig, coalesce(client, '')), 'A') ||
+                setweight(to_tsvector('english'::regconfig, coalesce(matter, '')), 'A') ||
+                setweight(to_tsvector('english'::regconfig, coalesce(timekeeper, '')), 'B') ||
+                setweight(to_tsvector('english'::regconfig, coalesce(phase_task, '') || ' ' || coalesce(activity, '')), 'C') ||
+                setweight(to_tsvector('english'::regconfig, coalesce(narrative, '')), 'D')
+            ) STORED
+            """,
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_timesheet_entries_search
+            ON public.timesheet_entries USING gin (user_id, search_vector)
+            """,
+        ],
+    },
+    {
+        # Searchable text of uploaded documents, one row per chunk
+        "version": 8,
+        "name": "document_chunks",
+        "transactional": True,
+        "statements": [
+            """
+            CREATE TABLE IF NOT EXISTS public.document_chunks (
+                file_id VARCHAR(36) NOT NULL REFERENCES public.file_catalog(id) ON DELETE CASCADE,
+                chunk_index INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                search_vector tsvector GENERATED ALWAYS AS (
+                    to_tsvector('english'::regconfig, content)
+                ) STORED,
+                PRIMARY KEY (file_id, chunk_index)
+            )
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_document_chunks_search
+            ON public.document_chunks USING gin (search_vector)
+            """,
+        ],
+    },
+    {
+        # Text extraction state per uploaded file; pending rows are claimed by
+        # the ingestion workers of any process
+        "version": 9,
+        "name": "document_texts",
+        "transactional": True,
+        "statements": [
+            """
+            CREATE TABLE IF NOT EXISTS public.document_texts (
+                file_id VARCHAR(36) PRIMARY KEY REFERENCES public.file_catalog(id) ON DELETE CASCADE,
+                status VARCHAR(20) NOT NULL,
+                chunk_count INTEGER NOT NULL DEFAULT 0,
+                char_count INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                claimed_at TIMESTAMP,
+                created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                indexed_at TIMESTAMP
+            )
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_document_texts_status
+            ON public.document_texts (status, claimed_at)
+            """,
+        ],
+    },
+]
+
+
+def _ensure_migrations_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS public.schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP DEFAULT NOW()
+        );
+    """)
+
+
+def _drop_invalid_index(cursor, statement):
+    """Drop the INVALID leftover of an interrupted CREATE INDEX CONCURRENTLY"""
+    match = CONCURRENT_INDEX_PATTERN.search(statement)
+    if not match:
+        return
+    index_name = match.group(1)
+    cursor.execute(
+        "SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)",
+        (f"public.{index_name}",)
+    )
+    row = cursor.fetchone()
+    if row and row[0]:
+        print(f"⚠️ Dropping invalid index {index_name} left by an interrupted build")
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS public.{index_name}")
+
+
+def _apply(conn, migration):
+    cursor = conn.cursor()
+    try:
+        if migration.get("transactional", True):
+            for statement in migration["statements"]:
+                cursor.execute(statement)
+            cursor.execute(
+                "INSERT INTO public.schema_migrations (version, name) VALUES (%s, %s)",
+                (migration["version"], migration["name"])
+            )
+            conn.commit()
+        else:
+            conn.autocommit = True
+            try:
+                for statement in migration["statements"]:
+                    _drop_invalid_index(cursor, statement)
+                    cursor.execute(statement)
+                cursor.execute(
+                    "INSERT INTO public.schema_migrations (version, name) VALUES (%s, %s)",
+                    (migration["version"], migration["name"])
+                )
+            finally:
+                conn.autocommit = False
+    except Exception:
+        if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def run_migrations():
+    """
+    Apply all pending migrations in version order.
+    Returns True when the schema is up to date.
+    """
+    conn = get_connection()
+    if not conn:
+        print("❌ Could not connect to PostgreSQL for migrations")
+        return False
+
+    cursor = conn.cursor()
+    locked = False
+    try:
+        # Session-level lock, held across the non-transactional migrations too.
+        # Poll instead of blocking in pg_advisory_lock: a waiting statement holds
+        # a snapshot, and CREATE INDEX CONCURRENTLY would wait for it forever.
+        conn.autocommit = True
+        deadline = time.monotonic() + MIGRATION_LOCK_TIMEOUT_SECONDS
+        while True:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+            locked = cursor.fetchone()[0]
+            if locked:
+                break
+            if time.monotonic() > deadline:
+                raise TimeoutError("Timed out waiting for another process to finish migrations")
+            time.sleep(1)
+        conn.autocommit = False
+
+        _ensure_migrations_table(cursor)
+        cursor.execute("SELECT version FROM public.schema_migrations")
+        applied = {row[0] for row in cursor.fetchall()}
+        conn.commit()
+
+        for migration in sorted(MIGRATIONS, key=lambda m: m["version"]):
+            if migration["version"] in applied:
+                continue
+            print(f"🔄 Applying migration {migration['version']}: {migration['name']}...")
+            _apply(conn, migration)
+            print(f"✅ Migration {migration['version']} applied")
+
+        return True
+
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        return False
+
+    finally:
+        try:
+            if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if locked:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+                conn.commit()
+        except Exception:
+            pass
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    run_migrations()
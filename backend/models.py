@@ -165,9 +165,44 @@ class TimesheetResponse(BaseModel):
 class TimesheetListResponse(BaseModel):
     success: bool
     entries: List[TimesheetEntry]
-    total_count: int
+    total_count: Optional[int] = Field(None, description="Total matching entries (omitted when include_total=false)")
     page: int = 1
     page_size: int = 10
+    next_cursor: Optional[str] = Field(None, description="Cursor for the next page, if any")
+    has_more: bool = False
+
+class TimesheetSummaryRow(BaseModel):
+    client: Optional[str] = None
+    matter: Optional[str] = None
+    timekeeper: Optional[str] = None
+    phase_task: Optional[str] = None
+    entry_type: Optional[str] = None
+    period: Optional[date] = None
+    currency: str
+    entry_count: int = 0
+    hours_worked: float = 0
+    hours_billed: float = 0
+    total: float = 0
+
+class TimesheetSummaryResponse(BaseModel):
+    success: bool
+    group_by: List[str]
+    period: str
+    groups: List[TimesheetSummaryRow]
+    totals: List[TimesheetSummaryRow] = Field(default=[], description="Grand totals per currency")
+
+class BulkImportRowError(BaseModel):
+    row: int
+    errors: List[str]
+
+class BulkImportResponse(BaseModel):
+    success: bool
+    message: str
+    total_rows: int = 0
+    inserted: int = 0
+    failed: int = 0
+    errors: List[BulkImportRowError] = []
+    errors_truncated: bool = False
 
 # File Upload Models
 class FileUploadResponse(BaseModel):
@@ -175,6 +210,80 @@ class FileUploadResponse(BaseModel):
     message: str
     file: Optional[UploadedFile] = None
 
+# Resumable Upload Models
+class ResumableUploadInit(BaseModel):
+    filename: str = Field(..., min_length=1, description="Original file name")
+    size: int = Field(..., gt=0, description="Total file size in bytes")
+    chunk_size: Optional[int] = Field(None, gt=0, description="Requested chunk size in bytes")
+    sha256: Optional[str] = Field(None, description="Hex SHA-256 of the whole file, verified on commit")
+
+class ResumableUploadStatus(BaseModel):
+    success: bool = True
+    upload_id: str
+    filename: str
+    size: int
+    chunk_size: int
+    total_chunks: int
+    received_chunks: List[int] = []
+    missing_chunks: List[int] = []
+    received_bytes: int = 0
+    complete: bool = False
+    expires_at: Optional[datetime] = None
+
+class ResumableChunkResponse(BaseModel):
+    success: bool = True
+    upload_id: str
+    index: int
+    offset: int
+    size: int
+    sha256: str
+
+# Direct (Presigned) Upload Models
+class DirectUploadInit(BaseModel):
+    filename: str = Field(..., min_length=1, description="Original file name")
+    size: int = Field(..., gt=0, description="Total file size in bytes")
+    content_type: Optional[str] = Field(None, description="MIME type; guessed from the file name when omitted")
+
+class DirectUploadPart(BaseModel):
+    part_number: int
+    url: str
+
+class DirectUploadTicket(BaseModel):
+    success: bool = True
+    file_id: str
+    upload_token: str
+    method: str  # "PUT" (single request) or "MULTIPART"
+    url: Optional[str] = None
+    headers: dict = {}
+    part_size: Optional[int] = None
+    parts: List[DirectUploadPart] = []
+    expires_at: datetime
+
+class DirectUploadCompletedPart(BaseModel):
+    part_number: int
+    etag: str
+
+class DirectUploadComplete(BaseModel):
+    upload_token: str
+    parts: Optional[List[DirectUploadCompletedPart]] = Field(
+        None, description="ETags returned by each part PUT; listed from S3 when omitted"
+    )
+
+class DirectUploadAbort(BaseModel):
+    upload_token: str
+
+class DirectUploadRefresh(BaseModel):
+    upload_token: str
+    part_numbers: Optional[List[int]] = Field(
+        None, description="Parts to sign new URLs for; all parts when omitted"
+    )
+
+class PresignedDownload(BaseModel):
+    success: bool = True
+    file_id: str
+    url: str
+    expires_at: datetime
+
 # Generic Response Models
 class SuccessResponse(BaseModel):
     success: bool = True
@@ -0,0 +1,326 @@
+# Office Conversion Worker Pool
+#
+# Keeps OFFICE_POOL_SIZE warm LibreOffice instances running under unoserver,
+# one per port pair and user profile, and converts documents by running the
+# lightweight `unoconvert` client against an idle worker. This avoids the
+# multi-second LibreOffice cold start per request, and all process handling
+# is asyncio-based so the event loop never blocks.
+#
+# Ports are picked by the OS each time a worker starts, so every uvicorn
+# process can run its own pool on one host without collisions.
+#
+# Workers are restarted when they crash or a conversion times out, and
+# recycled after OFFICE_WORKER_MAX_JOBS conversions to keep memory in check.
+# Without unoserver installed, each conversion falls back to a one-shot
+# `libreoffice --headless` process (still async, concurrency bounded).
+
+import asyncio
+import os
+import shutil
+import socket
+import tempfile
+import time
+
+OFFICE_POOL_SIZE = int(os.getenv("OFFICE_POOL_SIZE", 2))
+OFFICE_WORKER_MAX_JOBS = int(os.getenv("OFFICE_WORKER_MAX_JOBS", 200))
+OFFICE_JOB_TIMEOUT_SECONDS = float(os.getenv("OFFICE_JOB_TIMEOUT_SECONDS", 120))
+OFFICE_WORKER_STARTUP_TIMEOUT_SECONDS = float(os.getenv("OFFICE_WORKER_STARTUP_TIMEOUT_SECONDS", 30))
+# Another process can take a picked port before unoserver binds it; retry with new ones
+OFFICE_WORKER_START_ATTEMPTS = 3
+# How long a request may wait for a free worker
+OFFICE_QUEUE_TIMEOUT_SECONDS = float(os.getenv("OFFICE_QUEUE_TIMEOUT_SECONDS", 300))
+
+UNOSERVER_BIN = os.getenv("UNOSERVER_BIN", "unoserver")
+UNOCONVERT_BIN = os.getenv("UNOCONVERT_BIN", "unoconvert")
+LIBREOFFICE_BIN = os.getenv("LIBREOFFICE_BIN", "libreoffice")
+
+
+class OfficeConversionError(RuntimeError):
+    """Raised when a document could not be converted"""
+
+
+async def _kill(process):
+    if process is None or process.returncode is not None:
+        return
+    try:
+        process.kill()
+    except ProcessLookupError:
+        return
+    await process.wait()
+
+
+async def _run(args, timeout: float):
+    """Run a command; returns (returncode, stderr). Kills it on timeout."""
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        _, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except BaseException:
+        await _kill(process)
+        raise
+    return process.returncode, stderr.decode("utf-8", errors="replace")
+
+
+def _free_ports(count: int) -> list:
+    """Distinct local TCP ports that are currently unused (picked by the OS)"""
+    sockets = []
+    try:
+        for _ in range(count):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sockets.append(sock)
+            sock.bind(("127.0.0.1", 0))
+        return [sock.getsockname()[1] for sock in sockets]
+    finally:
+        for sock in sockets:
+            sock.close()
+
+
+def _output_path(input_path: str, output_dir: str, target_format: str) -> str:
+    base_name = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(output_dir, f"{base_name}.{target_format}")
+
+
+class OfficeWorker:
+    """One unoserver process with its own ports and LibreOffice profile"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.uno_port = None
+        self.port = None
+        self.profile_dir = None
+        self.process = None
+        self.jobs = 0
+        self.restarts = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def _wait_until_listening(self):
+        deadline = time.monotonic() + OFFICE_WORKER_STARTUP_TIMEOUT_SECONDS
+        while time.monotonic() < deadline:
+            if not self.alive:
+                raise OfficeConversionError(f"Office worker {self.index} exited during startup")
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", self.port)
+                writer.close()
+            except OSError:
+                await asyncio.sleep(0.25)
+                continue
+            # The listener could belong to another process that took the port,
+            # in which case ours fails to bind and exits
+            await asyncio.sleep(0.25)
+            if self.alive:
+                return
+        raise OfficeConversionError(f"Office worker {self.index} did not start in time")
+
+    async def _launch(self):
+        self.uno_port, self.port = _free_ports(2)
+        self.profile_dir = tempfile.mkdtemp(prefix=f"office_worker_{self.index}_")
+        self.process = await asyncio.create_subprocess_exec(
+            UNOSERVER_BIN,
+            "--interface", "127.0.0.1",
+            "--port", str(self.port),
+            "--uno-port", str(self.uno_port),
+            "--user-installation", f"file://{self.profile_dir}",
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            await self._wait_until_listening()
+        except BaseException:
+            await self.stop()
+            raise
+
+    async def start(self):
+        self.jobs = 0
+        for attempt in range(1, OFFICE_WORKER_START_ATTEMPTS + 1):
+            try:
+                await self._launch()
+                return
+            except OfficeConversionError:
+                if attempt == OFFICE_WORKER_START_ATTEMPTS:
+                    raise
+
+    async def stop(self):
+        await _kill(self.process)
+        self.process = None
+        if self.profile_dir:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+            self.profile_dir = None
+
+    async def restart(self):
+        self.restarts += 1
+        await self.stop()
+        await self.start()
+
+    async def convert(self, input_path: str, output_path: str, target_format: str):
+        self.jobs += 1
+        returncode, stderr = await _run([
+            UNOCONVERT_BIN,
+            "--host", "127.0.0.1",
+            "--port", str(self.port),
+            "--convert-to", target_format,
+            input_path, output_path,
+        ], OFFICE_JOB_TIMEOUT_SECONDS)
+        if returncode != 0:
+            raise OfficeConversionError(f"Conversion failed: {stderr.strip()[-500:]}")
+
+
+class OfficePool:
+    def __init__(self, size: int = OFFICE_POOL_SIZE):
+        self.size = size
+        self.workers = []
+        self._idle = None
+        self._start_lock = asyncio.Lock()
+        self._fallback_slots = asyncio.Semaphore(size)
+        # Background tasks (warm-up, worker release) kept referenced until done
+        self._releasing = set()
+        self.mode = None
+        self.completed = 0
+        self.failed = 0
+        self._version = None
+
+    async def start(self):
+        if self.mode is not None:
+            return
+        async with self._start_lock:
+            if self.mode is not None:
+                return
+            if not (shutil.which(UNOSERVER_BIN) and shutil.which(UNOCONVERT_BIN)):
+                print("⚠️ unoserver not found, using one-shot LibreOffice conversions")
+                self.mode = "oneshot"
+                return
+
+            self._idle = asyncio.Queue()
+            workers = [OfficeWorker(i) for i in range(self.size)]
+            results = await asyncio.gather(*(worker.start() for worker in workers), return_exceptions=True)
+            for worker, result in zip(workers, results):
+                if isinstance(result, BaseException):
+                    print(f"⚠️ Office worker {worker.index} failed to start: {result}")
+                    continue
+                self.workers.append(worker)
+                self._idle.put_nowait(worker)
+
+            if not self.workers:
+                print("⚠️ No office workers started, using one-shot LibreOffice conversions")
+                self.mode = "oneshot"
+                return
+            print(f"✅ Started {len(self.workers)} office conversion workers")
+            self.mode = "pool"
+
+    async def _convert_pooled(self, input_path: str, output_path: str, target_format: str):
+        try:
+            worker = await asyncio.wait_for(self._idle.get(), OFFICE_QUEUE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            raise OfficeConversionError("All office workers are busy, try again later")
+
+        healthy = True
+        try:
+            if not worker.alive:
+                await worker.restart()
+            await worker.convert(input_path, output_path, target_format)
+        except asyncio.TimeoutError:
+            healthy = False
+            raise OfficeConversionError(f"Conversion timed out after {OFFICE_JOB_TIMEOUT_SECONDS:.0f}s")
+        except BaseException:
+            # A failed job may have been caused by a wedged or dead worker
+            healthy = worker.alive
+            raise
+        finally:
+            # Return the worker in the background so the caller isn't held up
+            # by a restart / recycle
+            task = asyncio.ensure_future(self._release(worker, healthy))
+            self._releasing.add(task)
+            task.add_done_callback(self._releasing.discard)
+
+    async def _release(self, worker: OfficeWorker, healthy: bool):
+        try:
+            if not healthy or not worker.alive or worker.jobs >= OFFICE_WORKER_MAX_JOBS:
+                await worker.restart()
+        except Exception as e:
+            print(f"⚠️ Office worker {worker.index} restart failed: {e}")
+        # A worker that failed to restart is retried by the next job that takes it
+        self._idle.put_nowait(worker)
+
+    async def _convert_oneshot(self, input_path: str, output_dir: str, target_format: str):
+        # A separate profile per run, so concurrent instances don't collide
+        profile_dir = tempfile.mkdtemp(prefix="office_oneshot_")
+        try:
+            async with self._fallback_slots:
+                returncode, stderr = await _run([
+                    LIBREOFFICE_BIN, "--headless",
+                    f"-env:UserInstallation=file://{profile_dir}",
+                    "--convert-to", target_format,
+                    input_path, "--outdir", output_dir,
+                ], OFFICE_JOB_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            raise OfficeConversionError(f"Conversion timed out after {OFFICE_JOB_TIMEOUT_SECONDS:.0f}s")
+        finally:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+        if returncode != 0:
+            raise OfficeConversionError(f"LibreOffice conversion failed: {stderr.strip()[-500:]}")
+
+    async def convert(self, input_path: str, output_dir: str, target_format: str = "pdf") -> str:
+        """Convert input_path into output_dir; returns the output file path"""
+        await self.start()
+        output_path = _output_path(input_path, output_dir, target_format)
+        try:
+            if self.mode == "pool":
+                await self._convert_pooled(input_path, output_path, target_format)
+            else:
+                await self._convert_oneshot(input_path, output_dir, target_format)
+        except BaseException:
+            self.failed += 1
+            raise
+        if not os.path.exists(output_path):
+            self.failed += 1
+            raise OfficeConversionError("Conversion produced no output")
+        self.completed += 1
+        return output_path
+
+    async def version(self) -> str:
+        """LibreOffice version string (identifies the converter for caching)"""
+        if self._version is None:
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    LIBREOFFICE_BIN, "--version",
+                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+                )
+                try:
+                    stdout, _ = await asyncio.wait_for(process.communicate(), 30)
+                except BaseException:
+                    await _kill(process)
+                    raise
+                self._version = stdout.decode("utf-8", errors="replace").strip() or "unknown"
+            except (OSError, asyncio.TimeoutError):
+                return "unknown"
+        return self._version
+
+    def start_in_background(self):
+        """Warm the workers up without delaying application startup"""
+        task = asyncio.ensure_future(self.start())
+        self._releasing.add(task)
+        task.add_done_callback(self._releasing.discard)
+
+    async def close(self):
+        for task in list(self._releasing):
+            task.cancel()
+        await asyncio.gather(*(worker.stop() for worker in self.workers), return_exceptions=True)
+        self.workers = []
+        self.mode = None
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode or "not_started",
+            "workers": len(self.workers),
+            "idle": self._idle.qsize() if self._idle is not None else 0,
+            "alive": sum(1 for worker in self.workers if worker.alive),
+            "restarts": sum(worker.restarts for worker in self.workers),
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+office_pool = OfficePool()
@@ -1,9 +1,9 @@
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel, EmailStr
 from models import SuccessResponse
-from database_utils import run_postgres_query
+from database_async import db
 from auth_routes import get_current_user, UserResponse
-import bcrypt
+from password_hashing import hash_password
 
 router = APIRouter(prefix="/org", tags=["Organization Management"])
 
@@ -25,85 +25,71 @@ async def create_organization(
     if current_user.role_name != "SuperAdmin":
         raise HTTPException(status_code=403, detail="Only SuperAdmin can create organizations")
 
-    check_org = run_postgres_query(
+    check_org = await db.fetchrow(
         "SELECT id FROM organizations WHERE name = %s",
         (data.org_name,)
     )
 
-    if check_org.get("data"):
+    if check_org:
         raise HTTPException(status_code=400, detail="Organization already exists")
 
     org_insert_query = """
         INSERT INTO organizations (name, created_at, updated_at)
         VALUES (%s, NOW(), NOW())
+        RETURNING id, name
     """
 
-    org_result = run_postgres_query(
-        org_insert_query,
-        (data.org_name,)
-    )
-
-    if not org_result.get("success"):
+    try:
+        org = await db.fetchrow(
+            org_insert_query,
+            (data.org_name,)
+        )
+    except Exception:
         raise HTTPException(status_code=500, detail="Failed to create organization")
 
-    # Fetch the created organization by name
-    fetch_org_query = "SELECT id, name FROM organizations WHERE name = %s"
-    fetch_org_result = run_postgres_query(fetch_org_query, (data.org_name,))
-    
-    if not fetch_org_result.get("data"):
+    if not org:
         raise HTTPException(status_code=500, detail="Failed to retrieve created organization")
-    
-    org = fetch_org_result["data"][0]
+
     new_org_id = org["id"]
 
     role_query = "SELECT id FROM roles WHERE role_name = 'OrgAdmin' LIMIT 1"
-    role_result = run_postgres_query(role_query)
+    org_admin_role_id = await db.fetchval(role_query)
 
-    if not role_result.get("data"):
+    if not org_admin_role_id:
         raise HTTPException(status_code=500, detail="OrgAdmin role not found. Create it first.")
 
-    org_admin_role_id = role_result["data"][0]["id"]
-
-    user_check = run_postgres_query(
+    user_check = await db.fetchrow(
         "SELECT id FROM users WHERE username = %s OR email = %s",
         (data.admin_username, data.admin_email)
     )
-    if user_check.get("data"):
+    if user_check:
         raise HTTPException(status_code=400, detail="Admin username or email already exists")
 
-    hashed_password = bcrypt.hashpw(
-        data.admin_password.encode("utf-8"),
-        bcrypt.gensalt()
-    ).decode("utf-8")
+    hashed_password = await hash_password(data.admin_password)
 
     user_insert_query = """
         INSERT INTO users (org_id, username, email, password, name, role_id, is_active)
         VALUES (%s, %s, %s, %s, %s, %s, TRUE)
+        RETURNING id, username, email, name
     """
 
-    admin_result = run_postgres_query(
-        user_insert_query,
-        (
-            new_org_id,
-            data.admin_username,
-            data.admin_email,
-            hashed_password,
-            data.admin_name,
-            org_admin_role_id
+    try:
+        admin = await db.fetchrow(
+            user_insert_query,
+            (
+                new_org_id,
+                data.admin_username,
+                data.admin_email,
+                hashed_password,
+                data.admin_name,
+                org_admin_role_id
+            )
         )
-    )
-
-    if not admin_result.get("success"):
+    except Exception:
         raise HTTPException(status_code=500, detail="Organization created, but failed to create admin user")
 
-    # Fetch the created user
-    fetch_user_query = "SELECT id, username, email, name FROM users WHERE email = %s"
-    fetch_user_result = run_postgres_query(fetch_user_query, (data.admin_email,))
-    
-    if not fetch_user_result.get("data"):
+    if not admin:
         raise HTTPException(status_code=500, detail="User created but could not retrieve details")
-    
-    admin = fetch_user_result["data"][0]
 
     return SuccessResponse(
         success=True,
@@ -131,34 +117,29 @@ async def create_user_by_org_admin(
     
     org_id = current_user.org_id
 
-    user_check = run_postgres_query(
+    user_check = await db.fetchrow(
         "SELECT id FROM users WHERE username = %s OR email = %s",
         (data.username, data.email)
     )
 
-    if user_check.get("data"):
+    if user_check:
         raise HTTPException(status_code=400, detail="Username or email already exists")
 
     role_query = "SELECT id FROM roles WHERE role_name = %s"
-    role_result = run_postgres_query(role_query, (data.role,))
+    role_id = await db.fetchval(role_query, (data.role,))
 
-    if role_result.get("data"):
-        role_id = role_result["data"][0]["id"]
-    else:
+    if not role_id:
         create_role_query = """
             INSERT INTO roles (role_name)
             VALUES (%s)
             RETURNING id;
         """
-        new_role = run_postgres_query(create_role_query, (data.role,))
-        if not new_role.get("success"):
+        try:
+            role_id = await db.fetchval(create_role_query, (data.role,))
+        except Exception:
             raise HTTPException(status_code=500, detail="Failed to create new role")
-        role_id = new_role["data"][0]["id"]
 
-    hashed_password = bcrypt.hashpw(
-        data.password.encode("utf-8"),
-        bcrypt.gensalt()
-    ).decode("utf-8")
+    hashed_password = await hash_password(data.password)
 
     user_insert_query = """
         INSERT INTO users (org_id, username, email, password, name, role_id, is_active)
@@ -166,23 +147,21 @@ async def create_user_by_org_admin(
         RETURNING id, username, email, name, role_id;
     """
 
-    user_result = run_postgres_query(
-        user_insert_query,
-        (
-            org_id,
-            data.username,
-            data.email,
-            hashed_password,
-            data.name,
-            role_id
+    try:
+        user = await db.fetchrow(
+            user_insert_query,
+            (
+                org_id,
+                data.username,
+                data.email,
+                hashed_password,
+                data.name,
+                role_id
+            )
         )
-    )
-
-    if not user_result.get("success"):
+    except Exception:
         raise HTTPException(status_code=500, detail="Failed to create user")
 
-    user = user_result["data"][0]
-
     return SuccessResponse(
         success=True,
         message=(
@@ -0,0 +1,124 @@
+# Password hashing off the event loop
+#
+# bcrypt is deliberately slow (~250ms per call). Running it inline in an async
+# handler freezes every other request on the worker, so hashing and
+# verification run on a bounded thread pool instead. bcrypt releases the GIL
+# while it works, so the pool spreads a login burst across all CPU cores.
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+# Max concurrent bcrypt operations (defaults to one per CPU core)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 4))
+# Max operations waiting for a worker before new requests are rejected
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", 256))
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing queue is full"""
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._stats = {
+            "completed": 0,
+            "rejected": 0,
+            "max_queue_depth": 0,
+            "total_wait_seconds": 0.0,
+            "total_run_seconds": 0.0,
+        }
+
+    def _run(self, fn, args, submitted_at):
+        started_at = time.monotonic()
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._stats["total_wait_seconds"] += started_at - submitted_at
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._stats["completed"] += 1
+                self._stats["total_run_seconds"] += time.monotonic() - started_at
+
+    async def _submit(self, fn, *args):
+        with self._lock:
+            if self._queued >= self.max_queue:
+                self._stats["rejected"] += 1
+                raise PasswordHasherBusy("Too many password operations in progress, try again shortly")
+            self._queued += 1
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._queued)
+
+        try:
+            future = self._executor.submit(self._run, fn, args, time.monotonic())
+        except BaseException:
+            self._unqueue()
+            raise
+        # _run un-queues the operation when it starts; one cancelled while still
+        # queued (the request went away) never starts, so un-queue it here
+        future.add_done_callback(lambda f: self._unqueue() if f.cancelled() else None)
+        return await asyncio.wrap_future(future)
+
+    def _unqueue(self):
+        with self._lock:
+            self._queued -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(_hash_password, password)
+
+    async def verify(self, password: str, stored_hash: str) -> bool:
+        return await self._submit(_verify_password, password, stored_hash)
+
+    def stats(self) -> dict:
+        with self._lock:
+            completed = self._stats["completed"]
+            return {
+                **self._stats,
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "queue_depth": self._queued,
+                "running": self._running,
+                "avg_wait_ms": round(self._stats["total_wait_seconds"] / completed * 1000, 2) if completed else 0.0,
+                "avg_run_ms": round(self._stats["total_run_seconds"] / completed * 1000, 2) if completed else 0.0,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+def _hash_password(password: str) -> str:
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+
+
+def _verify_password(password: str, stored_hash: str) -> bool:
+    try:
+        return bcrypt.checkpw(password.encode("utf-8"), stored_hash.encode("utf-8"))
+    except ValueError:
+        # Malformed hash stored for the user
+        return False
+
+
+# Shared hasher used by all routers
+password_hasher = PasswordHasher()
+
+
+async def hash_password(password: str) -> str:
+    """Hash a password with bcrypt on the hashing pool"""
+    return await password_hasher.hash(password)
+
+
+async def verify_password(password: str, stored_hash: str) -> bool:
+    """Check a password against a bcrypt hash on the hashing pool"""
+    return await password_hasher.verify(password, stored_hash)
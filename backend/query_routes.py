@@ -1,4 +1,5 @@
 from fastapi import APIRouter, HTTPException, Depends, status, File, UploadFile, Form
+from starlette.concurrency import run_in_threadpool
 from typing import List, Optional
 import uuid
 from datetime import datetime
@@ -10,6 +11,11 @@ from models import (
     SuccessResponse, ErrorResponse, DropdownData, User
 )
 from auth_routes import get_current_user
+from utils.uploads import UploadTooLarge
+from file_routes import blob_store, register_uploaded_file, remove_catalog_file
+import file_catalog
+import search_index
+from document_ingest import get_file_contexts
 
 router = APIRouter(prefix="/query", tags=["Query & Search"])
 
@@ -57,6 +63,13 @@ def validate_file_size(file_size: int) -> bool:
     """Validate file size"""
     return file_size <= MAX_FILE_SIZE
 
+def _remove_legacy_upload(file_id: str) -> bool:
+    for filename in os.listdir(UPLOAD_DIR):
+        if filename.startswith(file_id) and os.path.isfile(os.path.join(UPLOAD_DIR, filename)):
+            os.remove(os.path.join(UPLOAD_DIR, filename))
+            return True
+    return False
+
 @router.post("/search", response_model=QueryResponse)
 async def search_query(
     query_request: QueryRequest,
@@ -66,7 +79,6 @@ async def search_query(
     Process search query with optional file context
     """
     try:
-        # Mock search logic - replace with actual search implementation
         result = {
             "query": query_request.query,
             "type": query_request.selected_button,
@@ -80,17 +92,43 @@ async def search_query(
         if query_request.selected_button == "Translation":
             result["translation_result"] = f"Translated '{query_request.query}' to {query_request.selected_language}"
         elif query_request.selected_button == "Matters":
-            result["matters_found"] = ["Matter 1", "Matter 2", "Matter 3"]
+            result["matters_found"] = await search_index.search_matters(current_user.id, query_request.query)
         elif query_request.selected_button == "Entries":
-            result["entries_found"] = ["Entry 1", "Entry 2", "Entry 3"]
+            result["entries_found"] = await search_index.search_entries(current_user.id, query_request.query)
         else:
             result["general_result"] = f"Processed query: {query_request.query}"
+            result["entries_found"] = await search_index.search_entries(current_user.id, query_request.query)
+        
+        # Document text: within the attached files when there are any,
+        # otherwise (general queries only) across every readable document
+        if query_request.selected_button != "Translation" and (
+            query_request.uploaded_files or query_request.selected_button not in ("Matters", "Entries")
+        ):
+            file_ids = [file.id for file in query_request.uploaded_files] or None
+            result["documents_found"] = await search_index.search_documents(
+                current_user, query_request.query, file_ids=file_ids
+            )
         
-        # Process uploaded files if any
+        # Attached files: text was extracted in the background at upload,
+        # so this is a lookup rather than parsing the documents now
         files_processed = []
         if query_request.uploaded_files:
-            for file in query_request.uploaded_files:
-                files_processed.append(f"Processed file: {file.name}")
+            file_contexts = await get_file_contexts(
+                [file.id for file in query_request.uploaded_files], current_user
+            )
+            result["file_context"] = file_contexts
+            for context in file_contexts:
+                if context["status"] == "indexed":
+                    files_processed.append(
+                        f"Processed file: {context['name']} ({context['chunk_count']} sections, "
+                        f"{context['char_count']} characters)"
+                    )
+                elif context["status"] in ("pending", "processing"):
+                    files_processed.append(f"Still processing file: {context['name']}")
+                elif context["status"] == "unsupported":
+                    files_processed.append(f"Text not available for file type: {context['name']}")
+                else:
+                    files_processed.append(f"Could not read file: {context['name']}")
         
         return QueryResponse(
             success=True,
@@ -121,32 +159,21 @@ async def upload_file(
                 detail=f"File type not allowed. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"
             )
         
-        # Read file content to check size
-        content = await file.read()
-        if not validate_file_size(len(content)):
+        file_id = str(uuid.uuid4())
+        
+        # Stream to disk in chunks, hashing and enforcing the size limit as we go
+        try:
+            sha256, file_size, tmp_path = await blob_store.spool_upload(file, MAX_FILE_SIZE)
+        except UploadTooLarge:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"File too large. Maximum size: {MAX_FILE_SIZE / (1024*1024):.1f}MB"
             )
         
-        # Generate unique filename
-        file_id = str(uuid.uuid4())
-        file_extension = os.path.splitext(file.filename)[1]
-        unique_filename = f"{file_id}{file_extension}"
-        file_path = os.path.join(UPLOAD_DIR, unique_filename)
-        
-        # Save file
-        with open(file_path, "wb") as buffer:
-            buffer.write(content)
-        
-        # Create file record
-        uploaded_file = UploadedFile(
-            id=file_id,
-            name=file.filename,
-            size=len(content),
-            type=file.content_type or "application/octet-stream",
-            url=f"/files/{unique_filename}",
-            uploaded_at=datetime.utcnow()
+        # Same storage and catalog as /files uploads, so the file can be
+        # downloaded from /files/download/{id} and read back by its ID
+        uploaded_file = await register_uploaded_file(
+            file_id, file.filename, tmp_path, sha256, file_size, current_user
         )
         
         return FileUploadResponse(
@@ -204,14 +231,18 @@ async def delete_file(
     Delete an uploaded file
     """
     try:
-        # Find file by ID (in a real app, you'd query the database)
-        file_found = False
-        for filename in os.listdir(UPLOAD_DIR):
-            if filename.startswith(file_id):
-                file_path = os.path.join(UPLOAD_DIR, filename)
-                os.remove(file_path)
-                file_found = True
-                break
+        file_record = await file_catalog.get_file(file_id)
+        
+        if file_record:
+            if file_record["uploaded_by"] != current_user.username:
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    detail="You don't have permission to delete this file"
+                )
+            file_found = await remove_catalog_file(file_id)
+        else:
+            # Files uploaded before the catalog were saved as uploads/{id}{ext}
+            file_found = await run_in_threadpool(_remove_legacy_upload, file_id)
         
         if not file_found:
             raise HTTPException(
@@ -0,0 +1,397 @@
+# Resumable Chunked Uploads
+#
+#   POST   /files/resumable                         start an upload (filename, size, chunk_size, sha256)
+#   PUT    /files/resumable/{upload_id}/chunks/{i}  upload chunk i (raw body, optional X-Chunk-SHA256)
+#   GET    /files/resumable/{upload_id}             which chunks are stored / still missing
+#   POST   /files/resumable/{upload_id}/commit      assemble the chunks into a regular file
+#   DELETE /files/resumable/{upload_id}             abort and discard the chunks
+#
+# Every chunk is written to its own file under storage/.resumable/{upload_id}/,
+# so chunks can be sent in parallel and in any order, and a dropped connection
+# only costs the chunk that was in flight. The manifest is written once at
+# start; progress is whatever chunk files exist on disk.
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Depends, status, Request
+from starlette.concurrency import run_in_threadpool
+
+from models import (
+    User, FileUploadResponse, SuccessResponse,
+    ResumableUploadInit, ResumableUploadStatus, ResumableChunkResponse
+)
+from auth_routes import get_current_user
+from file_routes import (
+    ALLOWED_EXTENSIONS, validate_file_extension, register_uploaded_file, blob_store
+)
+from utils.storage import STORAGE_LOCAL_ROOT
+from utils.uploads import UPLOAD_CHUNK_SIZE
+
+router = APIRouter(prefix="/files/resumable", tags=["File Management"])
+
+RESUMABLE_UPLOAD_DIR = os.path.join(STORAGE_LOCAL_ROOT, ".resumable")
+RESUMABLE_MAX_FILE_SIZE = int(os.getenv("RESUMABLE_MAX_FILE_SIZE", 5 * 1024 * 1024 * 1024))
+RESUMABLE_DEFAULT_CHUNK_SIZE = int(os.getenv("RESUMABLE_DEFAULT_CHUNK_SIZE", 8 * 1024 * 1024))
+RESUMABLE_MIN_CHUNK_SIZE = 256 * 1024
+RESUMABLE_MAX_CHUNK_SIZE = int(os.getenv("RESUMABLE_MAX_CHUNK_SIZE", 64 * 1024 * 1024))
+# Unfinished uploads are discarded after this long
+RESUMABLE_UPLOAD_TTL_SECONDS = int(os.getenv("RESUMABLE_UPLOAD_TTL_SECONDS", 24 * 3600))
+RESUMABLE_PURGE_INTERVAL_SECONDS = 600
+
+MANIFEST_NAME = "manifest.json"
+COMMITTING_NAME = "manifest.committing"
+
+os.makedirs(RESUMABLE_UPLOAD_DIR, exist_ok=True)
+
+_last_purge = 0.0
+
+
+# ============================================================
+#  ON-DISK LAYOUT
+# ============================================================
+def _upload_dir(upload_id: str) -> str:
+    return os.path.join(RESUMABLE_UPLOAD_DIR, upload_id)
+
+
+def _part_path(upload_id: str, index: int) -> str:
+    return os.path.join(_upload_dir(upload_id), f"{index:06d}.part")
+
+
+def _chunk_length(manifest: dict, index: int) -> int:
+    """Expected byte length of chunk index (the last one may be short)"""
+    offset = index * manifest["chunk_size"]
+    return min(manifest["chunk_size"], manifest["size"] - offset)
+
+
+def _write_json(path: str, data: dict):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as handle:
+        json.dump(data, handle)
+    os.replace(tmp_path, path)
+
+
+def _read_manifest(upload_id: str) -> Optional[dict]:
+    for name in (MANIFEST_NAME, COMMITTING_NAME):
+        try:
+            with open(os.path.join(_upload_dir(upload_id), name)) as handle:
+                manifest = json.load(handle)
+            manifest["committing"] = name == COMMITTING_NAME
+            return manifest
+        except (FileNotFoundError, ValueError):
+            continue
+    return None
+
+
+def _received_chunks(upload_id: str) -> list:
+    try:
+        names = os.listdir(_upload_dir(upload_id))
+    except FileNotFoundError:
+        return []
+    return sorted(int(name[:-5]) for name in names if name.endswith(".part") and name[:-5].isdigit())
+
+
+def _purge_expired_uploads():
+    now = time.time()
+    try:
+        upload_ids = os.listdir(RESUMABLE_UPLOAD_DIR)
+    except FileNotFoundError:
+        return
+    for upload_id in upload_ids:
+        manifest = _read_manifest(upload_id)
+        if manifest is not None:
+            expired = manifest["expires_at_ts"] < now
+        else:
+            # No manifest (yet): only remove once it is clearly abandoned
+            try:
+                expired = os.path.getmtime(_upload_dir(upload_id)) + RESUMABLE_UPLOAD_TTL_SECONDS < now
+            except OSError:
+                continue
+        if expired:
+            shutil.rmtree(_upload_dir(upload_id), ignore_errors=True)
+
+
+async def _maybe_purge_expired_uploads():
+    global _last_purge
+    now = time.monotonic()
+    if now - _last_purge < RESUMABLE_PURGE_INTERVAL_SECONDS:
+        return
+    _last_purge = now
+    await run_in_threadpool(_purge_expired_uploads)
+
+
+async def _get_manifest(upload_id: str, current_user: User) -> dict:
+    # upload_id becomes a path component, so only accept what we generate
+    try:
+        upload_id = str(uuid.UUID(upload_id))
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+
+    manifest = await run_in_threadpool(_read_manifest, upload_id)
+    if (
+        manifest is None
+        or manifest["owner"] != current_user.username
+        or manifest["expires_at_ts"] < time.time()
+    ):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    return manifest
+
+
+async def _build_status(manifest: dict) -> ResumableUploadStatus:
+    received = await run_in_threadpool(_received_chunks, manifest["upload_id"])
+    received_set = set(received)
+    return ResumableUploadStatus(
+        upload_id=manifest["upload_id"],
+        filename=manifest["filename"],
+        size=manifest["size"],
+        chunk_size=manifest["chunk_size"],
+        total_chunks=manifest["total_chunks"],
+        received_chunks=received,
+        missing_chunks=[i for i in range(manifest["total_chunks"]) if i not in received_set],
+        received_bytes=sum(_chunk_length(manifest, i) for i in received),
+        complete=len(received_set) == manifest["total_chunks"],
+        expires_at=datetime.utcfromtimestamp(manifest["expires_at_ts"])
+    )
+
+
+# ============================================================
+#  CHUNK WRITING / ASSEMBLY (run in the thread pool)
+# ============================================================
+def _write_chunk(handle, digest, data: bytes):
+    digest.update(data)
+    handle.write(data)
+
+
+def _finish_chunk(handle, tmp_path: str, part_path: str, keep: bool):
+    handle.close()
+    if keep:
+        os.replace(tmp_path, part_path)
+    else:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def _assemble(manifest: dict, target_path: str) -> str:
+    """Concatenate the parts into target_path and return the file's SHA-256"""
+    digest = hashlib.sha256()
+    with open(target_path, "wb") as target:
+        for index in range(manifest["total_chunks"]):
+            with open(_part_path(manifest["upload_id"], index), "rb") as part:
+                while True:
+                    data = part.read(UPLOAD_CHUNK_SIZE)
+                    if not data:
+                        break
+                    digest.update(data)
+                    target.write(data)
+    return digest.hexdigest()
+
+
+def _begin_commit(upload_id: str) -> bool:
+    """Atomically claim the upload for assembly; False if another request did"""
+    directory = _upload_dir(upload_id)
+    try:
+        os.rename(os.path.join(directory, MANIFEST_NAME), os.path.join(directory, COMMITTING_NAME))
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _cancel_commit(upload_id: str):
+    directory = _upload_dir(upload_id)
+    try:
+        os.rename(os.path.join(directory, COMMITTING_NAME), os.path.join(directory, MANIFEST_NAME))
+    except FileNotFoundError:
+        pass
+
+
+# ============================================================
+#  ROUTES
+# ============================================================
+@router.post("", response_model=ResumableUploadStatus)
+async def start_resumable_upload(
+    request: ResumableUploadInit,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Start a resumable upload. The response gives the chunk size and chunk count
+    the client should use.
+    """
+    if not validate_file_extension(request.filename):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"File type not allowed. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"
+        )
+    if request.size > RESUMABLE_MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"File too large. Maximum size: {RESUMABLE_MAX_FILE_SIZE / (1024*1024):.1f}MB"
+        )
+
+    await _maybe_purge_expired_uploads()
+
+    chunk_size = request.chunk_size or RESUMABLE_DEFAULT_CHUNK_SIZE
+    chunk_size = max(RESUMABLE_MIN_CHUNK_SIZE, min(chunk_size, RESUMABLE_MAX_CHUNK_SIZE))
+
+    upload_id = str(uuid.uuid4())
+    manifest = {
+        "upload_id": upload_id,
+        "owner": current_user.username,
+        "filename": request.filename,
+        "size": request.size,
+        "chunk_size": chunk_size,
+        "total_chunks": -(-request.size // chunk_size),
+        "sha256": request.sha256.lower() if request.sha256 else None,
+        "created_at": datetime.utcnow().isoformat(),
+        "expires_at_ts": time.time() + RESUMABLE_UPLOAD_TTL_SECONDS,
+    }
+
+    await run_in_threadpool(os.makedirs, _upload_dir(upload_id))
+    await run_in_threadpool(_write_json, os.path.join(_upload_dir(upload_id), MANIFEST_NAME), manifest)
+    return await _build_status(manifest)
+
+
+@router.put("/{upload_id}/chunks/{index}", response_model=ResumableChunkResponse)
+async def upload_chunk(
+    upload_id: str,
+    index: int,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Store chunk `index` (raw request body). Re-sending a chunk replaces it, so
+    clients can retry any chunk that failed. If X-Chunk-SHA256 is given the
+    chunk is rejected unless it matches.
+    """
+    manifest = await _get_manifest(upload_id, current_user)
+    if manifest["committing"]:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload is being committed")
+    if not 0 <= index < manifest["total_chunks"]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Chunk index must be between 0 and {manifest['total_chunks'] - 1}"
+        )
+
+    expected = _chunk_length(manifest, index)
+    expected_checksum = request.headers.get("x-chunk-sha256")
+
+    part_path = _part_path(manifest["upload_id"], index)
+    tmp_path = f"{part_path}.{uuid.uuid4().hex}.tmp"
+    digest = hashlib.sha256()
+    received = 0
+    keep = False
+
+    handle = await run_in_threadpool(open, tmp_path, "wb")
+    try:
+        async for data in request.stream():
+            received += len(data)
+            if received > expected:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Chunk {index} must be exactly {expected} bytes"
+                )
+            await run_in_threadpool(_write_chunk, handle, digest, data)
+
+        if received != expected:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Chunk {index} must be exactly {expected} bytes, got {received}"
+            )
+        checksum = digest.hexdigest()
+        if expected_checksum and expected_checksum.strip().lower() != checksum:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Checksum mismatch for chunk {index}"
+            )
+        keep = True
+    finally:
+        await run_in_threadpool(_finish_chunk, handle, tmp_path, part_path, keep)
+
+    return ResumableChunkResponse(
+        upload_id=manifest["upload_id"],
+        index=index,
+        offset=index * manifest["chunk_size"],
+        size=received,
+        sha256=checksum
+    )
+
+
+@router.get("/{upload_id}", response_model=ResumableUploadStatus)
+async def get_resumable_upload_status(
+    upload_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Report which chunks are stored, so a client can resume after a failure
+    """
+    manifest = await _get_manifest(upload_id, current_user)
+    return await _build_status(manifest)
+
+
+@router.post("/{upload_id}/commit", response_model=FileUploadResponse)
+async def commit_resumable_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Assemble all chunks into a regular uploaded file (same metadata and
+    download URL as /files/upload) and discard the chunks
+    """
+    manifest = await _get_manifest(upload_id, current_user)
+    upload_status = await _build_status(manifest)
+    if not upload_status.complete:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Upload incomplete, missing chunks: {upload_status.missing_chunks[:50]}"
+        )
+    if not await run_in_threadpool(_begin_commit, manifest["upload_id"]):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload is already being committed")
+
+    file_id = str(uuid.uuid4())
+    tmp_path = blob_store.temp_path()
+
+    try:
+        checksum = await run_in_threadpool(_assemble, manifest, tmp_path)
+        if manifest["sha256"] and manifest["sha256"] != checksum:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Checksum mismatch for the assembled file"
+            )
+        uploaded_file = await register_uploaded_file(
+            file_id, manifest["filename"], tmp_path, checksum, manifest["size"], current_user
+        )
+    except BaseException:
+        # The chunks are still there, so a retried commit can assemble them again
+        blob_store.discard_temp(tmp_path)
+        await run_in_threadpool(_cancel_commit, manifest["upload_id"])
+        raise
+
+    await run_in_threadpool(shutil.rmtree, _upload_dir(manifest["upload_id"]), True)
+
+    return FileUploadResponse(
+        success=True,
+        message="File uploaded successfully",
+        file=uploaded_file
+    )
+
+
+@router.delete("/{upload_id}", response_model=SuccessResponse)
+async def abort_resumable_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Abort an upload and discard its chunks
+    """
+    manifest = await _get_manifest(upload_id, current_user)
+    if manifest["committing"]:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Upload is being committed")
+    await run_in_threadpool(shutil.rmtree, _upload_dir(manifest["upload_id"]), True)
+    return SuccessResponse(success=True, message="Upload aborted")
@@ -0,0 +1,190 @@
+# Full-Text Search
+#
+# Postgres full-text search over timesheet entries (client, matter,
+# timekeeper, phase/activity and narrative; migration 7) and uploaded
+# document text (public.document_chunks; migration 8). Both tables keep
+# their tsvector in a generated column, so the GIN indexes are updated with
+# every write and there is nothing to rebuild.
+#
+# Every query term is prefix-matched ("discov" finds "discovery"), results
+# are ranked with ts_rank_cd (cover density with field weights, normalised
+# by document length) and ts_headline marks the matches. Headlines are only
+# built for the rows that are returned. ts_headline does not escape the text
+# around a match, so it marks matches with control characters instead of
+# tags; the highlight is then HTML-escaped and the markers turned into
+# <mark> tags, so clients can render it as HTML.
+#
+# Entries are searched within the caller's own timesheet; documents within
+# those the caller uploaded or that belong to the caller's organization.
+
+import html
+import os
+import re
+
+from database_async import db
+
+SEARCH_RESULT_LIMIT = int(os.getenv("SEARCH_RESULT_LIMIT", 20))
+SEARCH_MAX_TERMS = 12
+SEARCH_CONFIG = "english"
+# ts_rank_cd normalisation: divide by 1 + log(document length)
+RANK_NORMALIZATION = 1
+# Match markers that cannot appear in escaped text
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_STOP = "\x03"
+HIGHLIGHT_SELECTORS = f'StartSel="{HIGHLIGHT_START}", StopSel="{HIGHLIGHT_STOP}"'
+HEADLINE_OPTIONS = (
+    f"{HIGHLIGHT_SELECTORS}, MaxWords=35, MinWords=15, "
+    "MaxFragments=2, FragmentDelimiter=\" … \""
+)
+MATTER_HEADLINE_OPTIONS = f"HighlightAll=true, {HIGHLIGHT_SELECTORS}"
+
+SEARCH_TERM_PATTERN = re.compile(r"[^\W_]+")
+
+
+def build_tsquery(text: str):
+    """
+    to_tsquery() input matching every term of text as a prefix, or None when
+    text has no searchable terms. Only letters and digits are kept, so the
+    result never contains tsquery operators from user input.
+    """
+    terms = SEARCH_TERM_PATTERN.findall(text.lower())[:SEARCH_MAX_TERMS]
+    if not terms:
+        return None
+    return " & ".join(f"{term}:*" for term in terms)
+
+
+def render_highlight(headline):
+    """ts_headline output as safe HTML: text escaped, matches wrapped in <mark>"""
+    if headline is None:
+        return None
+    return (
+        html.escape(headline, quote=False)
+        .replace(HIGHLIGHT_START, "<mark>")
+        .replace(HIGHLIGHT_STOP, "</mark>")
+    )
+
+
+async def search_entries(user_id: int, text: str, limit: int = SEARCH_RESULT_LIMIT) -> list:
+    """Best matching timesheet entries of one user, with a highlighted narrative"""
+    tsquery = build_tsquery(text)
+    if tsquery is None:
+        return []
+    rows = await db.fetch("""
+        WITH q AS (SELECT to_tsquery(%s::regconfig, %s) AS query)
+        SELECT e.id, e.client, e.matter, e.timekeeper, e.entry_date, e.entry_type,
+               e.entry_status, hits.rank,
+               ts_headline(%s::regconfig, e.narrative, q.query, %s) AS highlight
+        FROM (
+            SELECT t.id, ts_rank_cd(t.search_vector, q.query, %s) AS rank
+            FROM public.timesheet_entries t, q
+            WHERE t.user_id = %s AND t.search_vector @@ q.query
+            ORDER BY rank DESC, t.id DESC
+            LIMIT %s
+        ) hits
+        JOIN public.timesheet_entries e ON e.id = hits.id
+        CROSS JOIN q
+        ORDER BY hits.rank DESC, e.id DESC
+    """, (
+        SEARCH_CONFIG, tsquery, SEARCH_CONFIG, HEADLINE_OPTIONS,
+        RANK_NORMALIZATION, user_id, limit
+    ))
+    return [
+        {
+            "id": str(row["id"]),
+            "client": row["client"],
+            "matter": row["matter"],
+            "timekeeper": row["timekeeper"],
+            "entry_date": row["entry_date"],
+            "entry_type": row["entry_type"],
+            "status": row["entry_status"],
+            "highlight": render_highlight(row["highlight"]),
+            "rank": float(row["rank"]),
+        }
+        for row in rows
+    ]
+
+
+async def search_matters(user_id: int, text: str, limit: int = SEARCH_RESULT_LIMIT) -> list:
+    """Client/matter pairs whose entries match, best match first"""
+    tsquery = build_tsquery(text)
+    if tsquery is None:
+        return []
+    rows = await db.fetch("""
+        WITH q AS (SELECT to_tsquery(%s::regconfig, %s) AS query)
+        SELECT hits.client, hits.matter, hits.entry_count, hits.last_entry_date, hits.rank,
+               ts_headline(%s::regconfig, hits.matter, q.query, %s) AS highlight
+        FROM (
+            SELECT t.client, t.matter, COUNT(*) AS entry_count,
+                   MAX(t.entry_date) AS last_entry_date,
+                   MAX(ts_rank_cd(t.search_vector, q.query, %s)) AS rank
+            FROM public.timesheet_entries t, q
+            WHERE t.user_id = %s AND t.search_vector @@ q.query
+            GROUP BY t.client, t.matter
+            ORDER BY rank DESC, last_entry_date DESC
+            LIMIT %s
+        ) hits
+        CROSS JOIN q
+        ORDER BY hits.rank DESC, hits.last_entry_date DESC
+    """, (
+        SEARCH_CONFIG, tsquery, SEARCH_CONFIG, MATTER_HEADLINE_OPTIONS,
+        RANK_NORMALIZATION, user_id, limit
+    ))
+    return [
+        {
+            "client": row["client"],
+            "matter": row["matter"],
+            "entry_count": row["entry_count"],
+            "last_entry_date": row["last_entry_date"],
+            "highlight": render_highlight(row["highlight"]),
+            "rank": float(row["rank"]),
+        }
+        for row in rows
+    ]
+
+
+async def search_documents(user, text: str, limit: int = SEARCH_RESULT_LIMIT, file_ids: list = None) -> list:
+    """
+    Best matching chunks of uploaded documents the user may read, optionally
+    only within file_ids
+    """
+    tsquery = build_tsquery(text)
+    if tsquery is None:
+        return []
+    file_filter = ""
+    params = [SEARCH_CONFIG, tsquery, SEARCH_CONFIG, HEADLINE_OPTIONS, RANK_NORMALIZATION,
+              user.username, user.org_id]
+    if file_ids is not None:
+        file_filter = "AND c.file_id = ANY(%s)"
+        params.append(list(file_ids))
+    params.append(limit)
+
+    rows = await db.fetch(f"""
+        WITH q AS (SELECT to_tsquery(%s::regconfig, %s) AS query)
+        SELECT hits.file_id, f.name, hits.chunk_index, hits.rank,
+               ts_headline(%s::regconfig, c.content, q.query, %s) AS highlight
+        FROM (
+            SELECT c.file_id, c.chunk_index, ts_rank_cd(c.search_vector, q.query, %s) AS rank
+            FROM public.document_chunks c
+            JOIN public.file_catalog f ON f.id = c.file_id
+            CROSS JOIN q
+            WHERE c.search_vector @@ q.query
+              AND (f.uploaded_by = %s OR (f.org_id IS NOT NULL AND f.org_id = %s))
+              {file_filter}
+            ORDER BY rank DESC, c.file_id, c.chunk_index
+            LIMIT %s
+        ) hits
+        JOIN public.document_chunks c ON c.file_id = hits.file_id AND c.chunk_index = hits.chunk_index
+        JOIN public.file_catalog f ON f.id = hits.file_id
+        CROSS JOIN q
+        ORDER BY hits.rank DESC, hits.file_id, hits.chunk_index
+    """, tuple(params))
+    return [
+        {
+            "file_id": row["file_id"],
+            "name": row["name"],
+            "chunk_index": row["chunk_index"],
+            "highlight": render_highlight(row["highlight"]),
+            "rank": float(row["rank"]),
+        }
+        for row in rows
+    ]
@@ -0,0 +1,117 @@
+# Chatbot Session Store
+#
+# Sessions expire after CHAT_SESSION_TTL_SECONDS of inactivity and the least
+# recently used ones are evicted beyond CHAT_SESSION_MAX_SESSIONS.
+#
+#   CHAT_SESSION_BACKEND=memory    per-process (default, single worker)
+#   CHAT_SESSION_BACKEND=postgres  shared by all workers, survives restarts
+
+import json
+import os
+import time
+
+from database_async import db
+from utils.cache import TTLCache
+
+CHAT_SESSION_BACKEND = os.getenv("CHAT_SESSION_BACKEND", "memory").lower()
+CHAT_SESSION_TTL_SECONDS = float(os.getenv("CHAT_SESSION_TTL_SECONDS", 3600))
+CHAT_SESSION_MAX_SESSIONS = int(os.getenv("CHAT_SESSION_MAX_SESSIONS", 10000))
+# How often the Postgres backend purges expired / excess sessions
+CHAT_SESSION_PURGE_INTERVAL_SECONDS = float(os.getenv("CHAT_SESSION_PURGE_INTERVAL_SECONDS", 60))
+
+
+class MemorySessionStore:
+    """In-process store; sessions are lost on restart and not shared between workers"""
+
+    def __init__(self, ttl: float = CHAT_SESSION_TTL_SECONDS, max_sessions: int = CHAT_SESSION_MAX_SESSIONS):
+        self._cache = TTLCache(maxsize=max_sessions, ttl=ttl)
+
+    async def get(self, session_id: str):
+        session = self._cache.get(session_id)
+        if session is not None:
+            # Sliding expiry: every access extends the session
+            self._cache.set(session_id, session)
+        return session
+
+    async def save(self, session_id: str, session: dict):
+        self._cache.set(session_id, session)
+
+    async def delete(self, session_id: str) -> bool:
+        return self._cache.pop(session_id) is not None
+
+    async def list_ids(self):
+        return self._cache.keys()
+
+    def stats(self) -> dict:
+        return {"backend": "memory", **self._cache.stats()}
+
+
+class PostgresSessionStore:
+    """Shared store in public.chat_sessions (see migration 4)"""
+
+    def __init__(self, ttl: float = CHAT_SESSION_TTL_SECONDS, max_sessions: int = CHAT_SESSION_MAX_SESSIONS,
+                 purge_interval: float = CHAT_SESSION_PURGE_INTERVAL_SECONDS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.purge_interval = purge_interval
+        self._last_purge = 0.0
+
+    async def get(self, session_id: str):
+        row = await db.fetchrow("""
+            UPDATE public.chat_sessions
+            SET expires_at = NOW() + make_interval(secs => %s), updated_at = NOW()
+            WHERE session_id = %s AND expires_at > NOW()
+            RETURNING data
+        """, (self.ttl, session_id))
+        return row["data"] if row else None
+
+    async def save(self, session_id: str, session: dict):
+        await db.execute("""
+            INSERT INTO public.chat_sessions (session_id, data, expires_at, updated_at)
+            VALUES (%s, %s::jsonb, NOW() + make_interval(secs => %s), NOW())
+            ON CONFLICT (session_id) DO UPDATE
+            SET data = EXCLUDED.data, expires_at = EXCLUDED.expires_at, updated_at = NOW()
+        """, (session_id, json.dumps(session, default=str), self.ttl))
+        await self._maybe_purge()
+
+    async def delete(self, session_id: str) -> bool:
+        return await db.execute("DELETE FROM public.chat_sessions WHERE session_id = %s", (session_id,)) > 0
+
+    async def list_ids(self):
+        rows = await db.fetch("""
+            SELECT session_id FROM public.chat_sessions
+            WHERE expires_at > NOW()
+            ORDER BY updated_at DESC
+        """)
+        return [row["session_id"] for row in rows]
+
+    async def _maybe_purge(self):
+        now = time.monotonic()
+        if now - self._last_purge < self.purge_interval:
+            return
+        self._last_purge = now
+        async with db.transaction() as conn:
+            await conn.execute("DELETE FROM public.chat_sessions WHERE expires_at <= NOW()")
+            # Evict least recently used sessions above the cap
+            await conn.execute("""
+                DELETE FROM public.chat_sessions
+                WHERE session_id IN (
+                    SELECT session_id FROM public.chat_sessions
+                    ORDER BY updated_at DESC
+                    OFFSET %s
+                )
+            """, (self.max_sessions,))
+
+    def stats(self) -> dict:
+        return {"backend": "postgres", "ttl": self.ttl, "max_sessions": self.max_sessions}
+
+
+def create_session_store():
+    if CHAT_SESSION_BACKEND == "postgres":
+        return PostgresSessionStore()
+    if CHAT_SESSION_BACKEND != "memory":
+        print(f"⚠️ Unknown CHAT_SESSION_BACKEND '{CHAT_SESSION_BACKEND}', using memory")
+    return MemorySessionStore()
+
+
+session_store = create_session_store()
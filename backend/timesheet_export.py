@@ -0,0 +1,182 @@
+# Streaming Timesheet Export (CSV / NDJSON / XLSX)
+#
+# Rows are read through a server-side (named) cursor in fetchmany batches and
+# written to the response as they arrive, so memory use does not depend on how
+# many entries are exported.
+
+import csv
+import io
+import json
+import os
+import tempfile
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+
+from psycopg2.extras import RealDictCursor
+from starlette.concurrency import run_in_threadpool
+
+from database_async import db
+from database_utils import build_timesheet_filters
+
+EXPORT_BATCH_SIZE = int(os.getenv("TIMESHEET_EXPORT_BATCH_SIZE", 2000))
+EXPORT_FILE_CHUNK_SIZE = 256 * 1024
+
+EXPORT_COLUMNS = (
+    "id", "entry_date", "client", "matter", "timekeeper", "entry_type",
+    "hours_worked", "hours_billed", "quantity", "rate", "currency", "total",
+    "phase_task", "activity", "expense", "bill_code", "entry_status",
+    "narrative", "created_at", "updated_at"
+)
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+def _json_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _open_cursor(conn, query, params):
+    cursor = conn.cursor(name=f"timesheet_export_{uuid.uuid4().hex}", cursor_factory=RealDictCursor)
+    cursor.itersize = EXPORT_BATCH_SIZE
+    cursor.execute(query, params)
+    return cursor
+
+
+def _close_cursor(conn, cursor):
+    try:
+        cursor.close()
+    finally:
+        conn.rollback()
+
+
+async def iter_export_batches(user_id: int, filters: dict):
+    """Yield lists of row dicts from a server-side cursor"""
+    where, params = build_timesheet_filters(user_id, filters)
+    query = f"""
+        SELECT {', '.join(EXPORT_COLUMNS)}
+        FROM public.timesheet_entries
+        {where}
+        ORDER BY entry_date DESC, id DESC
+    """
+
+    # Named cursors live inside a transaction, so autocommit stays off
+    async with db.acquire(autocommit=False) as conn:
+        cursor = await conn.run(_open_cursor, query, tuple(params))
+        try:
+            while True:
+                rows = await db.run_in_executor(cursor.fetchmany, EXPORT_BATCH_SIZE)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            await conn.run(_close_cursor, cursor)
+
+
+async def stream_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue().encode("utf-8")
+
+    async for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        for row in rows:
+            writer.writerow([row[column] for column in EXPORT_COLUMNS])
+        yield buffer.getvalue().encode("utf-8")
+
+
+async def stream_ndjson(batches):
+    async for rows in batches:
+        yield "".join(
+            json.dumps({column: _json_value(row[column]) for column in EXPORT_COLUMNS}) + "\n"
+            for row in rows
+        ).encode("utf-8")
+
+
+def _xlsx_write_rows(worksheet, start_row, rows, date_format):
+    for offset, row in enumerate(rows):
+        for col, column in enumerate(EXPORT_COLUMNS):
+            value = row[column]
+            if isinstance(value, Decimal):
+                worksheet.write_number(start_row + offset, col, float(value))
+            elif isinstance(value, (date, datetime)):
+                worksheet.write_datetime(start_row + offset, col, value, date_format)
+            elif value is None:
+                continue
+            else:
+                worksheet.write(start_row + offset, col, value)
+
+
+def _read_chunk(handle):
+    return handle.read(EXPORT_FILE_CHUNK_SIZE)
+
+
+async def stream_xlsx(batches):
+    """
+    XLSX is a zip archive, so it cannot be emitted row by row. The workbook is
+    written in xlsxwriter's constant_memory mode to a temporary file, which is
+    then streamed and removed.
+    """
+    import xlsxwriter
+
+    handle = tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False)
+    handle.close()
+    try:
+        workbook = xlsxwriter.Workbook(handle.name, {"constant_memory": True, "remove_timezone": True})
+        worksheet = workbook.add_worksheet("Timesheet")
+        date_format = workbook.add_format({"num_format": "yyyy-mm-dd"})
+        worksheet.write_row(0, 0, EXPORT_COLUMNS)
+
+        next_row = 1
+        async for rows in batches:
+            await run_in_threadpool(_xlsx_write_rows, worksheet, next_row, rows, date_format)
+            next_row += len(rows)
+        await run_in_threadpool(workbook.close)
+
+        with open(handle.name, "rb") as export_file:
+            while True:
+                chunk = await run_in_threadpool(_read_chunk, export_file)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        try:
+            os.remove(handle.name)
+        except OSError:
+            pass
+
+
+def xlsx_available() -> bool:
+    try:
+        import xlsxwriter  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+async def stream_export(fmt: str, user_id: int, filters: dict):
+    batches = iter_export_batches(user_id, filters)
+    if fmt == "csv":
+        chunks = stream_csv(batches)
+    elif fmt == "ndjson":
+        chunks = stream_ndjson(batches)
+    else:
+        chunks = stream_xlsx(batches)
+
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        # Release the cursor and pooled connection right away if the client disconnects
+        await chunks.aclose()
+        await batches.aclose()
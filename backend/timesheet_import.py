@@ -0,0 +1,245 @@
+# Bulk Timesheet Import (CSV / NDJSON → PostgreSQL COPY)
+#
+# The request body is read as a stream and parsed incrementally. Rows are
+# validated against TimesheetEntry as they arrive and valid rows are spooled
+# (memory, then a temp file) without touching the database, so a slow client
+# never holds a connection. Once the whole body is in, the spool is loaded with
+# a single COPY inside one short transaction.
+
+import codecs
+import csv
+import io
+import json
+import os
+import tempfile
+
+from pydantic import ValidationError
+
+from starlette.concurrency import run_in_threadpool
+
+from database_async import db
+from models import TimesheetEntry
+
+BULK_IMPORT_BATCH_SIZE = int(os.getenv("BULK_IMPORT_BATCH_SIZE", 5000))
+# Larger request bodies are rejected before parsing (MaxBodySizeMiddleware)
+BULK_IMPORT_MAX_BYTES = int(os.getenv("BULK_IMPORT_MAX_BYTES", 100 * 1024 * 1024))
+# Validated rows are kept in memory up to this size, then spooled to disk
+BULK_IMPORT_SPOOL_MAX_BYTES = int(os.getenv("BULK_IMPORT_SPOOL_MAX_BYTES", 8 * 1024 * 1024))
+# Per-row errors reported back to the client (the rest are only counted)
+BULK_IMPORT_MAX_REPORTED_ERRORS = int(os.getenv("BULK_IMPORT_MAX_REPORTED_ERRORS", 1000))
+
+COPY_COLUMNS = (
+    "user_id", "client", "matter", "timekeeper", "entry_date",
+    "entry_type", "hours_worked", "hours_billed", "quantity",
+    "rate", "currency", "total", "phase_task", "activity",
+    "expense", "bill_code", "entry_status", "narrative"
+)
+
+COPY_SQL = (
+    f"COPY public.timesheet_entries ({', '.join(COPY_COLUMNS)}) "
+    "FROM STDIN WITH (FORMAT csv)"
+)
+
+# Column names accepted in addition to the TimesheetEntry aliases
+FIELD_ALIASES = {
+    "entry_date": "date",
+    "entry_type": "type",
+    "entry_status": "status",
+}
+
+CURRENCY_MAPPING = {
+    'US dollars': 'USD', 'US Dollars': 'USD', 'USD': 'USD',
+    'Euro': 'EUR', 'EUR': 'EUR', 'British Pound': 'GBP', 'GBP': 'GBP'
+}
+
+
+# ============================================================
+#  STREAM PARSING
+# ============================================================
+async def iter_lines(byte_stream):
+    """Split an async stream of bytes into text lines without buffering the whole body"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    # Pieces of the unfinished last line, joined once its newline arrives, so
+    # only new data is scanned however long the line gets
+    pending = []
+    async for chunk in byte_stream:
+        *lines, tail = decoder.decode(chunk).split("\n")
+        if lines:
+            pending.append(lines[0])
+            lines[0] = "".join(pending)
+            pending = []
+        for line in lines:
+            yield line.rstrip("\r")
+        if tail:
+            pending.append(tail)
+    pending.append(decoder.decode(b"", final=True))
+    last = "".join(pending)
+    if last:
+        yield last.rstrip("\r")
+
+
+async def iter_csv_records(lines):
+    """
+    Yield (row_number, dict) for each CSV record.
+    A quoted field may contain newlines, so physical lines are joined until
+    the record's quotes are balanced.
+    """
+    header = None
+    record_lines = []
+    quotes = 0
+    row_number = 0
+
+    async for line in lines:
+        record_lines.append(line)
+        quotes += line.count('"')
+        if quotes % 2:
+            continue
+
+        record = "\n".join(record_lines)
+        record_lines, quotes = [], 0
+        if not record.strip():
+            continue
+
+        values = next(csv.reader([record]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+
+        row_number += 1
+        yield row_number, dict(zip(header, values))
+
+    if record_lines and "".join(record_lines).strip():
+        row_number += 1
+        yield row_number, {"__error__": "Unterminated quoted field"}
+
+
+async def iter_ndjson_records(lines):
+    """Yield (row_number, dict) for each non-empty NDJSON line"""
+    row_number = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield row_number, {"__error__": f"Invalid JSON: {e.msg}"}
+            continue
+        if not isinstance(record, dict):
+            yield row_number, {"__error__": "Each line must be a JSON object"}
+            continue
+        yield row_number, record
+
+
+# ============================================================
+#  VALIDATION
+# ============================================================
+def validate_record(record: dict):
+    """
+    Validate one input record against TimesheetEntry.
+    Returns (values_tuple_without_user_id, None) or (None, [error messages]).
+    """
+    if "__error__" in record:
+        return None, [record["__error__"]]
+
+    data = {}
+    for key, value in record.items():
+        if key is None:
+            continue
+        key = FIELD_ALIASES.get(key.strip(), key.strip())
+        if isinstance(value, str):
+            value = value.strip()
+            if value == "":
+                continue
+        if value is None:
+            continue
+        data[key] = value
+
+    if "currency" in data:
+        data["currency"] = CURRENCY_MAPPING.get(data["currency"], data["currency"])
+
+    try:
+        entry = TimesheetEntry(**data)
+    except ValidationError as e:
+        return None, [
+            f"{'.'.join(str(loc) for loc in err['loc']) or 'entry'}: {err['msg']}"
+            for err in e.errors()
+        ]
+
+    values = entry.model_dump(mode="json", by_alias=False)
+    return tuple(values.get(column) for column in COPY_COLUMNS[1:]), None
+
+
+def write_copy_rows(spool, user_id: int, rows):
+    """Append validated rows to the spool as CSV for COPY (None → unquoted empty → NULL)"""
+    writer = csv.writer(spool)
+    for values in rows:
+        writer.writerow((user_id,) + values)
+
+
+def copy_spool(conn, spool):
+    """Run COPY from the spool on a psycopg2 connection (called on the DB executor)"""
+    spool.seek(0)
+    with conn.cursor() as cursor:
+        cursor.copy_expert(COPY_SQL, spool)
+        return cursor.rowcount
+
+
+def open_spool():
+    return tempfile.SpooledTemporaryFile(max_size=BULK_IMPORT_SPOOL_MAX_BYTES, mode="w+", newline="", encoding="utf-8")
+
+
+# ============================================================
+#  IMPORT
+# ============================================================
+class BulkImportAborted(Exception):
+    """Raised when all_or_nothing is set and a row is invalid (nothing is loaded)"""
+
+
+async def spool_timesheet_entries(spool, user_id: int, records, all_or_nothing: bool = False):
+    """
+    Validate records and write the valid ones to spool (see open_spool). No
+    database work is done here. Returns a report dict; raises BulkImportAborted
+    (after filling the report) when all_or_nothing is set and a row is invalid.
+    """
+    report = {"inserted": 0, "failed": 0, "total_rows": 0, "errors": [], "errors_truncated": False}
+    batch = []
+
+    async def flush():
+        if batch:
+            await run_in_threadpool(write_copy_rows, spool, user_id, list(batch))
+            report["inserted"] += len(batch)
+            batch.clear()
+
+    async for row_number, record in records:
+        report["total_rows"] += 1
+        values, errors = validate_record(record)
+
+        if errors:
+            report["failed"] += 1
+            if len(report["errors"]) < BULK_IMPORT_MAX_REPORTED_ERRORS:
+                report["errors"].append({"row": row_number, "errors": errors})
+            else:
+                report["errors_truncated"] = True
+            continue
+
+        if all_or_nothing and report["failed"]:
+            # Keep validating for the report, but don't load anything
+            continue
+
+        batch.append(values)
+        if len(batch) >= BULK_IMPORT_BATCH_SIZE:
+            await flush()
+
+    if all_or_nothing and report["failed"]:
+        report["inserted"] = 0
+        raise BulkImportAborted(report)
+
+    await flush()
+    return report
+
+
+async def load_spool(spool):
+    """COPY the spooled rows in one transaction; returns the number of rows loaded"""
+    async with db.transaction() as conn:
+        return await conn.run(copy_spool, spool)
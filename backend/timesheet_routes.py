@@ -1,4 +1,5 @@
 from fastapi import APIRouter, HTTPException, Depends, status, Query, Request
+from fastapi.responses import StreamingResponse
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel, ValidationError
 import uuid
@@ -7,13 +8,22 @@ from datetime import datetime, date
 # Internal imports
 from models import (
     TimesheetEntry, TimesheetResponse, TimesheetListResponse,
+    BulkImportResponse, TimesheetSummaryRow, TimesheetSummaryResponse,
     SuccessResponse, ErrorResponse, User
 )
 from auth_routes import get_current_user
 from database_utils import (
-    create_timesheet_entry, get_timesheet_entries,
-    update_timesheet_entry, delete_timesheet_entry
+    create_timesheet_entry, get_timesheet_entries, count_timesheet_entries, decode_timesheet_cursor,
+    update_timesheet_entry, delete_timesheet_entry, invalidate_timesheet_counts,
+    get_timesheet_summary
 )
+from database_async import db
+from timesheet_import import (
+    iter_lines, iter_csv_records, iter_ndjson_records,
+    open_spool, spool_timesheet_entries, load_spool, BulkImportAborted
+)
+from timesheet_export import EXPORT_FORMATS, stream_export, xlsx_available
+from session_store import session_store
 
 router = APIRouter(prefix="/timesheet", tags=["Timesheet"])
 chatbot_router = APIRouter(prefix="/chatbot", tags=["Chatbot"])
@@ -26,8 +36,6 @@ def generate_entry_id() -> str:
 # Chatbot Implementation
 # ==============================
 
-chat_sessions: Dict[str, Dict[str, Any]] = {}
-
 class ChatMessage(BaseModel):
     message: str
     session_id: Optional[str] = None
@@ -57,14 +65,14 @@ def normalize_currency(currency: str) -> str:
     mapping = {'US DOLLARS': 'USD', 'US dollars': 'USD', 'USD': 'USD', 'Euro': 'EUR', 'EUR': 'EUR', 'British Pound': 'GBP', 'GBP': 'GBP'}
     return mapping.get(currency.strip(), currency.strip().upper())
 
-def create_session() -> str:
+async def create_session() -> str:
     sid = str(uuid.uuid4())
-    chat_sessions[sid] = {
+    await session_store.save(sid, {
         "current_question": 0,
         "data": {},
         "completed": False,
-        "created_at": datetime.now()
-    }
+        "created_at": datetime.now().isoformat()
+    })
     return sid
 
 # Ordered chatbot questions
@@ -94,11 +102,11 @@ async def chat_timesheet(chat_message: ChatMessage, current_user: User = Depends
     """
     try:
         sid = chat_message.session_id
-        if not sid or sid not in chat_sessions:
-            sid = create_session()
+        session = await session_store.get(sid) if sid else None
+        if session is None:
+            sid = await create_session()
             return ChatResponse(response=TIMESHEET_QUESTIONS[0]["question"], session_id=sid, next_question=TIMESHEET_QUESTIONS[0]["question"])
 
-        session = chat_sessions[sid]
         msg = chat_message.message.strip()
 
         # Confirmation phase handling
@@ -118,6 +126,7 @@ async def chat_timesheet(chat_message: ChatMessage, current_user: User = Depends
                     await create_timesheet_entry_endpoint(req, current_user)
                     session["completed"] = True
                     session["pending_confirmation"] = False
+                    await session_store.save(sid, session)
                     return ChatResponse(
                         response=f"✅ Entry created successfully!\nClient: {data['client']}\nType: {data['type']}\nTotal: {data['currency']} {total:.2f}",
                         session_id=sid, completed=True, timesheet_data=data
@@ -125,10 +134,12 @@ async def chat_timesheet(chat_message: ChatMessage, current_user: User = Depends
                 except Exception as e:
                     session["completed"] = True
                     session["pending_confirmation"] = False
+                    await session_store.save(sid, session)
                     return ChatResponse(response=f"❌ Error saving entry: {e}", session_id=sid, completed=True)
             else:
                 # User says "no" or anything else, start over
-                sid = create_session()
+                await session_store.delete(sid)
+                sid = await create_session()
                 return ChatResponse(response="Let's start a new timesheet.\n" + TIMESHEET_QUESTIONS[0]["question"], session_id=sid)
 
         idx = session["current_question"]
@@ -156,11 +167,13 @@ async def chat_timesheet(chat_message: ChatMessage, current_user: User = Depends
             data["total"] = total
             summary = "\n".join([f"{k.title().replace('_', ' ')}: {v}" for k, v in data.items()])
             session["pending_confirmation"] = True
+            await session_store.save(sid, session)
             return ChatResponse(
                 response=f"🔍 Here is your timesheet entry:\n{summary}\n\nIs everything OK? Reply 'yes' to submit or 'no' to start over.",
                 session_id=sid, timesheet_data=data, next_question="Is everything OK? Reply 'yes' to submit or 'no' to start over."
             )
 
+        await session_store.save(sid, session)
         next_q = TIMESHEET_QUESTIONS[session["current_question"]]
         return ChatResponse(response=f"✅ Got it!\n\n{next_q['question']}", session_id=sid, next_question=next_q["question"])
     except Exception as e:
@@ -168,12 +181,12 @@ async def chat_timesheet(chat_message: ChatMessage, current_user: User = Depends
 
 @chatbot_router.get("/sessions")
 async def list_sessions(current_user: User = Depends(get_current_user)):
-    return {"count": len(chat_sessions), "active_sessions": list(chat_sessions.keys())}
+    session_ids = await session_store.list_ids()
+    return {"count": len(session_ids), "active_sessions": session_ids, "store": session_store.stats()}
 
 @chatbot_router.delete("/session/{sid}")
 async def delete_session(sid: str, current_user: User = Depends(get_current_user)):
-    if sid in chat_sessions:
-        del chat_sessions[sid]
+    if await session_store.delete(sid):
         return {"message": "Session deleted"}
     raise HTTPException(status_code=404, detail="Session not found")
 
@@ -217,7 +230,7 @@ async def create_timesheet_entry_endpoint(request: Request, current_user: User =
         # Save to DB or fallback to mock
         try:
             user_id = getattr(current_user, 'id', 1)
-            db_result = create_timesheet_entry(user_id, entry_data)
+            db_result = await create_timesheet_entry(user_id, entry_data)
             if db_result["success"]:
                 return TimesheetResponse(success=True, message="Timesheet entry created successfully in database", entry_id=entry_id, entry=entry)
             else:
@@ -235,6 +248,87 @@ async def create_timesheet_entry_endpoint(request: Request, current_user: User =
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to create timesheet entry: {str(e)}")
 
+@router.post("/entries/bulk", response_model=BulkImportResponse)
+async def bulk_import_timesheet_entries(
+    request: Request,
+    format: Optional[str] = Query(None, description="csv or ndjson (defaults from Content-Type)"),
+    all_or_nothing: bool = Query(False, description="Roll back the whole import if any row is invalid"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Bulk import timesheet entries from a CSV (with header row) or NDJSON request body.
+    The body is streamed and validated as it arrives, then loaded with one COPY in a single
+    transaction once it has been received in full.
+    Invalid rows are skipped and reported individually unless all_or_nothing is set.
+    """
+    content_type = request.headers.get("content-type", "").lower()
+    fmt = (format or ("ndjson" if "ndjson" in content_type or "jsonl" in content_type else "csv")).lower()
+    if fmt not in ("csv", "ndjson"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="format must be csv or ndjson")
+
+    lines = iter_lines(request.stream())
+    records = iter_csv_records(lines) if fmt == "csv" else iter_ndjson_records(lines)
+    user_id = getattr(current_user, 'id', 1)
+
+    try:
+        with open_spool() as spool:
+            report = await spool_timesheet_entries(spool, user_id, records, all_or_nothing=all_or_nothing)
+            if report["inserted"]:
+                report["inserted"] = await load_spool(spool)
+    except BulkImportAborted as aborted:
+        report = aborted.args[0]
+        return BulkImportResponse(
+            success=False,
+            message=f"Import rolled back: {report['failed']} of {report['total_rows']} rows are invalid",
+            **report
+        )
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Bulk import failed: {str(e)}")
+
+    invalidate_timesheet_counts(user_id)
+    return BulkImportResponse(
+        success=True,
+        message=f"Imported {report['inserted']} of {report['total_rows']} rows",
+        **report
+    )
+
+@router.get("/entries/export")
+async def export_timesheet_entries(
+    format: str = Query("csv", description="csv, ndjson or xlsx"),
+    client: Optional[str] = Query(None, description="Filter by client"),
+    matter: Optional[str] = Query(None, description="Filter by matter"),
+    timekeeper: Optional[str] = Query(None, description="Filter by timekeeper"),
+    date_from: Optional[date] = Query(None, description="Filter from date"),
+    date_to: Optional[date] = Query(None, description="Filter to date"),
+    entry_type: Optional[str] = Query(None, description="Filter by entry type"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Export all matching timesheet entries (newest first) as a streamed file.
+    Accepts the same filters as GET /timesheet/entries.
+    """
+    fmt = format.lower()
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    if fmt == "xlsx" and not xlsx_available():
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="XLSX export requires the XlsxWriter package")
+
+    user_id = getattr(current_user, 'id', 1)
+    filters = {
+        'client': client,
+        'matter': matter,
+        'timekeeper': timekeeper,
+        'date_from': date_from,
+        'date_to': date_to,
+        'entry_type': entry_type
+    }
+    filename = f"timesheet_entries_{date.today().isoformat()}.{fmt}"
+    return StreamingResponse(
+        stream_export(fmt, user_id, filters),
+        media_type=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @router.get("/entries", response_model=TimesheetListResponse)
 async def get_timesheet_entries_endpoint(
     page: int = Query(1, ge=1, description="Page number"),
@@ -245,11 +339,21 @@ async def get_timesheet_entries_endpoint(
     date_from: Optional[date] = Query(None, description="Filter from date"),
     date_to: Optional[date] = Query(None, description="Filter to date"),
     entry_type: Optional[str] = Query(None, description="Filter by entry type"),
+    cursor: Optional[str] = Query(None, description="Continue after this cursor (next_cursor of the previous page)"),
+    include_total: bool = Query(True, description="Include the total number of matching entries"),
     current_user: User = Depends(get_current_user)
 ):
     """
-    Get timesheet entries with filtering and pagination
+    Get timesheet entries with filtering and pagination.
+    Pass the returned next_cursor as `cursor` to fetch the following page;
+    cursor pagination stays fast on deep pages, unlike page/offset.
     """
+    if cursor:
+        try:
+            decode_timesheet_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
     try:
         # Try database first
         try:
@@ -262,13 +366,15 @@ async def get_timesheet_entries_endpoint(
                 'date_to': date_to,
                 'entry_type': entry_type,
                 'limit': page_size,
-                'offset': (page - 1) * page_size
+                'offset': (page - 1) * page_size,
+                'cursor': cursor
             }
-            db_result = get_timesheet_entries(user_id, filters)
+            db_result = await get_timesheet_entries(user_id, filters)
             if db_result["success"] and db_result["data"] is not None:
                 entries = []
                 for entry_data in db_result["data"]:
                     mapped_data = {
+                        "id": str(entry_data["id"]) if entry_data.get("id") is not None else None,
                         "client": entry_data.get("CLIENT") or entry_data.get("client"),
                         "matter": entry_data.get("MATTER") or entry_data.get("matter"),
                         "timekeeper": entry_data.get("TIMEKEEPER") or entry_data.get("timekeeper"),
@@ -293,7 +399,12 @@ async def get_timesheet_entries_endpoint(
                         entries.append(entry)
                     except Exception as model_error:
                         continue
-                return TimesheetListResponse(success=True, entries=entries, total_count=len(entries), page=page, page_size=page_size)
+                total_count = await count_timesheet_entries(user_id, filters) if include_total else None
+                next_cursor = db_result.get("next_cursor")
+                return TimesheetListResponse(
+                    success=True, entries=entries, total_count=total_count, page=page, page_size=page_size,
+                    next_cursor=next_cursor, has_more=next_cursor is not None
+                )
             else:
                 raise Exception("Database query failed")
         except Exception as db_error:
@@ -322,10 +433,52 @@ async def get_timesheet_entries_endpoint(
             start_idx = (page - 1) * page_size
             end_idx = start_idx + page_size
             paginated_entries = filtered_entries[start_idx:end_idx]
-            return TimesheetListResponse(success=True, entries=paginated_entries, total_count=total_count, page=page, page_size=page_size)
+            return TimesheetListResponse(
+                success=True, entries=paginated_entries, total_count=total_count, page=page, page_size=page_size,
+                has_more=end_idx < total_count
+            )
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to retrieve timesheet entries: {str(e)}")
 
+@router.get("/summary", response_model=TimesheetSummaryResponse)
+async def get_timesheet_summary_endpoint(
+    group_by: Optional[str] = Query(None, description="Comma-separated: client, matter, timekeeper, phase_task, entry_type, period"),
+    period: str = Query("month", description="Period granularity: day, week, month, quarter, year"),
+    client: Optional[str] = Query(None, description="Filter by client"),
+    matter: Optional[str] = Query(None, description="Filter by matter"),
+    timekeeper: Optional[str] = Query(None, description="Filter by timekeeper"),
+    date_from: Optional[date] = Query(None, description="Filter from date"),
+    date_to: Optional[date] = Query(None, description="Filter to date"),
+    entry_type: Optional[str] = Query(None, description="Filter by entry type"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Hours worked, hours billed and totals per group, split by currency.
+    Computed in SQL from incrementally maintained rollups, never from raw entries.
+    """
+    dimensions = [d.strip() for d in group_by.split(",") if d.strip()] if group_by else []
+    filters = {
+        'client': client,
+        'matter': matter,
+        'timekeeper': timekeeper,
+        'date_from': date_from,
+        'date_to': date_to,
+        'entry_type': entry_type
+    }
+    try:
+        rows = await get_timesheet_summary(getattr(current_user, 'id', 1), dimensions, period, filters)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to summarize timesheet entries: {str(e)}")
+
+    groups, totals = [], []
+    for row in rows:
+        summary_row = TimesheetSummaryRow(**{k: v for k, v in row.items() if k != "is_total" and v is not None})
+        (totals if row["is_total"] else groups).append(summary_row)
+
+    return TimesheetSummaryResponse(success=True, group_by=dimensions, period=period, groups=groups, totals=totals)
+
 @router.get("/entries/{entry_id}", response_model=TimesheetResponse)
 async def get_timesheet_entry(
     entry_id: str,
@@ -419,58 +572,35 @@ async def timesheet_health_check():
 
 @router.get("/debug/database")
 async def debug_database_connection():
-    from database_setup import get_connection, DB_CONFIG
-    conn = get_connection()
-    if conn:
-        try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT version()")
-            version = cursor.fetchone()
-            cursor.execute("SELECT current_database()")
-            current_database = cursor.fetchone()
-            cursor.execute("SELECT current_schema()")
-            current_schema = cursor.fetchone()
-            cursor.execute("SELECT current_user")
-            current_user = cursor.fetchone()
-            cursor.close()
-            conn.close()
-            return {
-                "database_connection": "success",
-                "postgres_version": version[0] if version else "unknown",
-                "current_database": current_database[0] if current_database else "None",
-                "current_schema": current_schema[0] if current_schema else "None",
-                "current_user": current_user[0] if current_user else "None",
-                "config": {
-                    "host": DB_CONFIG.get('host', 'not_set'),
-                    "port": DB_CONFIG.get('port', 'not_set'),
-                    "database": DB_CONFIG.get('dbname', 'not_set'),
-                    "user": DB_CONFIG.get('user', 'not_set'),
-                    "password": "***" if DB_CONFIG.get('password') else 'not_set'
-                }
-            }
-        except Exception as e:
-            return {
-                "database_connection": "failed",
-                "error": str(e),
-                "config": {
-                    "host": DB_CONFIG.get('host', 'not_set'),
-                    "port": DB_CONFIG.get('port', 'not_set'),
-                    "database": DB_CONFIG.get('dbname', 'not_set'),
-                    "user": DB_CONFIG.get('user', 'not_set'),
-                    "password": "***" if DB_CONFIG.get('password') else 'not_set'
-                }
-            }
-    else:
+    from database_setup import DB_CONFIG
+    config = {
+        "host": DB_CONFIG.get('host', 'not_set'),
+        "port": DB_CONFIG.get('port', 'not_set'),
+        "database": DB_CONFIG.get('dbname', 'not_set'),
+        "user": DB_CONFIG.get('user', 'not_set'),
+        "password": "***" if DB_CONFIG.get('password') else 'not_set'
+    }
+    try:
+        row = await db.fetchrow("""
+            SELECT version() AS version,
+                   current_database() AS current_database,
+                   current_schema() AS current_schema,
+                   current_user AS current_user
+        """)
+        return {
+            "database_connection": "success",
+            "postgres_version": row["version"] if row else "unknown",
+            "current_database": row["current_database"] if row else "None",
+            "current_schema": row["current_schema"] if row else "None",
+            "current_user": row["current_user"] if row else "None",
+            "pool": db.pool.stats(),
+            "config": config
+        }
+    except Exception as e:
         return {
             "database_connection": "failed",
-            "error": "Could not establish connection",
-            "config": {
-                "host": DB_CONFIG.get('host', 'not_set'),
-                "port": DB_CONFIG.get('port', 'not_set'),
-                "database": DB_CONFIG.get('dbname', 'not_set'),
-                "user": DB_CONFIG.get('user', 'not_set'),
-                "password": "***" if DB_CONFIG.get('password') else 'not_set'
-            }
+            "error": str(e),
+            "config": config
         }
 
 @router.get("/debug/mock-data")
@@ -484,7 +614,7 @@ async def debug_mock_data():
 async def debug_raw_data(current_user: User = Depends(get_current_user)):
     try:
         user_id = getattr(current_user, 'id', 1)
-        db_result = get_timesheet_entries(user_id, {})
+        db_result = await get_timesheet_entries(user_id, {})
         return {
             "success": db_result["success"],
             "raw_data": db_result["data"],
@@ -517,7 +647,7 @@ async def debug_test_insert(current_user: User = Depends(get_current_user)):
     }
     try:
         user_id = getattr(current_user, 'id', 1)
-        db_result = create_timesheet_entry(user_id, test_entry_data)
+        db_result = await create_timesheet_entry(user_id, test_entry_data)
         return {
             "test_result": "success" if db_result["success"] else "failed",
             "database_response": db_result,
@@ -2,9 +2,9 @@ from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel, EmailStr, Field
 from typing import Optional
 from models import SuccessResponse, UserWithDetails
-from database_utils import run_postgres_query
-from auth_routes import get_current_user, UserResponse
-import bcrypt
+from database_async import db
+from auth_routes import get_current_user, invalidate_user_cache, UserResponse
+from password_hashing import hash_password
  
 router = APIRouter(prefix="/users", tags=["User Management"])
  
@@ -53,11 +53,11 @@ async def create_user(
     # Validate role_id if provided
     if data.role_id:
         role_query = "SELECT id, role_name FROM roles WHERE id = %s"
-        role_result = run_postgres_query(role_query, (data.role_id,))
-        if not role_result.get("data"):
+        role_row = await db.fetchrow(role_query, (data.role_id,))
+        if not role_row:
             raise HTTPException(status_code=400, detail="Invalid role_id")
        
-        role_name = role_result["data"][0]["role_name"]
+        role_name = role_row["role_name"]
        
         # OrgAdmin can't create SuperAdmin
         if current_user.role_name == "OrgAdmin" and role_name == "SuperAdmin":
@@ -67,66 +67,52 @@ async def create_user(
             )
  
     # Check if user already exists
-    user_check = run_postgres_query(
+    user_check = await db.fetchrow(
         "SELECT id FROM users WHERE username = %s OR email = %s",
         (data.username, data.email)
     )
-    if user_check.get("data"):
+    if user_check:
         raise HTTPException(
             status_code=400,
             detail="Username or email already exists"
         )
  
     # Hash password
-    hashed_password = bcrypt.hashpw(
-        data.password.encode("utf-8"),
-        bcrypt.gensalt()
-    ).decode("utf-8")
+    hashed_password = await hash_password(data.password)
  
-    # Insert user
+    # Insert user and fetch it back (with org and role names) in one round-trip
     insert_query = """
-        INSERT INTO users (username, email, password, name, role_id, org_id, is_active)
-        VALUES (%s, %s, %s, %s, %s, %s, TRUE)
+        WITH inserted AS (
+            INSERT INTO users (username, email, password, name, role_id, org_id, is_active)
+            VALUES (%s, %s, %s, %s, %s, %s, TRUE)
+            RETURNING id, username, email, name, org_id, role_id, is_active
+        )
+        SELECT i.*, o.name AS org_name, r.role_name
+        FROM inserted i
+        LEFT JOIN organizations o ON i.org_id = o.id
+        LEFT JOIN roles r ON i.role_id = r.id
     """
    
-    result = run_postgres_query(
-        insert_query,
-        (
-            data.username,
-            data.email,
-            hashed_password,
-            data.name,
-            data.role_id,
-            data.org_id
+    try:
+        user_row = await db.fetchrow(
+            insert_query,
+            (
+                data.username,
+                data.email,
+                hashed_password,
+                data.name,
+                data.role_id,
+                data.org_id
+            )
         )
-    )
- 
-    if not result.get("success"):
+    except Exception:
         raise HTTPException(status_code=500, detail="Failed to create user")
- 
-    # Fetch the created user
-    fetch_query = "SELECT id, username, email, name, org_id, role_id, is_active FROM users WHERE email = %s"
-    fetch_result = run_postgres_query(fetch_query, (data.email,))
    
-    if not fetch_result.get("data"):
+    if not user_row:
         raise HTTPException(status_code=500, detail="User created but could not retrieve details")
-   
-    user_row = fetch_result["data"][0]
- 
-    # Fetch org and role names for response
-    org_name = None
-    if user_row["org_id"]:
-        org_query = "SELECT name FROM organizations WHERE id = %s"
-        org_result = run_postgres_query(org_query, (user_row["org_id"],))
-        if org_result.get("data"):
-            org_name = org_result["data"][0]["name"]
- 
-    role_name = None
-    if user_row["role_id"]:
-        role_query = "SELECT role_name FROM roles WHERE id = %s"
-        role_result = run_postgres_query(role_query, (user_row["role_id"],))
-        if role_result.get("data"):
-            role_name = role_result["data"][0]["role_name"]
+ 
+    org_name = user_row["org_name"]
+    role_name = user_row["role_name"]
  
     user_response = UserWithDetails(
         id=user_row["id"],
@@ -160,7 +146,7 @@ async def list_users(
             LEFT JOIN roles r ON u.role_id = r.id
             ORDER BY u.id DESC
         """
-        res = run_postgres_query(query)
+        rows = await db.fetch(query)
     else:
         # OrgAdmin or others: restrict to org
         query = """
@@ -172,13 +158,13 @@ async def list_users(
             WHERE u.org_id = %s
             ORDER BY u.id DESC
         """
-        res = run_postgres_query(query, (current_user.org_id,))
+        rows = await db.fetch(query, (current_user.org_id,))
  
-    if not res.get("data"):
+    if not rows:
         return []
  
     users = []
-    for row in res["data"]:
+    for row in rows:
         users.append(UserWithDetails(
             id=row["id"],
             username=row["username"],
@@ -209,13 +195,11 @@ async def get_user(
         LEFT JOIN roles r ON u.role_id = r.id
         WHERE u.id = %s
     """
-    result = run_postgres_query(query, (user_id,))
+    row = await db.fetchrow(query, (user_id,))
    
-    if not result.get("data"):
+    if not row:
         raise HTTPException(status_code=404, detail="User not found")
    
-    row = result["data"][0]
-   
     return UserWithDetails(
         id=row["id"],
         username=row["username"],
@@ -248,11 +232,10 @@ async def update_user(
     """Update a user's fields. SuperAdmin can update any user; OrgAdmin can update users in their org (but not elevate to SuperAdmin)."""
     # Fetch existing user
     q = "SELECT id, org_id, role_id FROM users WHERE id = %s"
-    existing = run_postgres_query(q, (user_id,))
-    if not existing.get("data"):
+    row = await db.fetchrow(q, (user_id,))
+    if not row:
         raise HTTPException(status_code=404, detail="User not found")
  
-    row = existing["data"][0]
     target_org = row.get("org_id")
     target_role = row.get("role_id")
  
@@ -263,10 +246,10 @@ async def update_user(
  
     # If role_id provided, validate
     if data.role_id is not None:
-        role_check = run_postgres_query("SELECT role_name FROM roles WHERE id = %s", (data.role_id,))
-        if not role_check.get("data"):
+        role_check = await db.fetchrow("SELECT role_name FROM roles WHERE id = %s", (data.role_id,))
+        if not role_check:
             raise HTTPException(status_code=400, detail="Invalid role_id")
-        new_role_name = role_check["data"][0]["role_name"]
+        new_role_name = role_check["role_name"]
         if current_user.role_name == "OrgAdmin" and new_role_name == "SuperAdmin":
             raise HTTPException(status_code=403, detail="OrgAdmin cannot assign SuperAdmin role")
  
@@ -293,7 +276,7 @@ async def update_user(
         updates.append("is_active = %s")
         params.append(data.is_active)
     if data.password is not None:
-        hashed = bcrypt.hashpw(data.password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+        hashed = await hash_password(data.password)
         updates.append("password = %s")
         params.append(hashed)
  
@@ -302,10 +285,13 @@ async def update_user(
  
     params.append(user_id)
     update_query = f"UPDATE users SET {', '.join(updates)}, updated_at = NOW() WHERE id = %s"
-    res = run_postgres_query(update_query, tuple(params))
-    if not res.get("success"):
+    try:
+        await db.execute(update_query, tuple(params))
+    except Exception:
         raise HTTPException(status_code=500, detail="Failed to update user")
  
+    invalidate_user_cache(user_id)
+ 
     return {"success": True, "message": "User updated"}
  
  
@@ -317,24 +303,26 @@ async def delete_user(
     """Delete a user. Only SuperAdmin can delete across orgs; OrgAdmin can delete within org."""
     # Fetch existing user
     q = "SELECT org_id, role_id FROM users WHERE id = %s"
-    existing = run_postgres_query(q, (user_id,))
-    if not existing.get("data"):
+    row = await db.fetchrow(q, (user_id,))
+    if not row:
         raise HTTPException(status_code=404, detail="User not found")
-    row = existing["data"][0]
     if current_user.role_name == "OrgAdmin" and row.get("org_id") != current_user.org_id:
         raise HTTPException(status_code=403, detail="OrgAdmin can only delete users in their org")
  
     # Prevent deleting SuperAdmin by OrgAdmin
     if current_user.role_name == "OrgAdmin":
-        role_check = run_postgres_query("SELECT role_name FROM roles WHERE id = %s", (row.get("role_id"),))
-        if role_check.get("data") and role_check["data"][0]["role_name"] == "SuperAdmin":
+        role_check = await db.fetchrow("SELECT role_name FROM roles WHERE id = %s", (row.get("role_id"),))
+        if role_check and role_check["role_name"] == "SuperAdmin":
             raise HTTPException(status_code=403, detail="Cannot delete SuperAdmin")
  
     del_query = "DELETE FROM users WHERE id = %s"
-    res = run_postgres_query(del_query, (user_id,))
-    if not res.get("success"):
+    try:
+        await db.execute(del_query, (user_id,))
+    except Exception:
         raise HTTPException(status_code=500, detail="Failed to delete user")
  
+    invalidate_user_cache(user_id)
+ 
     return {"success": True, "message": "User deleted"}
  
  
\ No newline at end of file
@@ -0,0 +1,85 @@
+import hashlib
+import os
+import re
+import uuid
+
+from fastapi import UploadFile
+
+from utils.uploads import save_upload_file
+
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+class BlobStore:
+    """
+    Content-addressed file storage: each distinct file is kept once, under
+    the key <prefix>/<first two hex digits>/<sha256> of a storage backend
+    (see utils.storage). Callers track who references a blob and call
+    remove() once nothing does, making sure a blob being adopted is already
+    referenced, so that a concurrent remove() of the same hash keeps it.
+    """
+
+    def __init__(self, storage, tmp_dir: str, prefix: str = "blobs"):
+        self.storage = storage
+        self.tmp_dir = tmp_dir
+        self.prefix = prefix
+        os.makedirs(tmp_dir, exist_ok=True)
+
+    def key(self, sha256: str) -> str:
+        if not SHA256_PATTERN.match(sha256):
+            raise ValueError(f"Invalid blob hash: {sha256!r}")
+        return f"{self.prefix}/{sha256[:2]}/{sha256}"
+
+    async def exists(self, sha256: str) -> bool:
+        return await self.storage.stat(self.key(sha256)) is not None
+
+    async def local_path(self, sha256: str):
+        """Path of the blob on local disk (fetched from remote storage if needed), or None"""
+        return await self.storage.local_path(self.key(sha256))
+
+    def pinned_path(self, sha256: str):
+        """Async context manager: local_path(), kept on disk until the block exits"""
+        return self.storage.pinned_path(self.key(sha256))
+
+    async def download(self, sha256: str, target_path: str):
+        """Copy the blob to a local file (for backends without local_path)"""
+        await self.storage.download_file(self.key(sha256), target_path)
+
+    async def download_url(self, sha256: str, filename: str = None, content_type: str = None):
+        """A short-lived URL to fetch the blob from storage directly, or None"""
+        return await self.storage.download_url(self.key(sha256), filename, content_type)
+
+    def temp_path(self) -> str:
+        """A local scratch path, next to the store when it is on local disk"""
+        return os.path.join(self.tmp_dir, uuid.uuid4().hex)
+
+    async def adopt(self, tmp_path: str, sha256: str) -> bool:
+        """
+        Move a fully written file into the store under its hash. If the content
+        is already stored the temporary file is dropped. Returns True when a new
+        blob was created.
+        """
+        if await self.exists(sha256):
+            self.discard_temp(tmp_path)
+            return False
+        await self.storage.put_file(self.key(sha256), tmp_path)
+        return True
+
+    async def spool_upload(self, upload: UploadFile, max_size: int):
+        """
+        Stream an upload to a temporary file, hashing it on the way.
+        Returns (sha256, size, tmp_path) ready for adopt().
+        """
+        digest = hashlib.sha256()
+        tmp_path = self.temp_path()
+        size = await save_upload_file(upload, tmp_path, max_size, on_chunk=digest.update)
+        return digest.hexdigest(), size, tmp_path
+
+    def discard_temp(self, tmp_path: str):
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+    async def remove(self, sha256: str):
+        await self.storage.delete(self.key(sha256))
@@ -0,0 +1,289 @@
+import mimetypes
+import os
+import re
+import stat
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+
+from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import Response
+
+FILE_CHUNK_SIZE = 256 * 1024
+# More ranges than this in one request are answered with the whole file
+MAX_RANGES = 16
+
+RANGE_PATTERN = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+
+
+def parse_range_header(value: str, size: int):
+    """
+    Parse a Range header against a file of `size` bytes.
+    Returns a sorted list of merged (start, end) inclusive ranges, [] if none is
+    satisfiable, or None when the header is malformed (and must be ignored).
+    """
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        match = RANGE_PATTERN.match(part)
+        if not match:
+            return None
+        first, last = match.groups()
+        if first == "" and last == "":
+            return None
+        if first == "":
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length == 0 or size == 0:
+                continue
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            if start >= size:
+                continue
+            end = min(int(last), size - 1) if last else size - 1
+        ranges.append((start, end))
+
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _etag_matches(header_value: str, etag: str, weak: bool) -> bool:
+    if header_value.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header_value.split(","):
+        candidate = candidate.strip()
+        if weak and candidate.startswith("W/"):
+            candidate = candidate[2:]
+        elif not weak and (candidate.startswith("W/") or etag.startswith("W/")):
+            continue
+        if candidate == opaque:
+            return True
+    return False
+
+
+def content_disposition(filename: str, disposition: str = "attachment") -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"{disposition}; filename*=utf-8''{quoted}"
+    return f'{disposition}; filename="{filename}"'
+
+
+class ConditionalFileResponse(Response):
+    """
+    File response with validators and byte ranges:
+
+    - ETag (strong when the content hash is passed in) and Last-Modified
+    - 304 for If-None-Match / If-Modified-Since
+    - Range / If-Range, answering 206 (single range or multipart/byteranges)
+      or 416 when no range is satisfiable
+    - whole-file bodies are handed to the server with the ASGI pathsend
+      extension when it is available (zero-copy), otherwise read in chunks
+      in the thread pool
+    """
+
+    def __init__(self, path: str, filename: str = None, media_type: str = None,
+                 etag: str = None, stat_result: os.stat_result = None,
+                 status_code: int = 200, headers: dict = None,
+                 content_disposition_type: str = "attachment", cache_control: str = None,
+                 background=None):
+        self.path = path
+        self.status_code = status_code
+        self.filename = filename
+        if media_type is None:
+            media_type = mimetypes.guess_type(filename or path)[0] or "application/octet-stream"
+        self.media_type = media_type
+        self.stat_result = stat_result
+        self.content_hash = etag
+        self.background = background
+        self.init_headers(headers)
+        if filename is not None:
+            self.headers["content-disposition"] = content_disposition(filename, content_disposition_type)
+        if cache_control:
+            self.headers["cache-control"] = cache_control
+
+    def _validators(self, stat_result: os.stat_result):
+        if self.content_hash:
+            etag = f'"{self.content_hash}"'
+        else:
+            etag = f'W/"{int(stat_result.st_mtime):x}-{stat_result.st_size:x}"'
+        return etag, formatdate(stat_result.st_mtime, usegmt=True)
+
+    def _not_modified(self, request_headers: Headers, etag: str, stat_result: os.stat_result) -> bool:
+        if "if-none-match" in request_headers:
+            return _etag_matches(request_headers["if-none-match"], etag, weak=True)
+        if "if-modified-since" in request_headers:
+            try:
+                since = parsedate_to_datetime(request_headers["if-modified-since"]).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(stat_result.st_mtime) <= since
+        return False
+
+    def _range_allowed(self, request_headers: Headers, etag: str, last_modified: str) -> bool:
+        if_range = request_headers.get("if-range")
+        if if_range is None:
+            return True
+        if if_range.strip().startswith(('"', 'W/')):
+            return _etag_matches(if_range, etag, weak=False)
+        return if_range.strip() == last_modified
+
+    async def _send_start(self, send, status_code: int, extra_headers: dict):
+        headers = self.raw_headers + [
+            (key.encode("latin-1"), value.encode("latin-1")) for key, value in extra_headers.items()
+        ]
+        await send({"type": "http.response.start", "status": status_code, "headers": headers})
+
+    async def _send_file_slice(self, send, handle, start: int, length: int, more_body_after: bool):
+        await run_in_threadpool(handle.seek, start)
+        remaining = length
+        while remaining > 0:
+            chunk = await run_in_threadpool(handle.read, min(FILE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            await send({
+                "type": "http.response.body",
+                "body": chunk,
+                "more_body": remaining > 0 or more_body_after,
+            })
+        if remaining > 0 and not more_body_after:
+            # File shrank underneath us; end the response instead of hanging
+            await send({"type": "http.response.body", "body": b""})
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self._respond(scope, receive, send)
+        finally:
+            if self.background is not None:
+                await self.background()
+
+    async def _respond(self, scope, receive, send):
+        method = scope.get("method", "GET").upper()
+        send_body = method != "HEAD"
+        request_headers = Headers(scope=scope)
+
+        stat_result = self.stat_result
+        if stat_result is None:
+            try:
+                stat_result = await run_in_threadpool(os.stat, self.path)
+            except FileNotFoundError:
+                return await Response("File not found", status_code=404)(scope, receive, send)
+        if not stat.S_ISREG(stat_result.st_mode):
+            return await Response("File not found", status_code=404)(scope, receive, send)
+
+        size = stat_result.st_size
+        etag, last_modified = self._validators(stat_result)
+        validators = {"etag": etag, "last-modified": last_modified, "accept-ranges": "bytes"}
+
+        if self.status_code == 200 and method in ("GET", "HEAD"):
+            if self._not_modified(request_headers, etag, stat_result):
+                for name in ("content-type", "content-disposition", "content-length"):
+                    if name in self.headers:
+                        del self.headers[name]
+                await self._send_start(send, 304, validators)
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        ranges = None
+        if self.status_code == 200 and "range" in request_headers and self._range_allowed(request_headers, etag, last_modified):
+            ranges = parse_range_header(request_headers["range"], size)
+            if ranges is not None and len(ranges) > MAX_RANGES:
+                ranges = None
+
+        if ranges == []:
+            await self._send_start(send, 416, {**validators, "content-range": f"bytes */{size}", "content-length": "0"})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if not ranges:
+            await self._send_start(send, self.status_code, {**validators, "content-length": str(size)})
+            if not send_body:
+                await send({"type": "http.response.body", "body": b""})
+            elif "http.response.pathsend" in scope.get("extensions", {}):
+                await send({"type": "http.response.pathsend", "path": os.path.abspath(self.path)})
+            else:
+                with await run_in_threadpool(open, self.path, "rb") as handle:
+                    await self._send_file_slice(send, handle, 0, size, more_body_after=False)
+                    if size == 0:
+                        await send({"type": "http.response.body", "body": b""})
+            return
+
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            await self._send_start(send, 206, {
+                **validators,
+                "content-range": f"bytes {start}-{end}/{size}",
+                "content-length": str(end - start + 1),
+            })
+            if not send_body:
+                await send({"type": "http.response.body", "body": b""})
+                return
+            with await run_in_threadpool(open, self.path, "rb") as handle:
+                await self._send_file_slice(send, handle, start, end - start + 1, more_body_after=False)
+            return
+
+        # Multiple ranges: multipart/byteranges
+        boundary = uuid.uuid4().hex
+        part_headers = [
+            (
+                f"--{boundary}\r\n"
+                f"Content-Type: {self.media_type}\r\n"
+                f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+            ).encode("latin-1")
+            for start, end in ranges
+        ]
+        closing = f"\r\n--{boundary}--\r\n".encode("latin-1")
+        content_length = (
+            sum(len(header) for header in part_headers)
+            + sum(end - start + 1 for start, end in ranges)
+            + 2 * (len(ranges) - 1)  # CRLF between parts
+            + len(closing)
+        )
+        del self.headers["content-type"]
+        await self._send_start(send, 206, {
+            **validators,
+            "content-type": f"multipart/byteranges; boundary={boundary}",
+            "content-length": str(content_length),
+        })
+        if not send_body:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        with await run_in_threadpool(open, self.path, "rb") as handle:
+            for index, ((start, end), header) in enumerate(zip(ranges, part_headers)):
+                prefix = header if index == 0 else b"\r\n" + header
+                await send({"type": "http.response.body", "body": prefix, "more_body": True})
+                await self._send_file_slice(send, handle, start, end - start + 1, more_body_after=True)
+            await send({"type": "http.response.body", "body": closing})
+
+
+class ConditionalStaticFiles(StaticFiles):
+    """
+    StaticFiles serving through ConditionalFileResponse (weak ETags from
+    mtime and size). Only plain files at the top of the directory are served: subdirectories
+    and hidden names are never exposed.
+    """
+
+    async def get_response(self, path: str, scope):
+        if path.startswith(".") or "/" in path.replace(os.sep, "/"):
+            raise HTTPException(status_code=404)
+        return await super().get_response(path, scope)
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        return ConditionalFileResponse(full_path, stat_result=stat_result, status_code=status_code)
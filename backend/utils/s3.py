@@ -1,50 +1,437 @@
-import boto3
+import asyncio
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import quote
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 
 load_dotenv()
 
-s3 = boto3.client(
-    "s3",
-    region_name=os.getenv("AWS_REGION")
-)
-
 BUCKET_NAME = os.getenv("AWS_S3_BUCKET")
 TRANSLATED_BUCKET_NAME = os.getenv("AWS_S3_TRANSLATED_BUCKET")
+# Point at MinIO / moto / LocalStack instead of AWS, e.g. http://localhost:9000
+AWS_S3_ENDPOINT_URL = os.getenv("AWS_S3_ENDPOINT_URL") or None
+
+# Objects at least this large use multipart upload
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", 16 * 1024 * 1024))
+# S3 requires parts of at least 5MB (except the last) and at most 10,000 parts
+S3_PART_SIZE = max(int(os.getenv("S3_PART_SIZE", 16 * 1024 * 1024)), 5 * 1024 * 1024)
+S3_MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", 8))
+# Parts held in memory (queued or uploading) across all uploads of the process
+S3_MAX_BUFFERED_PARTS = int(os.getenv("S3_MAX_BUFFERED_PARTS", S3_MAX_CONCURRENCY * 2))
+S3_PART_RETRIES = int(os.getenv("S3_PART_RETRIES", 3))
+S3_MAX_PARTS = 10000
+# Lifetime of presigned URLs handed to clients for direct transfers
+S3_PRESIGN_EXPIRES_SECONDS = int(os.getenv("S3_PRESIGN_EXPIRES_SECONDS", 900))
+
+_client = None
+_client_lock = threading.Lock()
+# Runs blocking boto3 transfers for the async wrappers, so long uploads don't
+# tie up the shared request thread pool
+_executor = ThreadPoolExecutor(max_workers=S3_MAX_CONCURRENCY, thread_name_prefix="s3")
+# Multipart parts of every upload share one pool and one memory budget. Part
+# jobs never wait for anything but S3, so uploads waiting on _executor threads
+# for a buffer slot always get one back.
+_part_executor = ThreadPoolExecutor(max_workers=S3_MAX_CONCURRENCY, thread_name_prefix="s3-part")
+_part_slots = threading.BoundedSemaphore(S3_MAX_BUFFERED_PARTS)
+
+
+class S3UploadError(Exception):
+    """Raised when an upload fails (any multipart upload has been aborted)"""
+
+
+def get_s3_client():
+    """Shared boto3 client, created on first use (boto3 clients are thread-safe)"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = boto3.client(
+                    "s3",
+                    region_name=os.getenv("AWS_REGION"),
+                    endpoint_url=AWS_S3_ENDPOINT_URL,
+                    config=Config(
+                        max_pool_connections=S3_MAX_CONCURRENCY * 2,
+                        retries={"max_attempts": 5, "mode": "adaptive"},
+                    ),
+                )
+    return _client
+
+
+def object_url(bucket_name: str, key: str) -> str:
+    if AWS_S3_ENDPOINT_URL:
+        return f"{AWS_S3_ENDPOINT_URL.rstrip('/')}/{bucket_name}/{quote(key)}"
+    return f"https://{bucket_name}.s3.{os.getenv('AWS_REGION')}.amazonaws.com/{quote(key)}"
+
 
 def s3_health_check():
     try:
-        s3.head_bucket(Bucket=BUCKET_NAME)
+        get_s3_client().head_bucket(Bucket=BUCKET_NAME)
         return True
     except Exception:
         return False
 
 
-def upload_file_to_s3(file_path: str, file_name: str, bucket_name: str = None) -> str:
+# ============================================================
+#  MULTIPART TRANSFER ENGINE
+# ============================================================
+def iter_file_parts(file_path: str, part_size: int = S3_PART_SIZE):
+    """Read a file part by part (only one part in memory per call)"""
+    with open(file_path, "rb") as handle:
+        while True:
+            data = handle.read(part_size)
+            if not data:
+                break
+            yield data
+
+
+def rechunk(chunks, part_size: int):
+    """Regroup an iterator of byte strings of any size into part_size pieces"""
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= part_size:
+            yield bytes(buffer[:part_size])
+            del buffer[:part_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def _upload_part(client, bucket_name: str, key: str, upload_id: str, part_number: int, data: bytes) -> dict:
+    """Upload one part, retrying it on its own with exponential backoff"""
+    for attempt in range(S3_PART_RETRIES + 1):
+        try:
+            response = client.upload_part(
+                Bucket=bucket_name, Key=key, UploadId=upload_id,
+                PartNumber=part_number, Body=data
+            )
+            return {"PartNumber": part_number, "ETag": response["ETag"]}
+        except Exception:
+            if attempt == S3_PART_RETRIES:
+                raise
+            time.sleep(min(2 ** attempt * 0.5, 8))
+
+
+def _submit_part(*args):
+    """Queue _upload_part on the shared part pool; the caller holds a part slot"""
+    future = _part_executor.submit(_upload_part, *args)
+    future.add_done_callback(lambda _: _part_slots.release())
+    return future
+
+
+def _abort(client, bucket_name: str, key: str, upload_id: str):
+    try:
+        client.abort_multipart_upload(Bucket=bucket_name, Key=key, UploadId=upload_id)
+    except Exception as e:
+        print(f"⚠️ Failed to abort multipart upload {upload_id} for {key}: {e}")
+
+
+def upload_parts(parts, bucket_name: str, key: str, content_type: str = None,
+                 concurrency: int = S3_MAX_CONCURRENCY, client=None) -> str:
     """
-    Upload a file to S3 and return the URL
+    Upload an iterator of parts (byte strings of at least 5MB, except the
+    last) as one object. Parts upload on the shared part pool, at most
+    `concurrency` * 2 of them in flight per call and S3_MAX_BUFFERED_PARTS
+    across all uploads (a part is only read once a slot is free). Small inputs (a single part
+    below S3_MULTIPART_THRESHOLD) use one put_object. Any failure aborts the
+    multipart upload so no orphaned parts are billed. Returns the object URL.
     """
-    if bucket_name is None:
-        bucket_name = BUCKET_NAME
+    client = client or get_s3_client()
+    extra = {"ContentType": content_type} if content_type else {}
+    parts = iter(parts)
+
+    first = next(parts, b"")
+    second = next(parts, None)
+    if second is None and len(first) < S3_MULTIPART_THRESHOLD:
+        try:
+            client.put_object(Bucket=bucket_name, Key=key, Body=first, **extra)
+        except Exception as e:
+            raise S3UploadError(f"Failed to upload {key} to S3: {e}") from e
+        return object_url(bucket_name, key)
+
+    def all_parts():
+        yield first
+        if second is not None:
+            yield second
+            yield from parts
 
+    upload_id = client.create_multipart_upload(Bucket=bucket_name, Key=key, **extra)["UploadId"]
+    completed = []
+    in_flight = set()
     try:
-        s3.upload_file(file_path, bucket_name, file_name)
-        url = f"https://{bucket_name}.s3.{os.getenv('AWS_REGION')}.amazonaws.com/{file_name}"
-        return url
-    except Exception as e:
-        raise Exception(f"Failed to upload file to S3: {str(e)}")
+        source = all_parts()
+        part_number = 0
+        while True:
+            _part_slots.acquire()
+            try:
+                data = next(source, None)
+            except BaseException:
+                _part_slots.release()
+                raise
+            if data is None:
+                _part_slots.release()
+                break
+            part_number += 1
+            if part_number > S3_MAX_PARTS:
+                _part_slots.release()
+                raise S3UploadError(f"Too many parts for {key}; increase S3_PART_SIZE")
+            in_flight.add(_submit_part(client, bucket_name, key, upload_id, part_number, data))
+            del data
+            if len(in_flight) >= concurrency * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                completed.extend(future.result() for future in done)
+        completed.extend(future.result() for future in in_flight)
+
+        completed.sort(key=lambda part: part["PartNumber"])
+        client.complete_multipart_upload(
+            Bucket=bucket_name, Key=key, UploadId=upload_id,
+            MultipartUpload={"Parts": completed}
+        )
+    except BaseException as e:
+        for future in in_flight:
+            future.cancel()
+        wait(in_flight)
+        _abort(client, bucket_name, key, upload_id)
+        if isinstance(e, Exception) and not isinstance(e, S3UploadError):
+            raise S3UploadError(f"Failed to upload {key} to S3: {e}") from e
+        raise
+    return object_url(bucket_name, key)
 
 
-def upload_file_content_to_s3(file_content: bytes, file_name: str, bucket_name: str = None) -> str:
+def upload_stream_to_s3(chunks, file_name: str, bucket_name: str = None,
+                        content_type: str = None, client=None) -> str:
+    """Upload an iterator of byte chunks of any size without buffering it all"""
+    return upload_parts(
+        rechunk(chunks, S3_PART_SIZE), bucket_name or BUCKET_NAME, file_name,
+        content_type=content_type, client=client
+    )
+
+
+def upload_file_to_s3(file_path: str, file_name: str, bucket_name: str = None,
+                      content_type: str = None, client=None) -> str:
+    """
+    Upload a file to S3 and return the URL
+    """
+    return upload_parts(
+        iter_file_parts(file_path), bucket_name or BUCKET_NAME, file_name,
+        content_type=content_type, client=client
+    )
+
+
+def upload_file_content_to_s3(file_content: bytes, file_name: str, bucket_name: str = None,
+                              content_type: str = None, client=None) -> str:
     """
     Upload file content directly to S3 and return the URL
     """
-    if bucket_name is None:
-        bucket_name = BUCKET_NAME
+    view = memoryview(file_content)
+    parts = (bytes(view[i:i + S3_PART_SIZE]) for i in range(0, len(view), S3_PART_SIZE))
+    return upload_parts(
+        parts, bucket_name or BUCKET_NAME, file_name,
+        content_type=content_type, client=client
+    )
+
+
+# ============================================================
+#  ASYNC WRAPPERS (for route handlers)
+# ============================================================
+async def run_s3(fn, *args, **kwargs):
+    """Run a blocking boto3 call on the S3 executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, lambda: fn(*args, **kwargs))
+
+
+async def upload_file_to_s3_async(file_path: str, file_name: str, bucket_name: str = None,
+                                  content_type: str = None, client=None) -> str:
+    return await run_s3(upload_file_to_s3, file_path, file_name, bucket_name, content_type, client)
+
+
+async def upload_file_content_to_s3_async(file_content: bytes, file_name: str, bucket_name: str = None,
+                                          content_type: str = None, client=None) -> str:
+    return await run_s3(upload_file_content_to_s3, file_content, file_name, bucket_name, content_type, client)
+
+
+async def upload_async_stream_to_s3(chunks, file_name: str, bucket_name: str = None,
+                                    content_type: str = None, client=None) -> str:
+    """
+    Upload an async iterator of byte chunks (e.g. a request body). Parts are
+    uploaded on the shared part pool as soon as they fill, up to
+    S3_MAX_CONCURRENCY of them per upload and S3_MAX_BUFFERED_PARTS across
+    all uploads, so memory stays bounded however many uploads run at once.
+    """
+    client = client or get_s3_client()
+    bucket_name = bucket_name or BUCKET_NAME
+    key = file_name
+    extra = {"ContentType": content_type} if content_type else {}
+
+    buffer = bytearray()
+    upload_id = None
+    tasks = []
+    slots = asyncio.Semaphore(S3_MAX_CONCURRENCY)
+
+    jobs = []
+
+    def send_part(part_number: int, data: bytes):
+        # Submitted right away, so cancelling it always gives both slots back
+        job = _submit_part(client, bucket_name, key, upload_id, part_number, data)
+        jobs.append(job)
+        future = asyncio.wrap_future(job)
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+    async def acquire_slots():
+        await slots.acquire()
+        # Polled rather than waited on in a thread, to keep the event loop free
+        while not _part_slots.acquire(blocking=False):
+            await asyncio.sleep(0.05)
 
     try:
-        s3.put_object(Bucket=bucket_name, Key=file_name, Body=file_content)
-        url = f"https://{bucket_name}.s3.{os.getenv('AWS_REGION')}.amazonaws.com/{file_name}"
-        return url
-    except Exception as e:
-        raise Exception(f"Failed to upload file content to S3: {str(e)}")
+        async for chunk in chunks:
+            buffer += chunk
+            while len(buffer) >= max(S3_PART_SIZE, S3_MULTIPART_THRESHOLD if upload_id is None else 0):
+                if upload_id is None:
+                    upload_id = (await run_s3(
+                        client.create_multipart_upload, Bucket=bucket_name, Key=key, **extra
+                    ))["UploadId"]
+                data = bytes(buffer[:S3_PART_SIZE])
+                del buffer[:S3_PART_SIZE]
+                if len(tasks) >= S3_MAX_PARTS:
+                    raise S3UploadError(f"Too many parts for {key}; increase S3_PART_SIZE")
+                await acquire_slots()
+                tasks.append(send_part(len(tasks) + 1, data))
+
+        if upload_id is None:
+            await run_s3(client.put_object, Bucket=bucket_name, Key=key, Body=bytes(buffer), **extra)
+            return object_url(bucket_name, key)
+
+        if buffer:
+            await acquire_slots()
+            tasks.append(send_part(len(tasks) + 1, bytes(buffer)))
+        completed = await asyncio.gather(*tasks)
+        await run_s3(
+            client.complete_multipart_upload,
+            Bucket=bucket_name, Key=key, UploadId=upload_id,
+            MultipartUpload={"Parts": sorted(completed, key=lambda part: part["PartNumber"])}
+        )
+        return object_url(bucket_name, key)
+
+    except BaseException as e:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Parts already uploading finish first, so none lands after the abort
+        running = [asyncio.wrap_future(job) for job in jobs if not job.done()]
+        if running:
+            await asyncio.wait(running)
+        if upload_id is not None:
+            await run_s3(_abort, client, bucket_name, key, upload_id)
+        if isinstance(e, Exception) and not isinstance(e, S3UploadError):
+            raise S3UploadError(f"Failed to upload {key} to S3: {e}") from e
+        raise
+
+
+# ============================================================
+#  PRESIGNED URLS (clients transfer bytes directly with S3)
+# ============================================================
+def presigned_put_url(key: str, content_type: str = None, bucket_name: str = None,
+                      expires_in: int = S3_PRESIGN_EXPIRES_SECONDS) -> str:
+    """
+    URL for a single PUT of the whole object. When content_type is given
+    the client must send the same Content-Type header.
+    """
+    params = {"Bucket": bucket_name or BUCKET_NAME, "Key": key}
+    if content_type:
+        params["ContentType"] = content_type
+    return get_s3_client().generate_presigned_url("put_object", Params=params, ExpiresIn=expires_in)
+
+
+def presigned_get_url(key: str, filename: str = None, content_type: str = None,
+                      bucket_name: str = None, expires_in: int = S3_PRESIGN_EXPIRES_SECONDS) -> str:
+    """URL to download an object, optionally as an attachment named filename"""
+    params = {"Bucket": bucket_name or BUCKET_NAME, "Key": key}
+    if filename:
+        params["ResponseContentDisposition"] = f"attachment; filename*=utf-8''{quote(filename)}"
+    if content_type:
+        params["ResponseContentType"] = content_type
+    return get_s3_client().generate_presigned_url("get_object", Params=params, ExpiresIn=expires_in)
+
+
+def multipart_part_size(size: int) -> int:
+    """S3_PART_SIZE, or larger when needed to stay within S3_MAX_PARTS"""
+    return max(S3_PART_SIZE, -(-size // S3_MAX_PARTS))
+
+
+def create_presigned_multipart_upload(key: str, size: int, content_type: str = None,
+                                      bucket_name: str = None,
+                                      expires_in: int = S3_PRESIGN_EXPIRES_SECONDS) -> dict:
+    """
+    Start a multipart upload of `size` bytes and presign a PUT URL for every
+    part. Returns {"upload_id", "part_size", "parts": [{"part_number", "url"}]}.
+    """
+    client = get_s3_client()
+    bucket_name = bucket_name or BUCKET_NAME
+    extra = {"ContentType": content_type} if content_type else {}
+    part_size = multipart_part_size(size)
+    upload_id = client.create_multipart_upload(Bucket=bucket_name, Key=key, **extra)["UploadId"]
+    parts = presigned_part_urls(
+        key, upload_id, range(1, -(-size // part_size) + 1), bucket_name, expires_in
+    )
+    return {"upload_id": upload_id, "part_size": part_size, "parts": parts}
+
+
+def presigned_part_urls(key: str, upload_id: str, part_numbers, bucket_name: str = None,
+                        expires_in: int = S3_PRESIGN_EXPIRES_SECONDS) -> list:
+    """PUT URLs for parts of a multipart upload: [{"part_number", "url"}]"""
+    client = get_s3_client()
+    bucket_name = bucket_name or BUCKET_NAME
+    return [
+        {
+            "part_number": part_number,
+            "url": client.generate_presigned_url(
+                "upload_part",
+                Params={"Bucket": bucket_name, "Key": key, "UploadId": upload_id, "PartNumber": part_number},
+                ExpiresIn=expires_in,
+            ),
+        }
+        for part_number in part_numbers
+    ]
+
+
+def complete_multipart_upload(key: str, upload_id: str, parts: list = None, bucket_name: str = None):
+    """
+    Finish a client-driven multipart upload. parts is a list of
+    {"PartNumber", "ETag"}; when omitted, the parts S3 holds are used.
+    """
+    client = get_s3_client()
+    bucket_name = bucket_name or BUCKET_NAME
+    if parts is None:
+        parts = []
+        paginator = client.get_paginator("list_parts")
+        for page in paginator.paginate(Bucket=bucket_name, Key=key, UploadId=upload_id):
+            parts.extend({"PartNumber": p["PartNumber"], "ETag": p["ETag"]} for p in page.get("Parts", []))
+    client.complete_multipart_upload(
+        Bucket=bucket_name, Key=key, UploadId=upload_id,
+        MultipartUpload={"Parts": sorted(parts, key=lambda part: part["PartNumber"])}
+    )
+
+
+def abort_multipart_upload(key: str, upload_id: str, bucket_name: str = None):
+    _abort(get_s3_client(), bucket_name or BUCKET_NAME, key, upload_id)
+
+
+def head_object(key: str, bucket_name: str = None):
+    """Object metadata (ContentLength, ContentType, ETag...), or None if missing"""
+    try:
+        return get_s3_client().head_object(Bucket=bucket_name or BUCKET_NAME, Key=key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+
+
+def delete_object(key: str, bucket_name: str = None):
+    get_s3_client().delete_object(Bucket=bucket_name or BUCKET_NAME, Key=key)
@@ -0,0 +1,178 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+from starlette.concurrency import run_in_threadpool
+
+SCRATCH_DIR = os.getenv("SCRATCH_DIR", os.path.join(tempfile.gettempdir(), "matterai_scratch"))
+# Total bytes this process may reserve for workspaces at once
+SCRATCH_QUOTA_BYTES = int(os.getenv("SCRATCH_QUOTA_BYTES", 5 * 1024 * 1024 * 1024))
+# How long a request waits for quota before being turned away
+SCRATCH_ACQUIRE_TIMEOUT_SECONDS = float(os.getenv("SCRATCH_ACQUIRE_TIMEOUT_SECONDS", 30))
+# Workspaces older than this are treated as leaked, even if their process is alive
+SCRATCH_ORPHAN_AGE_SECONDS = float(os.getenv("SCRATCH_ORPHAN_AGE_SECONDS", 6 * 3600))
+SCRATCH_JANITOR_INTERVAL_SECONDS = float(os.getenv("SCRATCH_JANITOR_INTERVAL_SECONDS", 300))
+
+
+class ScratchQuotaExceeded(Exception):
+    """Raised when no scratch space frees up within the acquire timeout"""
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Workspace:
+    """A private scratch directory holding `reserved` bytes of the quota"""
+
+    def __init__(self, space, path: str, reserved: int):
+        self.space = space
+        self.path = path
+        self.reserved = reserved
+        self.released = False
+
+    def file_path(self, name: str) -> str:
+        return os.path.join(self.path, os.path.basename(name))
+
+    async def release(self):
+        """Delete the directory and return its quota (safe to call twice)"""
+        if self.released:
+            return
+        self.released = True
+        await self.space._release(self)
+
+
+class ScratchSpace:
+    """
+    Per-request scratch directories under one root, with a byte quota.
+    Directories are named <pid>-<uuid>, so the janitor can tell which ones
+    were left behind by a process that has since died.
+    """
+
+    def __init__(self, root: str = SCRATCH_DIR, quota: int = SCRATCH_QUOTA_BYTES):
+        self.root = root
+        self.quota = quota
+        self.reserved = 0
+        self._active = {}
+        self._condition = asyncio.Condition()
+        self._janitor_task = None
+        self.waits = 0
+        self.rejections = 0
+        self.orphans_removed = 0
+        os.makedirs(root, exist_ok=True)
+
+    async def acquire(self, size_hint: int, timeout: float = SCRATCH_ACQUIRE_TIMEOUT_SECONDS) -> Workspace:
+        """
+        Reserve size_hint bytes and create a workspace, waiting up to timeout
+        for other requests to release space. A single request larger than the
+        whole quota still runs, but only once nothing else holds space.
+        """
+        size = max(int(size_hint), 0)
+        async with self._condition:
+            def has_room():
+                return self.reserved + size <= self.quota or self.reserved == 0
+
+            if not has_room():
+                self.waits += 1
+                try:
+                    await asyncio.wait_for(self._condition.wait_for(has_room), timeout)
+                except asyncio.TimeoutError:
+                    self.rejections += 1
+                    raise ScratchQuotaExceeded("Server is busy processing other files, try again shortly")
+            self.reserved += size
+
+        path = os.path.join(self.root, f"{os.getpid()}-{uuid.uuid4().hex}")
+        try:
+            await run_in_threadpool(os.makedirs, path)
+        except BaseException:
+            await self._return_quota(size)
+            raise
+        workspace = Workspace(self, path, size)
+        self._active[path] = workspace
+        return workspace
+
+    async def _return_quota(self, size: int):
+        async with self._condition:
+            self.reserved -= size
+            self._condition.notify_all()
+
+    async def _release(self, workspace: Workspace):
+        self._active.pop(workspace.path, None)
+        try:
+            await run_in_threadpool(shutil.rmtree, workspace.path, True)
+        finally:
+            await self._return_quota(workspace.reserved)
+
+    # ------------------------------------------------------------
+    #  Janitor
+    # ------------------------------------------------------------
+    def _sweep(self) -> int:
+        removed = 0
+        now = time.time()
+        own_pid = os.getpid()
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if path in self._active:
+                continue
+            pid_text = name.split("-", 1)[0]
+            try:
+                age = now - os.path.getmtime(path)
+            except OSError:
+                continue
+            owner_gone = pid_text.isdigit() and int(pid_text) != own_pid and not _pid_alive(int(pid_text))
+            # Our own inactive directories were released already or leaked
+            leaked = pid_text == str(own_pid) and age > 60
+            if owner_gone or leaked or age > SCRATCH_ORPHAN_AGE_SECONDS:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        return removed
+
+    async def sweep(self) -> int:
+        """Remove workspaces orphaned by crashed processes or leaked requests"""
+        removed = await run_in_threadpool(self._sweep)
+        self.orphans_removed += removed
+        if removed:
+            print(f"🧹 Removed {removed} orphaned scratch directories")
+        return removed
+
+    async def _janitor(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"⚠️ Scratch janitor failed: {e}")
+            await asyncio.sleep(SCRATCH_JANITOR_INTERVAL_SECONDS)
+
+    def start_janitor(self):
+        if self._janitor_task is None:
+            self._janitor_task = asyncio.ensure_future(self._janitor())
+
+    async def close(self):
+        if self._janitor_task is not None:
+            self._janitor_task.cancel()
+            self._janitor_task = None
+        for workspace in list(self._active.values()):
+            await workspace.release()
+
+    def stats(self) -> dict:
+        return {
+            "root": self.root,
+            "quota_bytes": self.quota,
+            "reserved_bytes": self.reserved,
+            "active_workspaces": len(self._active),
+            "waits": self.waits,
+            "rejections": self.rejections,
+            "orphans_removed": self.orphans_removed,
+        }
+
+
+scratch_space = ScratchSpace()
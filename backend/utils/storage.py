@@ -0,0 +1,508 @@
+import asyncio
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from starlette.concurrency import run_in_threadpool
+
+from utils.s3 import (
+    BUCKET_NAME, get_s3_client, run_s3, head_object, delete_object, presigned_get_url,
+    upload_file_to_s3, upload_file_content_to_s3
+)
+
+# "local" keeps files under STORAGE_LOCAL_ROOT; "s3" keeps them in AWS_S3_BUCKET
+# with a write-through local cache of up to STORAGE_CACHE_MAX_BYTES (0 disables it).
+# STORAGE_LOCAL_ROOT also holds upload temp and staging files. None of these
+# directories may be inside PUBLIC_UPLOAD_DIR, which is served at /static
+# without authentication; stored content is only served by /files/download.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+STORAGE_LOCAL_ROOT = os.getenv("STORAGE_LOCAL_ROOT", "storage")
+STORAGE_S3_PREFIX = os.getenv("STORAGE_S3_PREFIX", "")
+STORAGE_CACHE_DIR = os.getenv("STORAGE_CACHE_DIR", os.path.join("storage", ".cache"))
+STORAGE_CACHE_MAX_BYTES = int(os.getenv("STORAGE_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+# How often each process re-reads the cache directory to account for files
+# cached (or evicted) by the other workers sharing it
+STORAGE_CACHE_RESCAN_SECONDS = float(os.getenv("STORAGE_CACHE_RESCAN_SECONDS", 60))
+STORAGE_STREAM_CHUNK_SIZE = 1024 * 1024
+PUBLIC_UPLOAD_DIR = "uploads"
+# Where blobs, staging and the cache used to be kept, inside PUBLIC_UPLOAD_DIR
+LEGACY_PRIVATE_DIRS = {
+    os.path.join(PUBLIC_UPLOAD_DIR, "blobs"): os.path.join(STORAGE_LOCAL_ROOT, "blobs"),
+    os.path.join(PUBLIC_UPLOAD_DIR, ".resumable"): os.path.join(STORAGE_LOCAL_ROOT, ".resumable"),
+    os.path.join(PUBLIC_UPLOAD_DIR, ".storage_cache"): STORAGE_CACHE_DIR,
+}
+
+
+class StorageBackend:
+    """
+    Key/value file storage. Keys are relative, slash-separated paths. stat()
+    returns {"size", "modified", "etag"} or None when the key does not exist.
+    """
+
+    async def put(self, key: str, data: bytes, content_type: str = None):
+        raise NotImplementedError
+
+    async def put_file(self, key: str, source_path: str, content_type: str = None):
+        """Store a local file under key; source_path is consumed (moved or removed)"""
+        raise NotImplementedError
+
+    async def get(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    def stream(self, key: str, start: int = 0, end: int = None):
+        """Async iterator over bytes start..end (inclusive) of the object"""
+        raise NotImplementedError
+
+    async def read_range(self, key: str, start: int, end: int) -> bytes:
+        return b"".join([chunk async for chunk in self.stream(key, start, end)])
+
+    async def stat(self, key: str):
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    async def local_path(self, key: str):
+        """A path on local disk holding the object (fetching it if needed), or None"""
+        raise NotImplementedError
+
+    @asynccontextmanager
+    async def pinned_path(self, key: str):
+        """local_path(key), kept on local disk until the block exits"""
+        yield await self.local_path(key)
+
+    async def download_file(self, key: str, target_path: str):
+        """Write the object to a local file"""
+        handle = await run_in_threadpool(open, target_path, "wb")
+        try:
+            async for data in self.stream(key):
+                await run_in_threadpool(handle.write, data)
+        finally:
+            await run_in_threadpool(handle.close)
+
+    async def download_url(self, key: str, filename: str = None, content_type: str = None):
+        """A short-lived URL clients can download the object from directly, or None"""
+        return None
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__}
+
+
+# ============================================================
+#  LOCAL FILESYSTEM
+# ============================================================
+class LocalStorage(StorageBackend):
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, key))
+        if os.path.isabs(key) or not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"Invalid storage key: {key!r}")
+        return path
+
+    def _write(self, key: str, data: bytes):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as handle:
+            handle.write(data)
+        os.replace(tmp_path, path)
+
+    def _move_in(self, key: str, source_path: str):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.replace(source_path, path)
+        except OSError:
+            # Different filesystem
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            shutil.move(source_path, tmp_path)
+            os.replace(tmp_path, path)
+
+    def _read(self, key: str) -> bytes:
+        with open(self.path(key), "rb") as handle:
+            return handle.read()
+
+    def _stat(self, key: str):
+        try:
+            stat_result = os.stat(self.path(key))
+        except FileNotFoundError:
+            return None
+        return {
+            "size": stat_result.st_size,
+            "modified": stat_result.st_mtime,
+            "etag": f"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}",
+        }
+
+    def _delete(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    async def put(self, key: str, data: bytes, content_type: str = None):
+        await run_in_threadpool(self._write, key, data)
+
+    async def put_file(self, key: str, source_path: str, content_type: str = None):
+        await run_in_threadpool(self._move_in, key, source_path)
+
+    async def get(self, key: str) -> bytes:
+        return await run_in_threadpool(self._read, key)
+
+    async def stream(self, key: str, start: int = 0, end: int = None):
+        handle = await run_in_threadpool(open, self.path(key), "rb")
+        try:
+            await run_in_threadpool(handle.seek, start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                size = STORAGE_STREAM_CHUNK_SIZE if remaining is None else min(STORAGE_STREAM_CHUNK_SIZE, remaining)
+                data = await run_in_threadpool(handle.read, size)
+                if not data:
+                    break
+                if remaining is not None:
+                    remaining -= len(data)
+                yield data
+        finally:
+            await run_in_threadpool(handle.close)
+
+    async def stat(self, key: str):
+        return await run_in_threadpool(self._stat, key)
+
+    async def delete(self, key: str):
+        await run_in_threadpool(self._delete, key)
+
+    async def local_path(self, key: str):
+        path = self.path(key)
+        return path if await run_in_threadpool(os.path.exists, path) else None
+
+    def stats(self) -> dict:
+        return {"backend": "local", "root": self.root}
+
+
+# ============================================================
+#  S3
+# ============================================================
+class S3Storage(StorageBackend):
+    def __init__(self, bucket_name: str = None, prefix: str = ""):
+        self.bucket_name = bucket_name or BUCKET_NAME
+        self.prefix = prefix.strip("/")
+
+    def object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _read(self, key: str, byte_range: str = None):
+        extra = {"Range": byte_range} if byte_range else {}
+        return get_s3_client().get_object(Bucket=self.bucket_name, Key=self.object_key(key), **extra)["Body"]
+
+    async def upload_file(self, key: str, source_path: str, content_type: str = None):
+        """Store a copy of a local file, leaving source_path in place"""
+        await run_s3(upload_file_to_s3, source_path, self.object_key(key), self.bucket_name, content_type)
+
+    async def download_file(self, key: str, target_path: str):
+        # Parallel ranged GETs for large objects
+        await run_s3(get_s3_client().download_file, self.bucket_name, self.object_key(key), target_path)
+
+    async def put(self, key: str, data: bytes, content_type: str = None):
+        await run_s3(upload_file_content_to_s3, data, self.object_key(key), self.bucket_name, content_type)
+
+    async def put_file(self, key: str, source_path: str, content_type: str = None):
+        await self.upload_file(key, source_path, content_type)
+        await run_in_threadpool(os.remove, source_path)
+
+    async def get(self, key: str) -> bytes:
+        body = await run_s3(self._read, key)
+        try:
+            return await run_s3(body.read)
+        finally:
+            body.close()
+
+    async def stream(self, key: str, start: int = 0, end: int = None):
+        byte_range = None
+        if start or end is not None:
+            byte_range = f"bytes={start}-{'' if end is None else end}"
+        body = await run_s3(self._read, key, byte_range)
+        try:
+            while True:
+                data = await run_s3(body.read, STORAGE_STREAM_CHUNK_SIZE)
+                if not data:
+                    break
+                yield data
+        finally:
+            body.close()
+
+    async def stat(self, key: str):
+        response = await run_s3(head_object, self.object_key(key), self.bucket_name)
+        if response is None:
+            return None
+        return {
+            "size": response["ContentLength"],
+            "modified": response["LastModified"].timestamp(),
+            "etag": response["ETag"].strip('"'),
+        }
+
+    async def delete(self, key: str):
+        await run_s3(delete_object, self.object_key(key), self.bucket_name)
+
+    async def local_path(self, key: str):
+        return None
+
+    async def download_url(self, key: str, filename: str = None, content_type: str = None):
+        return await run_s3(presigned_get_url, self.object_key(key), filename, content_type, self.bucket_name)
+
+    def stats(self) -> dict:
+        return {"backend": "s3", "bucket": self.bucket_name, "prefix": self.prefix}
+
+
+# ============================================================
+#  TIERED (S3 with a write-through local hot cache)
+# ============================================================
+class TieredStorage(StorageBackend):
+    """
+    Writes go to S3 and the local cache; reads are served from the cache,
+    fetching the object from S3 on a miss. The cache is bounded to max_bytes,
+    evicting the least recently used files first, so hot documents stay on
+    local disk and cold ones only live in the bucket. Files held through
+    pinned_path() are never evicted by this process.
+
+    Every uvicorn worker keeps its own index of the shared cache directory.
+    Hits update a file's access time and each index is rebuilt from disk every
+    STORAGE_CACHE_RESCAN_SECONDS, so all workers evict by the same recency
+    against the directory's real size; between rescans the cache can exceed
+    max_bytes by what the other workers have added since. Another worker may
+    evict a file this one is about to serve, but never one it already has
+    open (eviction only unlinks).
+    """
+
+    def __init__(self, remote: S3Storage, cache_dir: str, max_bytes: int):
+        self.remote = remote
+        self.cache = LocalStorage(cache_dir)
+        self.max_bytes = max_bytes
+        self._index = None  # OrderedDict path -> size, least recently used first
+        self._indexed_at = 0.0
+        self._bytes = 0
+        self._pins = {}  # path -> number of pinned_path() blocks holding it
+        self._lock = threading.Lock()
+        self._fetches = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # ------------------------------------------------------------
+    #  Cache index (guarded by _lock, run in the thread pool)
+    # ------------------------------------------------------------
+    def _load_index(self):
+        """(Re)build the LRU index from disk, oldest access first, when it is stale"""
+        if self._index is not None and time.monotonic() - self._indexed_at < STORAGE_CACHE_RESCAN_SECONDS:
+            return
+        entries = []
+        for root, _, names in os.walk(self.cache.root):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat_result = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat_result.st_atime, path, stat_result.st_size))
+        entries.sort()
+        self._index = OrderedDict((path, size) for _, path, size in entries)
+        self._indexed_at = time.monotonic()
+        self._bytes = sum(size for _, _, size in entries)
+
+    def _admit(self, path: str):
+        size = os.path.getsize(path)
+        with self._lock:
+            self._load_index()
+            self._bytes += size - self._index.pop(path, 0)
+            self._index[path] = size
+            if self._bytes <= self.max_bytes:
+                return
+            # Oldest first, never the entry just admitted or a pinned one
+            victims = []
+            excess = self._bytes - self.max_bytes
+            for old_path, old_size in self._index.items():
+                if excess <= 0:
+                    break
+                if old_path == path or self._pins.get(old_path):
+                    continue
+                victims.append(old_path)
+                excess -= old_size
+            for old_path in victims:
+                self._bytes -= self._index.pop(old_path)
+                self.evictions += 1
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+
+    def _touch(self, path: str) -> bool:
+        with self._lock:
+            self._load_index()
+            if not os.path.exists(path):
+                size = self._index.pop(path, None)
+                if size is not None:
+                    self._bytes -= size
+                return False
+            if path not in self._index:
+                self._index[path] = os.path.getsize(path)
+                self._bytes += self._index[path]
+            self._index.move_to_end(path)
+        # Recency for the other workers' rescans (atime alone is often not updated)
+        try:
+            os.utime(path, (time.time(), os.stat(path).st_mtime))
+        except OSError:
+            pass
+        return True
+
+    def _pin(self, path: str):
+        with self._lock:
+            self._pins[path] = self._pins.get(path, 0) + 1
+
+    def _unpin(self, path: str):
+        with self._lock:
+            if self._pins[path] > 1:
+                self._pins[path] -= 1
+            else:
+                del self._pins[path]
+
+    def _forget(self, path: str):
+        with self._lock:
+            self._load_index()
+            size = self._index.pop(path, None)
+            if size is not None:
+                self._bytes -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    # ------------------------------------------------------------
+    #  StorageBackend
+    # ------------------------------------------------------------
+    async def put(self, key: str, data: bytes, content_type: str = None):
+        await self.remote.put(key, data, content_type)
+        await self.cache.put(key, data)
+        await run_in_threadpool(self._admit, self.cache.path(key))
+
+    async def put_file(self, key: str, source_path: str, content_type: str = None):
+        await self.remote.upload_file(key, source_path, content_type)
+        await self.cache.put_file(key, source_path)
+        await run_in_threadpool(self._admit, self.cache.path(key))
+
+    async def _fetch(self, key: str, path: str):
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        await run_in_threadpool(os.makedirs, os.path.dirname(path), exist_ok=True)
+        try:
+            await self.remote.download_file(key, tmp_path)
+            await run_in_threadpool(os.replace, tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        await run_in_threadpool(self._admit, path)
+
+    async def local_path(self, key: str):
+        path = self.cache.path(key)
+        if await run_in_threadpool(self._touch, path):
+            self.hits += 1
+            return path
+
+        if await self.remote.stat(key) is None:
+            return None
+        self.misses += 1
+        # Concurrent readers of the same key share one download
+        fetch = self._fetches.get(key)
+        if fetch is None:
+            fetch = asyncio.ensure_future(self._fetch(key, path))
+            self._fetches[key] = fetch
+            fetch.add_done_callback(lambda _: self._fetches.pop(key, None))
+        await asyncio.shield(fetch)
+        return path
+
+    @asynccontextmanager
+    async def pinned_path(self, key: str):
+        path = self.cache.path(key)
+        await run_in_threadpool(self._pin, path)
+        try:
+            yield await self.local_path(key)
+        finally:
+            await run_in_threadpool(self._unpin, path)
+
+    async def get(self, key: str) -> bytes:
+        async with self.pinned_path(key) as path:
+            if path is None:
+                raise FileNotFoundError(key)
+            return await self.cache.get(key)
+
+    async def stream(self, key: str, start: int = 0, end: int = None):
+        async with self.pinned_path(key) as path:
+            if path is None:
+                raise FileNotFoundError(key)
+            async for data in self.cache.stream(key, start, end):
+                yield data
+
+    async def stat(self, key: str):
+        return await self.remote.stat(key)
+
+    async def delete(self, key: str):
+        await self.remote.delete(key)
+        await run_in_threadpool(self._forget, self.cache.path(key))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            **self.remote.stats(),
+            "cache_dir": self.cache.root,
+            "cache_entries": len(self._index) if self._index is not None else None,
+            "cache_bytes": self._bytes,
+            "cache_max_bytes": self.max_bytes,
+            "cache_pinned": len(self._pins),
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+            "cache_hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "cache_evictions": self.evictions,
+        }
+
+
+def move_legacy_private_dirs():
+    """
+    Move blobs, staging and cache directories created by older versions out of
+    PUBLIC_UPLOAD_DIR (once; a no-op when they are gone or already moved)
+    """
+    for old_path, new_path in LEGACY_PRIVATE_DIRS.items():
+        if not os.path.isdir(old_path) or os.path.abspath(old_path) == os.path.abspath(new_path):
+            continue
+        try:
+            if os.path.isdir(new_path):
+                os.rmdir(new_path)  # only replaces an empty directory
+            os.makedirs(os.path.dirname(os.path.abspath(new_path)), exist_ok=True)
+            shutil.move(old_path, new_path)
+            print(f"📦 Moved {old_path} to {new_path}")
+        except OSError as e:
+            print(f"⚠️ Could not move {old_path} to {new_path}: {e}")
+    # Upload temp files of the old layout are never picked up again
+    shutil.rmtree(os.path.join(STORAGE_LOCAL_ROOT, "blobs", "tmp"), ignore_errors=True)
+
+
+def create_storage(backend: str = STORAGE_BACKEND) -> StorageBackend:
+    if backend == "local":
+        return LocalStorage(STORAGE_LOCAL_ROOT)
+    if backend == "s3":
+        remote = S3Storage(prefix=STORAGE_S3_PREFIX)
+        if STORAGE_CACHE_MAX_BYTES <= 0:
+            return remote
+        return TieredStorage(remote, STORAGE_CACHE_DIR, STORAGE_CACHE_MAX_BYTES)
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend!r}")
+
+
+move_legacy_private_dirs()
+storage = create_storage()
@@ -0,0 +1,85 @@
+# Text extraction for search indexing. Runs in worker processes (see
+# document_ingest.py), so this module only imports what extraction needs.
+
+import re
+
+# Bump when extraction output changes, so cached text is re-extracted
+EXTRACTOR_VERSION = "1"
+SUPPORTED_EXTENSIONS = {".pdf", ".docx", ".txt"}
+
+_BLANK_LINES = re.compile(r"\n\s*\n")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def decode_text(data: bytes) -> str:
+    """Decode a plain-text file: UTF-8 (with or without BOM), UTF-16 with BOM, else cp1252"""
+    if data.startswith((b"\xff\xfe", b"\xfe\xff")):
+        return data.decode("utf-16", errors="replace")
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return data.decode("cp1252", errors="replace")
+
+
+def extract_pdf(path: str) -> str:
+    try:
+        import pymupdf
+    except ImportError:  # PyMuPDF < 1.24
+        import fitz as pymupdf
+
+    with pymupdf.open(path) as document:
+        return "\n\n".join(page.get_text("text") for page in document)
+
+
+def extract_docx(path: str) -> str:
+    import docx  # python-docx
+
+    document = docx.Document(path)
+    parts = [paragraph.text for paragraph in document.paragraphs]
+    for table in document.tables:
+        for row in table.rows:
+            parts.append(" | ".join(cell.text for cell in row.cells))
+    return "\n\n".join(parts)
+
+
+def extract_text(path: str, extension: str, max_chars: int = None) -> str:
+    """Plain text of a PDF, DOCX or TXT file, truncated to max_chars"""
+    extension = extension.lower()
+    if extension == ".pdf":
+        text = extract_pdf(path)
+    elif extension == ".docx":
+        text = extract_docx(path)
+    elif extension == ".txt":
+        with open(path, "rb") as handle:
+            text = decode_text(handle.read() if max_chars is None else handle.read(max_chars * 4))
+    else:
+        raise ValueError(f"Unsupported document type: {extension}")
+    # Postgres text cannot hold NUL characters
+    text = text.replace("\x00", "")
+    return text if max_chars is None else text[:max_chars]
+
+
+def chunk_text(text: str, chunk_chars: int) -> list:
+    """
+    Split text into chunks of at most chunk_chars, packing whole paragraphs
+    together and cutting longer paragraphs at word boundaries
+    """
+    chunks = []
+    current = ""
+    for paragraph in _BLANK_LINES.split(text):
+        paragraph = _WHITESPACE.sub(" ", paragraph).strip()
+        if not paragraph:
+            continue
+        if current and len(current) + 2 + len(paragraph) > chunk_chars:
+            chunks.append(current)
+            current = ""
+        while len(paragraph) > chunk_chars:
+            cut = paragraph.rfind(" ", 0, chunk_chars)
+            if cut < chunk_chars // 2:
+                cut = chunk_chars
+            chunks.append(paragraph[:cut].rstrip())
+            paragraph = paragraph[cut:].lstrip()
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
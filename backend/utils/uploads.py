@@ -0,0 +1,131 @@
+import os
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+# Bytes held in memory per upload while copying it to disk
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds its size limit"""
+
+
+def _write_chunk(out, chunk: bytes, on_chunk):
+    if on_chunk is not None:
+        on_chunk(chunk)
+    out.write(chunk)
+
+
+async def save_upload_file(upload: UploadFile, file_path: str, max_size: int,
+                           chunk_size: int = UPLOAD_CHUNK_SIZE, on_chunk=None) -> int:
+    """
+    Stream an UploadFile to file_path in chunks, enforcing max_size as it goes.
+    Disk writes run in the thread pool so the event loop never blocks.
+    on_chunk(bytes) is called for every chunk, in the thread pool alongside
+    the write (e.g. to hash the content).
+    Returns the number of bytes written; removes the partial file on failure.
+    """
+    # Starlette records the size once the multipart body is parsed
+    if upload.size is not None and upload.size > max_size:
+        raise UploadTooLarge(f"File exceeds the maximum size of {max_size} bytes")
+
+    size = 0
+    out = await run_in_threadpool(open, file_path, "wb")
+    try:
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_size:
+                raise UploadTooLarge(f"File exceeds the maximum size of {max_size} bytes")
+            await run_in_threadpool(_write_chunk, out, chunk, on_chunk)
+    except BaseException:
+        await run_in_threadpool(out.close)
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+        raise
+    await run_in_threadpool(out.close)
+    return size
+
+
+class MaxBodySizeMiddleware:
+    """
+    Reject request bodies larger than a per-path-prefix limit before they are
+    parsed: immediately (413) when Content-Length is too large, or as soon as
+    the streamed body crosses the limit.
+
+        app.add_middleware(MaxBodySizeMiddleware, limits={"/files/upload": 60 * 1024 * 1024})
+    """
+
+    def __init__(self, app, limits: dict):
+        self.app = app
+        # Longest prefix first so specific paths win
+        self.limits = sorted(limits.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def _limit_for(self, path: str):
+        for prefix, limit in self.limits:
+            if path.startswith(prefix):
+                return limit
+        return None
+
+    async def _reject(self, send):
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"connection", b"close")],
+        })
+        await send({"type": "http.response.body", "body": b'{"detail":"Request body too large"}'})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        limit = self._limit_for(scope["path"])
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    if int(value) > limit:
+                        return await self._reject(send)
+                except ValueError:
+                    pass
+                break
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise UploadTooLarge(f"Request body exceeds {limit} bytes")
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if exceeded:
+                # The framework may turn the aborted body into its own error
+                # response; answer 413 instead
+                if message["type"] == "http.response.start" and not response_started:
+                    response_started = True
+                    await self._reject(send)
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLarge:
+            if not response_started:
+                await self._reject(send)
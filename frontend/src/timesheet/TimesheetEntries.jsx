@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import { motion } from "framer-motion";
 import {
   Calendar,
@@ -32,15 +32,25 @@ const TimesheetEntries = ({ onClose }) => {
     date_to: "",
   });
   const [showFilters, setShowFilters] = useState(false);
+  // Cursor that loads each page (page 1 starts without one)
+  const pageCursors = useRef({ 1: null });
 
   const loadEntries = async (page = 1, currentFilters = filters) => {
     try {
       setLoading(true);
       setError(null);
 
+      if (page === 1) {
+        pageCursors.current = { 1: null };
+      }
+      const cursor = pageCursors.current[page];
+
       const queryFilters = {
         page,
         page_size: pageSize,
+        cursor,
+        // The total only needs to be counted when starting from the first page
+        include_total: page === 1,
         ...Object.fromEntries(
           Object.entries(currentFilters).filter(
             ([_, value]) => value && value.trim() !== ""
@@ -53,7 +63,10 @@ const TimesheetEntries = ({ onClose }) => {
 
       if (response.success) {
         setEntries(response.entries || []);
-        setTotalCount(response.total_count || 0);
+        if (response.total_count !== null && response.total_count !== undefined) {
+          setTotalCount(response.total_count);
+        }
+        pageCursors.current[page + 1] = response.next_cursor || null;
         setCurrentPage(page);
         console.log(
           `Loaded ${response.entries?.length || 0} timesheet entries`